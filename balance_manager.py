@@ -1,22 +1,63 @@
-import copy
+import json
+import os
+from types import MappingProxyType
+
+# Data file info
+DATA_DIR = './data'
+DATA_FILE = 'balances'
+DATA_FILE_PATH = DATA_DIR + '/' + DATA_FILE
+
+# Save a snapshot of the balances each time the chain reaches a multiple of this many blocks
+SNAPSHOT_INTERVAL = 100
+# Number of most recent snapshots kept (older ones remain usable if the chain is replaced after the newest)
+SNAPSHOTS_KEPT = 3
 
 
 class BalanceManager:
-    def __init__(self):
+    def __init__(self, node_id=None, snapshot_interval=SNAPSHOT_INTERVAL, ledger=None):
         # Dictionary of transaction participants -> their confirmed balance
         self.__balances = {}
+        # Optional columnar ledger (see ledger.py) kept up to date with the same blocks as the balances
+        self.__ledger = ledger
+        # Snapshots are only saved and loaded when there is a node id to name them after
+        self.__node_id = node_id
+        self.__snapshot_interval = snapshot_interval
 
     @property
     def balances(self):
-        return copy.deepcopy(self.__balances)
+        # A read-only view rather than a (deep) copy of the whole dictionary
+        return MappingProxyType(self.__balances)
+
+    @property
+    def ledger(self):
+        return self.__ledger
 
     def initialize_balances(self, block_chain):
         print('Initialising balances...')
         self.__balances = {}
-        for block in block_chain:
-            self.update_balances_for_block(block)
+        # Start from the latest snapshot that matches the chain and only replay the blocks after it
+        start_height = self.__load_latest_snapshot(block_chain)
+        if self.__ledger is not None:
+            # The ledger holds every transaction, so it is rebuilt from the start of the chain
+            self.__ledger.clear()
+            for block_idx in range(start_height):
+                self.__ledger.append_block(block_chain[block_idx])
+        # Only snapshot the last interval boundary replayed, rather than every boundary along the way
+        last_snapshot_height = len(block_chain) - len(block_chain) % self.__snapshot_interval
+        for block_idx in range(start_height, len(block_chain)):
+            block = block_chain[block_idx]
+            self.__apply_block(block)
+            if self.__node_id is not None and block_idx + 1 == last_snapshot_height:
+                self.__save_snapshot(last_snapshot_height, block.hash)
 
     def update_balances_for_block(self, block):
+        self.__apply_block(block)
+        if self.__node_id is not None and (block.idx + 1) % self.__snapshot_interval == 0:
+            self.__save_snapshot(block.idx + 1, block.hash)
+
+    def __apply_block(self, block):
+        if self.__ledger is not None:
+            self.__ledger.append_block(block)
         for txn in block.txns:
             txn_sender = txn.sender
             txn_recipient = txn.recipient
@@ -34,3 +75,61 @@ class BalanceManager:
     def display_balances(self):
         for participant in self.participants():
             print('* {:15} has a balance of {:>15.2f}'.format(participant, self.get_balance(participant)))
+
+    def __snapshot_file_path(self, height):
+        return '{}_{}_{}'.format(DATA_FILE_PATH, self.__node_id, height)
+
+    def __snapshot_heights(self):
+        # Heights of the saved snapshots, newest first
+        prefix = '{}_{}_'.format(DATA_FILE, self.__node_id)
+        if not os.path.exists(DATA_DIR):
+            return []
+        return sorted([int(file_name[len(prefix):]) for file_name in os.listdir(DATA_DIR)
+                       if file_name.startswith(prefix) and file_name[len(prefix):].isdigit()], reverse=True)
+
+    def __save_snapshot(self, height, block_hash):
+        """
+        Save the current balances, tagged with the chain height and hash of the last block they include
+
+        :param height: the number of blocks the balances include
+        :param block_hash: the hash of the last of those blocks
+        """
+        snapshot = {'height': height, 'hash': block_hash, 'balances': self.__balances}
+        try:
+            # Write to a temporary file first, so a crash can't leave a partially written snapshot
+            tmp_file_path = self.__snapshot_file_path(height) + '.tmp'
+            with open(tmp_file_path, mode='w') as f:
+                f.write(json.dumps(snapshot))
+            os.replace(tmp_file_path, self.__snapshot_file_path(height))
+
+            for old_height in self.__snapshot_heights()[SNAPSHOTS_KEPT:]:
+                os.remove(self.__snapshot_file_path(old_height))
+        except IOError:
+            print('WARN: Failed to save balance snapshot')
+
+    def __load_latest_snapshot(self, block_chain):
+        """
+        Load the most recent snapshot whose block hash matches the block chain
+
+        :param block_chain: the block chain the balances are for
+        :return: the number of blocks included in the loaded balances (0 if no snapshot was loaded)
+        """
+        if self.__node_id is None:
+            return 0
+
+        for height in self.__snapshot_heights():
+            if height > len(block_chain):
+                continue
+            try:
+                with open(self.__snapshot_file_path(height), mode='r') as f:
+                    snapshot = json.loads(f.read())
+            except (IOError, ValueError):
+                print('WARN: Ignoring unreadable balance snapshot at height {}'.format(height))
+                continue
+
+            # The snapshot is only valid if the chain still holds the block it was taken at
+            if snapshot['hash'] == block_chain[height - 1].hash:
+                self.__balances = snapshot['balances']
+                return height
+
+        return 0
@@ -0,0 +1,118 @@
+""" Generates synthetic blocks and transactions for benchmarking """
+import binascii
+from block import Block
+from blockchain import MINING_REWARD, MINING_SENDER
+import os
+import random
+from transaction import Transaction
+from utility.verification import Verification
+from wallet import Wallet
+
+# Hex lengths of a 1024 bit DER public key and its PKCS1 v1.5 signature
+PUBLIC_KEY_HEX_LEN = 324
+SIGNATURE_HEX_LEN = 256
+
+
+def random_hex(length):
+    return binascii.hexlify(os.urandom(length // 2)).decode('ascii')
+
+
+def synthetic_txns(count):
+    # Hashing doesn't depend on the signatures being valid, so random hex of a realistic size will do
+    return [Transaction(
+        random_hex(PUBLIC_KEY_HEX_LEN), random_hex(PUBLIC_KEY_HEX_LEN), 1.0, random_hex(SIGNATURE_HEX_LEN))
+            for _ in range(count)]
+
+
+def create_wallets(count):
+    # Generating RSA keys takes tens of milliseconds, so keep the number of wallets modest
+    wallets = []
+    for wallet_idx in range(count):
+        wallet = Wallet('benchmark_{}'.format(wallet_idx))
+        wallet.create_keys()
+        wallets.append(wallet)
+    return wallets
+
+
+def signed_txns(wallets, count, balances):
+    """
+    Generate payments between wallets, each signed by its sender.
+
+    A sender is only picked if its balance covers the payment, and funds received aren't spent
+    until the next call, so the payments are valid together in one block (or mempool).
+
+    :param wallets: the wallets to pick senders and recipients from
+    :param count: the number of payments to generate
+    :param balances: dictionary of public key -> balance, updated by the payments
+    :return: a list of transactions (fewer than count if the wallets run out of funds)
+    """
+    txns = []
+    received = {}
+    for _ in range(count):
+        # Unrounded amounts keep signatures (which only cover sender, recipient and amount) distinct
+        amount = random.uniform(0.01, 1.0)
+        senders = [wallet for wallet in wallets if balances.get(wallet.public_key, 0.0) >= amount]
+        if len(senders) == 0:
+            break
+        sender = random.choice(senders)
+        recipient = random.choice([wallet for wallet in wallets if wallet is not sender] or wallets)
+        signature = sender.sign_txn(sender.public_key, recipient.public_key, amount)
+        txns.append(Transaction(sender.public_key, recipient.public_key, amount, signature))
+        balances[sender.public_key] -= amount
+        received[recipient.public_key] = received.get(recipient.public_key, 0.0) + amount
+
+    for participant, amount in received.items():
+        balances[participant] = balances.get(participant, 0.0) + amount
+    return txns
+
+
+def generate_mempool(wallets, count, balances):
+    """
+    Generate open transactions that the senders' confirmed balances can cover.
+
+    :param wallets: the wallets to pick senders and recipients from
+    :param count: the number of transactions to generate
+    :param balances: dictionary (or read-only view) of public key -> confirmed balance
+    :return: a list of signed transactions
+    """
+    return signed_txns(wallets, count, dict(balances))
+
+
+def generate_chain(block_count, txns_per_block=1, char_count=3, wallets=None):
+    """
+    Generate a valid chain of blocks, each with a proof of work and a mining reward transaction.
+
+    Verifying a block costs the same whatever the difficulty, so benchmarks of long chains can
+    use a lower char_count (and verify with the same char_count) to keep generation quick.
+
+    :param block_count: the number of blocks to generate
+    :param txns_per_block: the number of transactions (excluding the reward) in each block
+    :param char_count: the proof of work difficulty
+    :param wallets: if given, the transactions are real signed payments between these wallets, which
+                    also earn the mining rewards (the first blocks have fewer payments, until they have funds)
+    :return: a list of blocks
+    """
+    chain = []
+    prev_hash = ''
+    balances = {}
+    for idx in range(block_count):
+        if wallets is None:
+            txns = synthetic_txns(txns_per_block)
+        else:
+            txns = signed_txns(wallets, txns_per_block, balances)
+        prefix_hash = Verification.pow_prefix(txns, prev_hash)
+        proof = 0
+        while not Verification.is_pow_valid_for_prefix(prefix_hash, proof, char_count=char_count):
+            proof += 1
+
+        if wallets is None:
+            miner = random_hex(PUBLIC_KEY_HEX_LEN)
+        else:
+            miner = random.choice(wallets).public_key
+            balances[miner] = balances.get(miner, 0.0) + MINING_REWARD
+        reward_txn = Transaction(MINING_SENDER, miner, MINING_REWARD, '')
+        block = Block(idx, prev_hash, txns + [reward_txn], proof)
+        chain.append(block)
+        prev_hash = block.hash
+
+    return chain
@@ -0,0 +1,55 @@
+""" Compares serial and parallel full chain verification """
+from block import Block
+import sys
+from time import perf_counter
+from benchmark.chain_generator import generate_chain
+from utility.pow_util import default_worker_count
+from utility.verification import Verification
+
+# Chain lengths to benchmark
+BLOCK_COUNTS = [10000, 100000]
+# A low difficulty keeps chain generation quick (verification costs the same whatever the difficulty)
+CHAR_COUNT = 1
+
+
+def timed(func):
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+
+def run(workers):
+    print('Parallel verification uses {} worker(s)'.format(workers))
+    print('{:>8} {:>12} {:>12} {:>8}'.format('blocks', 'serial (s)', 'parallel (s)', 'speedup'))
+    for block_count in BLOCK_COUNTS:
+        chain = generate_chain(block_count, char_count=CHAR_COUNT)
+        # Start from fresh blocks each time, so no run benefits from hashes cached by another
+        serial_chain = [Block.from_dict(block.to_dict()) for block in chain]
+        parallel_chain = [Block.from_dict(block.to_dict()) for block in chain]
+
+        serial_valid, serial_time = timed(
+            lambda: Verification.is_block_chain_valid(serial_chain, char_count=CHAR_COUNT))
+        parallel_valid, parallel_time = timed(
+            lambda: Verification.is_block_chain_valid(parallel_chain, char_count=CHAR_COUNT, workers=workers))
+        if not (serial_valid and parallel_valid):
+            raise RuntimeError('Generated chain of {} blocks failed verification (serial: {}, parallel: {})'.format(
+                block_count, serial_valid, parallel_valid))
+
+        print('{:>8} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+            block_count, serial_time, parallel_time, serial_time / parallel_time))
+        sys.stdout.flush()
+
+        # Both must report the same failing block (the last invalid one, as the serial check works backwards)
+        for broken_idx in [block_count // 3, 2 * block_count // 3]:
+            chain[broken_idx].proof = 'broken'
+        serial_chain = [Block.from_dict(block.to_dict()) for block in chain]
+        parallel_chain = [Block.from_dict(block.to_dict()) for block in chain]
+        serial_invalid = Verification.find_invalid_block(serial_chain, 0, block_count, CHAR_COUNT)
+        parallel_invalid = Verification.find_invalid_block(parallel_chain, 0, block_count, CHAR_COUNT, workers)
+        if serial_invalid != parallel_invalid:
+            raise RuntimeError('Serial verification found block {} invalid, but parallel found block {}'.format(
+                serial_invalid, parallel_invalid))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else default_worker_count())
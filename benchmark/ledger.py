@@ -0,0 +1,78 @@
+""" Compares balance queries on the columnar ledger with the dictionary replay of BalanceManager """
+from balance_manager import BalanceManager
+from block import Block
+import ledger
+import random
+import sys
+from time import perf_counter
+from benchmark.chain_generator import PUBLIC_KEY_HEX_LEN, random_hex
+from transaction import Transaction
+
+# Chain sizes (number of blocks) to benchmark
+BLOCK_COUNTS = [1000, 10000]
+TXNS_PER_BLOCK = 100
+# Number of distinct participants the transactions are between
+PARTICIPANT_COUNT = 1000
+TOP_COUNT = 10
+
+
+def synthetic_chain(block_count, keys):
+    # Balances don't depend on signatures or proofs, so neither are generated
+    return [Block(idx, '', [Transaction(random.choice(keys), random.choice(keys), random.uniform(0.01, 10.0), '')
+                            for _ in range(TXNS_PER_BLOCK)], 0)
+            for idx in range(block_count)]
+
+
+def timed(func):
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+
+def replay_balances(chain):
+    balance_manager = BalanceManager()
+    balance_manager.initialize_balances(chain)
+    return balance_manager.balances
+
+
+def run():
+    if not ledger.is_available():
+        print('NumPy is not installed, so there is no columnar ledger to benchmark')
+        return
+
+    keys = [random_hex(PUBLIC_KEY_HEX_LEN) for _ in range(PARTICIPANT_COUNT)]
+    print('{:>8} {:>24} {:>12} {:>12} {:>8}'.format('blocks', 'query', 'replay (s)', 'ledger (s)', 'speedup'))
+    for block_count in BLOCK_COUNTS:
+        chain = synthetic_chain(block_count, keys)
+        columnar_ledger = ledger.ColumnarLedger()
+        _, build_time = timed(lambda: [columnar_ledger.append_block(block) for block in chain])
+
+        # All balances: replaying every block vs summing the ledger's columns
+        replayed, replay_time = timed(lambda: replay_balances(chain))
+        vectorized, ledger_time = timed(lambda: columnar_ledger.balances())
+        if not all(abs(vectorized[participant] - balance) < 1e-6 for participant, balance in replayed.items()):
+            raise RuntimeError('Ledger balances of {} blocks differ from the replayed balances'.format(block_count))
+        print_row(block_count, 'all balances', replay_time, ledger_time)
+
+        # Balances as of half way along the chain
+        height = block_count // 2
+        _, replay_time = timed(lambda: replay_balances(chain[:height]))
+        _, ledger_time = timed(lambda: columnar_ledger.balances(height))
+        print_row(block_count, 'balances as of height', replay_time, ledger_time)
+
+        # Top participants by balance (the replay has to sort every balance)
+        _, replay_time = timed(
+            lambda: sorted(replay_balances(chain).items(), key=lambda item: item[1], reverse=True)[:TOP_COUNT])
+        _, ledger_time = timed(lambda: columnar_ledger.top(TOP_COUNT))
+        print_row(block_count, 'top {} by balance'.format(TOP_COUNT), replay_time, ledger_time)
+        print('{:>8} {:>24} {:>12} {:>12.3f}'.format(block_count, 'ledger build', '', build_time))
+        sys.stdout.flush()
+
+
+def print_row(block_count, query, replay_time, ledger_time):
+    print('{:>8} {:>24} {:>12.3f} {:>12.3f} {:>7.0f}x'.format(
+        block_count, query, replay_time, ledger_time, replay_time / ledger_time))
+
+
+if __name__ == '__main__':
+    run()
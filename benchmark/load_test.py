@@ -0,0 +1,300 @@
+""" Drives the node's HTTP API with concurrent readers and writers, then checks the node's state is still consistent """
+import argparse
+from balance_manager import BalanceManager
+from block import Block
+from blockchain import BlockChain
+import itertools
+import logging
+from mining_jobs import MINED, MiningJobs, RUNNING
+import multiprocessing
+import node
+import os
+import requests
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+from transaction import Transaction
+from benchmark.chain_generator import create_wallets, generate_chain
+from utility.verification import Verification
+from wallet import Wallet
+from werkzeug.serving import make_server
+
+# Default size of the synthetic chain the node starts with (each can be overridden on the command line)
+BLOCK_COUNT = 50
+TXNS_PER_BLOCK = 10
+WALLET_COUNT = 5
+# Default number of client threads of each kind, and seconds they run for
+READER_COUNT = 8
+WRITER_COUNT = 2
+DURATION = 10.0
+# Seconds the miner waits between mining jobs, and between polls of a running job
+MINE_INTERVAL = 1.0
+MINE_POLL_INTERVAL = 0.1
+# Paths the readers request in turn
+READ_PATHS = ['/chain', '/balance', '/transactions', '/nodes']
+# Transactions each writer adds per second. Both modes then do the same writes, so the reads they handle
+# show the capacity left over (unpaced writers, 0, would take more of it from the faster mode)
+WRITE_RATE = 5.0
+# Amount of every transaction (so repeats of the same payment are exercised)
+TXN_AMOUNT = 0.001
+# Seconds allowed for the node to start, and for any request
+STARTUP_TIMEOUT = 60.0
+REQUEST_TIMEOUT = 60.0
+# Node id of the load test's block chain data files (kept in a temporary directory)
+NODE_ID = 'load-test'
+
+
+class LoadResults:
+    # What the client threads saw, shared between them
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Kind of request ('read', 'write' or 'mine') -> latency of each request, in seconds
+        self.latencies = {'read': [], 'write': [], 'mine': []}
+        self.errors = []
+        # Ids of the transactions the node accepted
+        self.accepted_txn_ids = []
+        self.mined_count = 0
+        self.elapsed = 0.0
+
+    def record(self, kind, seconds, error=None):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            if error is not None:
+                self.errors.append(error)
+
+
+def serve(work_dir, keys, workers, threaded, port_queue):
+    # Runs in its own process, so the node doesn't compete with the clients for the GIL
+    os.chdir(work_dir)
+    # Only log errors, rather than every request
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    node.wallet = Wallet(NODE_ID)
+    node.wallet.private_key, node.wallet.public_key = keys
+    node.node_id = NODE_ID
+    node.mining_workers = workers
+    node.verify_on_load = False
+    node.balance_manager = BalanceManager(NODE_ID)
+    node.mining_jobs = MiningJobs(node.mine_block)
+    node.init_block_chain()
+    server = make_server('127.0.0.1', 0, node.py_coin_app, threaded=threaded)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def timed_request(session, results, kind, method, url, **kwargs):
+    """
+    Make a request, recording its latency and any server error.
+
+    :return: the response, or None if the request failed
+    """
+    start = perf_counter()
+    try:
+        response = session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        # Streamed responses (e.g. /chain) aren't complete until all of the body is read
+        response.content
+    except requests.exceptions.RequestException as e:
+        results.record(kind, perf_counter() - start, '{} {}: {}'.format(method, url, e))
+        return None
+    error = None
+    if response.status_code >= 500:
+        error = '{} {}: {} {}'.format(method, url, response.status_code, response.text[:200])
+    results.record(kind, perf_counter() - start, error)
+    return response
+
+
+def read(base_url, results, finished, reader_idx):
+    session = requests.Session()
+    # Readers start at different paths, so every path is being read at once
+    for path in itertools.islice(itertools.cycle(READ_PATHS), reader_idx, None):
+        if finished.is_set():
+            return
+        timed_request(session, results, 'read', 'GET', base_url + path)
+
+
+def write(base_url, results, finished, recipient, write_rate):
+    session = requests.Session()
+    next_write = perf_counter()
+    while not finished.is_set():
+        response = timed_request(session, results, 'write', 'POST', base_url + '/transactions',
+                                 json={'recipient': recipient, 'amount': TXN_AMOUNT})
+        if response is not None and response.status_code == 201:
+            with results.lock:
+                results.accepted_txn_ids.append(Transaction.from_dict(response.json()['txn']).txn_id)
+        if write_rate > 0:
+            # Keep to the rate, catching up after any slow writes
+            next_write += 1 / write_rate
+            finished.wait(max(next_write - perf_counter(), 0))
+
+
+def mine(base_url, results, finished):
+    # Mines a block at a time, finishing the job in progress once the load stops
+    session = requests.Session()
+    while not finished.is_set():
+        response = timed_request(session, results, 'mine', 'POST', base_url + '/mine')
+        if response is None or response.status_code != 202:
+            return
+        job = response.json()['job']
+        while job['status'] == RUNNING:
+            sleep(MINE_POLL_INTERVAL)
+            response = timed_request(session, results, 'mine', 'GET', '{}/mine/{}'.format(base_url, job['job_id']))
+            if response is None:
+                return
+            job = response.json()['job']
+        if job['status'] == MINED:
+            with results.lock:
+                results.mined_count += 1
+        finished.wait(MINE_INTERVAL)
+
+
+def run_load(base_url, args, recipient):
+    results = LoadResults()
+    finished = threading.Event()
+    threads = [threading.Thread(target=read, args=(base_url, results, finished, reader_idx))
+               for reader_idx in range(args.readers)]
+    threads += [threading.Thread(target=write, args=(base_url, results, finished, recipient, args.write_rate))
+                for _ in range(args.writers)]
+    threads.append(threading.Thread(target=mine, args=(base_url, results, finished)))
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    sleep(args.duration)
+    finished.set()
+    for thread in threads:
+        thread.join()
+    results.elapsed = perf_counter() - start
+    return results
+
+
+def check_consistency(base_url, results, public_key):
+    """
+    Check the node's state once the load has stopped.
+
+    :return: a list of the problems found (empty if the state is consistent)
+    """
+    problems = ['Server error: {}'.format(error) for error in results.errors]
+    chain = [Block.from_dict(dict_block) for dict_block in requests.get(base_url + '/chain').json()]
+    if not Verification.is_block_chain_valid(chain):
+        problems.append('The block chain is invalid')
+
+    # Every accepted transaction is either confirmed or still open, exactly once
+    open_txns = requests.get(base_url + '/transactions').json()
+    txn_ids = [txn.txn_id for block in chain for txn in block.txns] + \
+        [Transaction.from_dict(dict_txn).txn_id for dict_txn in open_txns]
+    seen_counts = {}
+    for txn_id in txn_ids:
+        seen_counts[txn_id] = seen_counts.get(txn_id, 0) + 1
+    for txn_id in results.accepted_txn_ids:
+        if seen_counts.get(txn_id, 0) != 1:
+            problems.append('Accepted transaction {} is held {} times'.format(txn_id, seen_counts.get(txn_id, 0)))
+
+    # Balances moved along with the chain
+    balance_manager = BalanceManager()
+    balance_manager.initialize_balances(chain)
+    balance = requests.get(base_url + '/balance').json()['balance']
+    if abs(balance - balance_manager.get_balance(public_key)) > 1e-6:
+        problems.append('Balance is {}, but the chain gives {}'.format(
+            balance, balance_manager.get_balance(public_key)))
+    return problems
+
+
+def report(mode, results):
+    rates = []
+    for kind in ['read', 'write']:
+        latencies = results.latencies[kind]
+        if len(latencies) < 2:
+            rates.append('{}s: {}'.format(kind, len(latencies)))
+            continue
+        rates.append('{}s: {:.1f}/s (median {:.1f} ms, p95 {:.1f} ms)'.format(
+            kind, len(latencies) / results.elapsed, 1e3 * statistics.median(latencies),
+            1e3 * statistics.quantiles(latencies, n=20)[-1]))
+    print('{:>12}  {}, blocks mined: {}, errors: {}'.format(
+        mode, ', '.join(rates), results.mined_count, len(results.errors)))
+
+
+def run_mode(base_dir, mode_dir, keys, recipient, args, threaded):
+    # Each mode starts from a fresh copy of the same data files
+    shutil.copytree(base_dir, mode_dir)
+    context = multiprocessing.get_context('spawn')
+    port_queue = context.Queue()
+    # Not a daemon, as the node starts worker processes of its own (e.g. to mine). It is terminated below
+    server = context.Process(target=serve, args=(mode_dir, keys, args.workers, threaded, port_queue))
+    server.start()
+    try:
+        base_url = 'http://127.0.0.1:{}'.format(port_queue.get(timeout=STARTUP_TIMEOUT))
+        results = run_load(base_url, args, recipient)
+        problems = check_consistency(base_url, results, keys[1])
+    finally:
+        server.terminate()
+        server.join()
+    report('threaded' if threaded else 'single', results)
+    for problem in problems:
+        print('ERROR: {}'.format(problem))
+    return results, problems
+
+
+def create_data_files(base_dir, args):
+    # Save a chain to the data files, as a node would have done, with the first wallet as the node's own
+    print('Generating {} wallets and a chain of {} blocks...'.format(args.wallets, args.blocks))
+    wallets = create_wallets(args.wallets)
+    chain = generate_chain(args.blocks, args.txns_per_block, wallets=wallets)
+    cwd = os.getcwd()
+    try:
+        os.chdir(base_dir)
+        block_chain = BlockChain(None, NODE_ID, args.workers, args.workers)
+        block_chain.load_data()
+        for block in chain:
+            if block_chain.add_block(block.to_dict()) is None:
+                raise RuntimeError('Generated block {} was rejected'.format(block.idx))
+        block_chain.save_data()
+    finally:
+        os.chdir(cwd)
+    return (wallets[0].private_key, wallets[0].public_key), wallets[1].public_key
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test the node with concurrent readers and writers')
+    parser.add_argument('--blocks', type=int, default=BLOCK_COUNT, help='number of blocks the chain starts with')
+    parser.add_argument('--txns-per-block', type=int, default=TXNS_PER_BLOCK,
+                        help='number of signed transactions in each block')
+    parser.add_argument('--wallets', type=int, default=WALLET_COUNT, help='number of participants')
+    parser.add_argument('--readers', type=int, default=READER_COUNT, help='number of reading client threads')
+    parser.add_argument('--writers', type=int, default=WRITER_COUNT,
+                        help='number of client threads adding transactions')
+    parser.add_argument('--write-rate', type=float, default=WRITE_RATE,
+                        help='transactions each writer adds per second (0 for as fast as possible)')
+    parser.add_argument('--duration', type=float, default=DURATION, help='seconds the load is applied for')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes used for mining')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.wallets < 2:
+        sys.exit('At least 2 wallets are needed')
+    work_dir = tempfile.mkdtemp(prefix='pycoin-load-test-')
+    try:
+        base_dir = os.path.join(work_dir, 'base')
+        os.mkdir(base_dir)
+        keys, recipient = create_data_files(base_dir, args)
+        print('Applying load for {} seconds with {} readers and {} writers...'.format(
+            args.duration, args.readers, args.writers))
+        single_results, single_problems = run_mode(base_dir, os.path.join(work_dir, 'single'), keys, recipient,
+                                                   args, False)
+        threaded_results, threaded_problems = run_mode(base_dir, os.path.join(work_dir, 'threaded'), keys,
+                                                       recipient, args, True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    single_reads = len(single_results.latencies['read']) / single_results.elapsed
+    threaded_reads = len(threaded_results.latencies['read']) / threaded_results.elapsed
+    if single_reads > 0:
+        print('Threaded serving handled {:.2f}x the reads'.format(threaded_reads / single_reads))
+    if len(single_problems) > 0 or len(threaded_problems) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
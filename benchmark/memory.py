@@ -0,0 +1,79 @@
+""" Measures the memory held by a long chain, compared with the original __dict__ based models """
+from block import Block
+import random
+import sys
+from time import time
+import tracemalloc
+from benchmark.chain_generator import PUBLIC_KEY_HEX_LEN, random_hex, SIGNATURE_HEX_LEN
+from transaction import Transaction
+
+# Number of transactions in the chain (can be overridden on the command line)
+TXN_COUNT = 1000000
+TXNS_PER_BLOCK = 100
+# Number of distinct participants the transactions are between
+PARTICIPANT_COUNT = 1000
+
+
+class DictTransaction:
+    # The original transaction layout: a __dict__ holding its own copy of each key
+    def __init__(self, sender, recipient, amount, signature, timestamp):
+        self.sender = sender
+        self.recipient = recipient
+        self.amount = amount
+        self.signature = signature
+        self.timestamp = timestamp
+
+    def intern_keys(self):
+        # The original models had no key table
+        pass
+
+
+class DictBlock:
+    # The original block layout
+    def __init__(self, idx, prev_hash, txns, proof, timestamp):
+        self.idx = idx
+        self.prev_hash = prev_hash
+        self.txns = txns
+        self.proof = proof
+        self.timestamp = timestamp
+
+
+def build_chain(block_class, txn_class, keys, txn_count):
+    chain = []
+    for idx in range(txn_count // TXNS_PER_BLOCK):
+        # Decoding a stored block gives each transaction its own copies of the key strings
+        txns = [txn_class(bytes.fromhex(random.choice(keys)).hex(), bytes.fromhex(random.choice(keys)).hex(),
+                          1.0, random_hex(SIGNATURE_HEX_LEN), time())
+                for _ in range(TXNS_PER_BLOCK)]
+        # As the block store does for the blocks of the chain
+        for txn in txns:
+            txn.intern_keys()
+        chain.append(block_class(idx, random_hex(64), txns, idx, time()))
+    return chain
+
+
+def measure(block_class, txn_class, keys, txn_count):
+    # Returns the bytes still allocated once the chain has been built
+    tracemalloc.start()
+    chain = build_chain(block_class, txn_class, keys, txn_count)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del chain
+    return size
+
+
+def run(txn_count):
+    keys = [random_hex(PUBLIC_KEY_HEX_LEN) for _ in range(PARTICIPANT_COUNT)]
+    # The slotted size includes the key table's single copy of each participant key
+    slotted_size = measure(Block, Transaction, keys, txn_count)
+    dict_size = measure(DictBlock, DictTransaction, keys, txn_count)
+
+    print('{} transactions between {} participants'.format(txn_count, PARTICIPANT_COUNT))
+    print('{:>10} {:>12} {:>10}'.format('models', 'total (MB)', 'bytes/txn'))
+    for name, size in [('dict', dict_size), ('slotted', slotted_size)]:
+        print('{:>10} {:>12.1f} {:>10.0f}'.format(name, size / 1024 / 1024, size / txn_count))
+    print('Slotted models use {:.0f}% of the memory'.format(100 * slotted_size / dict_size))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else TXN_COUNT)
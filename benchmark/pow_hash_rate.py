@@ -0,0 +1,43 @@
+""" Compares proof of work hash rates with and without the precomputed transaction prefix """
+import sys
+from time import perf_counter
+from benchmark.chain_generator import random_hex, synthetic_txns
+from utility.verification import Verification
+
+# Numbers of open transactions to benchmark
+TXN_COUNTS = [10, 1000, 10000]
+# Roughly how long (in seconds) to spend hashing for each measurement
+DURATION = 2.0
+
+
+def measure(attempt):
+    # Returns attempts per second
+    attempts = 0
+    start = perf_counter()
+    elapsed = 0.0
+    while elapsed < DURATION:
+        attempt(attempts)
+        attempts += 1
+        elapsed = perf_counter() - start
+    return attempts / elapsed
+
+
+def run():
+    print('{:>8} {:>18} {:>18} {:>8}'.format('txns', 'full (hash/s)', 'prefix (hash/s)', 'speedup'))
+    for count in TXN_COUNTS:
+        txns = synthetic_txns(count)
+        prev_hash = random_hex(64)
+
+        # Every attempt re-serializes the transactions (the original search path)
+        full_rate = measure(lambda nonce: Verification.is_pow_valid(txns, prev_hash, nonce))
+
+        # The prefix is serialized and hashed once; only the nonce is hashed per attempt
+        prefix_hash = Verification.pow_prefix(txns, prev_hash)
+        prefix_rate = measure(lambda nonce: Verification.is_pow_valid_for_prefix(prefix_hash, nonce))
+
+        print('{:>8} {:>18.1f} {:>18.1f} {:>7.0f}x'.format(count, full_rate, prefix_rate, prefix_rate / full_rate))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    run()
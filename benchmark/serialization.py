@@ -0,0 +1,54 @@
+""" Compares the size and encode/decode throughput of the JSON and binary block encodings """
+import binary_codec
+from block import Block
+import json
+import sys
+from time import perf_counter
+from benchmark.chain_generator import generate_chain
+
+# Numbers of transactions (excluding the reward) per block to benchmark
+TXNS_PER_BLOCK = [1, 10, 100]
+# Number of blocks encoded and decoded for each measurement
+BLOCK_COUNT = 1000
+# A low difficulty keeps chain generation quick (the encoding doesn't depend on the difficulty)
+CHAR_COUNT = 1
+
+
+def json_encode(block):
+    return json.dumps(block.to_dict()).encode()
+
+
+def json_decode(data):
+    return Block.from_dict(json.loads(data))
+
+
+def timed(func, items):
+    start = perf_counter()
+    results = [func(item) for item in items]
+    return results, perf_counter() - start
+
+
+def run():
+    print('{:>6} {:>8} {:>12} {:>12} {:>12} {:>8}'.format(
+        'txns', 'format', 'bytes/block', 'encode/s', 'decode/s', 'size'))
+    for txns_per_block in TXNS_PER_BLOCK:
+        chain = generate_chain(BLOCK_COUNT, txns_per_block, CHAR_COUNT)
+        json_size = None
+        for name, encode, decode in [('json', json_encode, json_decode),
+                                     ('binary', binary_codec.encode_block, binary_codec.decode_block)]:
+            encoded, encode_time = timed(encode, chain)
+            decoded, decode_time = timed(decode, encoded)
+            # Both encodings must give back blocks with the same hashes
+            if [block.hash for block in decoded] != [block.hash for block in chain]:
+                raise RuntimeError('Blocks decoded from {} have different hashes'.format(name))
+
+            size = sum(len(data) for data in encoded)
+            json_size = size if json_size is None else json_size
+            print('{:>6} {:>8} {:>12.0f} {:>12.0f} {:>12.0f} {:>7.0f}%'.format(
+                txns_per_block, name, size / BLOCK_COUNT, BLOCK_COUNT / encode_time,
+                BLOCK_COUNT / decode_time, 100 * size / json_size))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    run()
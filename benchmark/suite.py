@@ -0,0 +1,322 @@
+""" Times the node's core operations on a synthetic chain, and flags regressions against a saved baseline """
+import argparse
+from balance_manager import BalanceManager
+import binary_codec
+from block import Block
+from blockchain import BlockChain, MINING_SENDER
+import json
+from mining_jobs import MINED, MiningJobs
+import node
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+from benchmark.chain_generator import create_wallets, generate_chain, generate_mempool
+from utility import verification
+from utility.verification import Verification
+
+# Default size of the synthetic chain and mempool (each can be overridden on the command line)
+BLOCK_COUNT = 200
+TXNS_PER_BLOCK = 20
+WALLET_COUNT = 10
+MEMPOOL_SIZE = 100
+# Number of times each benchmark is run (the fastest run is reported)
+REPEAT_COUNT = 3
+# Number of proof of work searches, /chain requests and /mined blocks in each run
+POW_SEARCH_COUNT = 10
+CHAIN_REQUEST_COUNT = 5
+MINE_REQUEST_COUNT = 5
+# A benchmark has regressed if its time per operation is this fraction slower than the baseline's
+REGRESSION_THRESHOLD = 0.2
+# Where results are written unless a file is given on the command line
+RESULTS_FILE = 'benchmark-results.json'
+# Node id of the benchmark's block chain data files (kept in a temporary directory)
+NODE_ID = 'benchmark'
+
+
+class Fixture:
+    # The synthetic data shared by the benchmarks
+    def __init__(self, wallets, chain, mempool, workers):
+        self.wallets = wallets
+        self.chain = chain
+        self.mempool = mempool
+        self.workers = workers
+        self.client = None
+
+
+def bench_proof_of_work(fixture):
+    # How many nonces a search tries depends on the previous hash, so the time per attempt is reported
+    attempts = 0
+    start = perf_counter()
+    for search in range(POW_SEARCH_COUNT):
+        # (the nonce found is only roughly the number of attempts when searching in parallel)
+        attempts += BlockChain.proof_of_work(fixture.mempool, '{:064x}'.format(search), fixture.workers) + 1
+    return perf_counter() - start, attempts
+
+
+def bench_chain_validation(fixture):
+    # Fresh blocks, so no run benefits from block hashes cached by another
+    chain = [Block.from_dict(block.to_dict()) for block in fixture.chain]
+    start = perf_counter()
+    is_valid = Verification.is_block_chain_valid(chain, workers=fixture.workers)
+    elapsed = perf_counter() - start
+    if not is_valid:
+        raise RuntimeError('Generated chain of {} blocks failed validation'.format(len(chain)))
+    return elapsed, len(chain)
+
+
+def bench_save_data(fixture):
+    block_chain = BlockChain(None, NODE_ID, fixture.workers, fixture.workers)
+    block_chain.load_data()
+    start = perf_counter()
+    block_chain.save_data()
+    return perf_counter() - start, len(block_chain.chain)
+
+
+def bench_load_data(fixture):
+    block_chain = BlockChain(None, NODE_ID, fixture.workers, fixture.workers)
+    start = perf_counter()
+    block_chain.load_data()
+    elapsed = perf_counter() - start
+    if len(block_chain.chain) != len(fixture.chain):
+        raise RuntimeError('Loaded {} of {} blocks'.format(len(block_chain.chain), len(fixture.chain)))
+    return elapsed, len(fixture.chain)
+
+
+def bench_initialize_balances(fixture):
+    # Without a node id there are no snapshots, so every block is replayed
+    balance_manager = BalanceManager()
+    start = perf_counter()
+    balance_manager.initialize_balances(fixture.chain)
+    return perf_counter() - start, sum(len(block.txns) for block in fixture.chain)
+
+
+def bench_signatures(fixture):
+    # Forget earlier results and parsed keys, so every signature is verified from scratch
+    verification._signature_cache.clear()
+    verification._txn_verifier.cache_clear()
+    return time_signatures(fixture.mempool)
+
+
+def bench_cached_signatures(fixture):
+    for txn in fixture.mempool:
+        Verification.is_txn_signature_valid(txn, MINING_SENDER)
+    return time_signatures(fixture.mempool)
+
+
+def time_signatures(txns):
+    start = perf_counter()
+    results = [Verification.is_txn_signature_valid(txn, MINING_SENDER) for txn in txns]
+    elapsed = perf_counter() - start
+    if not all(results):
+        raise RuntimeError('{} of {} signatures failed verification'.format(results.count(False), len(txns)))
+    return elapsed, len(txns)
+
+
+def bench_get_chain(fixture):
+    return time_chain_requests(fixture, 'application/json')
+
+
+def bench_get_binary_chain(fixture):
+    return time_chain_requests(fixture, binary_codec.MEDIA_TYPE)
+
+
+def time_chain_requests(fixture, media_type):
+    block_count = 0
+    start = perf_counter()
+    for _ in range(CHAIN_REQUEST_COUNT):
+        response = fixture.client.get('/chain', headers={'Accept': media_type})
+        # The response is streamed, so read all of it
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError('Chain request failed with status {}'.format(response.status_code))
+        block_count += int(response.headers['X-Chain-Length'])
+    return perf_counter() - start, block_count
+
+
+def bench_mine(fixture):
+    elapsed = 0.0
+    for _ in range(MINE_REQUEST_COUNT):
+        # Refill the mempool from the current balances (not timed, as it is mostly signing)
+        node.block_chain.add_transactions(
+            generate_mempool(fixture.wallets, len(fixture.mempool), node.balance_manager.balances))
+        start = perf_counter()
+        response = fixture.client.post('/mine')
+        # Mining runs as a background job, so wait for it to finish
+        job = node.mining_jobs.get(response.get_json()['job']['job_id'])
+        job.wait()
+        elapsed += perf_counter() - start
+        if job.status != MINED:
+            raise RuntimeError('Mining job did not mine a block: {}'.format(job.to_dict()))
+    return elapsed, MINE_REQUEST_COUNT
+
+
+# Name -> (operation each time is divided by, benchmark function)
+BENCHMARKS = [
+    ('proof_of_work', 'attempt', bench_proof_of_work),
+    ('is_block_chain_valid', 'block', bench_chain_validation),
+    ('save_data', 'block', bench_save_data),
+    ('load_data', 'block', bench_load_data),
+    ('initialize_balances', 'txn', bench_initialize_balances),
+    ('is_txn_signature_valid', 'txn', bench_signatures),
+    ('is_txn_signature_valid (cached)', 'txn', bench_cached_signatures),
+    ('GET /chain', 'block', bench_get_chain),
+    ('GET /chain (binary)', 'block', bench_get_binary_chain),
+    # Mining changes the chain, so it runs last
+    ('POST /mine', 'block', bench_mine)
+]
+
+
+def create_fixture(args):
+    print('Generating {} wallets and a chain of {} blocks...'.format(args.wallets, args.blocks))
+    wallets = create_wallets(args.wallets)
+    chain = generate_chain(args.blocks, args.txns_per_block, wallets=wallets)
+    balance_manager = BalanceManager()
+    balance_manager.initialize_balances(chain)
+    mempool = generate_mempool(wallets, args.mempool, balance_manager.balances)
+    fixture = Fixture(wallets, chain, mempool, args.workers)
+
+    # Save the chain to the data files, as a node would have done
+    block_chain = BlockChain(None, NODE_ID, args.workers, args.workers)
+    block_chain.load_data()
+    for block in chain:
+        if block_chain.add_block(block.to_dict()) is None:
+            raise RuntimeError('Generated block {} was rejected'.format(block.idx))
+    block_chain.save_data()
+
+    # The node serves the same data files, with the first wallet as its own
+    node.wallet = wallets[0]
+    node.node_id = NODE_ID
+    node.mining_workers = args.workers
+    node.verify_on_load = False
+    node.balance_manager = BalanceManager(NODE_ID)
+    node.mining_jobs = MiningJobs(node.mine_block)
+    node.init_block_chain()
+    fixture.client = node.py_coin_app.test_client()
+    return fixture
+
+
+def run(args):
+    fixture = create_fixture(args)
+    results = {}
+    print('{:>32} {:>10} {:>12} {:>16}'.format('benchmark', 'ops', 'best (s)', 'per op (us)'))
+    for name, unit, benchmark in BENCHMARKS:
+        times = []
+        ops = 0
+        for _ in range(args.repeat):
+            elapsed, ops = benchmark(fixture)
+            times.append(elapsed)
+        results[name] = {
+            'unit': unit,
+            'ops': ops,
+            'best_seconds': min(times),
+            'median_seconds': statistics.median(times),
+            'seconds_per_op': min(times) / ops
+        }
+        print('{:>32} {:>10} {:>12.4f} {:>16.2f}'.format(name, ops, min(times), 1e6 * min(times) / ops))
+        sys.stdout.flush()
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'blocks': args.blocks,
+            'txns_per_block': args.txns_per_block,
+            'wallets': args.wallets,
+            'mempool': args.mempool,
+            'workers': args.workers,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Compare each benchmark's time per operation with a baseline's.
+
+    :param current: the results being checked
+    :param baseline: the results they are compared with
+    :param threshold: the fraction slower than the baseline at which a benchmark has regressed
+    :return: the names of the benchmarks that have regressed
+    """
+    if current['params'] != baseline['params']:
+        print('WARN: The baseline was run with different parameters: {}'.format(baseline['params']))
+
+    regressions = []
+    print('{:>32} {:>16} {:>16} {:>8}'.format('benchmark', 'baseline (us)', 'current (us)', 'change'))
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            print('{:>32} {:>16} {:>16.2f}'.format(name, 'n/a', 1e6 * result['seconds_per_op']))
+            continue
+        baseline_time = baseline['results'][name]['seconds_per_op']
+        ratio = result['seconds_per_op'] / baseline_time
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            status = 'REGRESSION'
+        elif ratio < 1 - threshold:
+            status = 'faster'
+        else:
+            status = ''
+        print('{:>32} {:>16.2f} {:>16.2f} {:>+7.0f}% {}'.format(
+            name, 1e6 * baseline_time, 1e6 * result['seconds_per_op'], 100 * (ratio - 1), status))
+
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the node on a synthetic chain')
+    parser.add_argument('--blocks', type=int, default=BLOCK_COUNT, help='number of blocks in the chain')
+    parser.add_argument('--txns-per-block', type=int, default=TXNS_PER_BLOCK,
+                        help='number of signed transactions in each block')
+    parser.add_argument('--wallets', type=int, default=WALLET_COUNT, help='number of participants')
+    parser.add_argument('--mempool', type=int, default=MEMPOOL_SIZE, help='number of open transactions')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used for mining and verification')
+    parser.add_argument('--repeat', type=int, default=REPEAT_COUNT, help='number of runs of each benchmark')
+    parser.add_argument('--seed', type=int, help='seed for the generated amounts and participants')
+    parser.add_argument('--output', default=RESULTS_FILE, help='file the results are written to')
+    parser.add_argument('--results', help='compare these saved results, rather than running the benchmarks')
+    parser.add_argument('--baseline', help='saved results to flag regressions against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='fraction slower than the baseline that counts as a regression')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.results is not None:
+        with open(args.results, mode='r') as f:
+            current = json.load(f)
+    else:
+        if args.seed is not None:
+            random.seed(args.seed)
+        output_path = os.path.abspath(args.output)
+        # The block chain's data files are relative to the working directory, so run in a scratch one
+        cwd = os.getcwd()
+        work_dir = tempfile.mkdtemp(prefix='pycoin-benchmark-')
+        try:
+            os.chdir(work_dir)
+            current = run(args)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir, ignore_errors=True)
+        with open(output_path, mode='w') as f:
+            json.dump(current, f, indent=2)
+        print('Results written to {}'.format(output_path))
+
+    if args.baseline is not None:
+        with open(args.baseline, mode='r') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if len(regressions) > 0:
+            print('{} benchmark(s) regressed: {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+""" Compact, versioned binary encoding of blocks and transactions """
+from block import Block
+import struct
+from transaction import Transaction
+
+# Version written at the start of every encoded block. Bump it whenever the layout changes
+FORMAT_VERSION = 1
+# Media type used to negotiate the binary encoding between nodes (JSON remains the default)
+MEDIA_TYPE = 'application/x-pycoin-blocks'
+
+# Block header: format version, idx, proof and number of transactions (unsigned, little-endian)
+BLOCK_HEADER = struct.Struct('<BQQI')
+# Each string field is a kind byte and a byte length, followed by the bytes themselves
+FIELD_HEADER = struct.Struct('<BI')
+# Each number is a kind byte followed by 8 bytes, so ints and floats both round-trip exactly.
+# (Hashes are calculated from the text form of a block, where 1 and 1.0 differ)
+NUMBER_KIND = struct.Struct('<B')
+FLOAT = struct.Struct('<d')
+INT = struct.Struct('<q')
+# A transaction's amount and timestamp share a single kind byte (bit 0 set if the amount is an int,
+# bit 1 if the timestamp is), so both are read with one unpack
+TXN_NUMBERS = [struct.Struct('<' + amount_format + timestamp_format)
+               for timestamp_format in ['d', 'q'] for amount_format in ['d', 'q']]
+# Encoded blocks are framed by their byte length when written one after another
+FRAME_HEADER = struct.Struct('<I')
+
+# String field kinds. Lower case hex (keys, signatures and hashes) is stored as raw bytes, at half the size
+TEXT_FIELD = 0
+HEX_FIELD = 1
+# Number kinds
+FLOAT_NUMBER = 0
+INT_NUMBER = 1
+
+
+def _encode_field(value, parts):
+    try:
+        raw = bytes.fromhex(value)
+        # Only use the raw form if decoding it gives back exactly the same string
+        kind = HEX_FIELD if raw.hex() == value else TEXT_FIELD
+    except ValueError:
+        kind = TEXT_FIELD
+    if kind == TEXT_FIELD:
+        raw = value.encode()
+    parts.append(FIELD_HEADER.pack(kind, len(raw)))
+    parts.append(raw)
+
+
+def _decode_field(data, offset):
+    kind, length = FIELD_HEADER.unpack_from(data, offset)
+    offset += FIELD_HEADER.size
+    raw = data[offset:offset + length]
+    if len(raw) != length:
+        raise ValueError('Encoded field is truncated')
+    return (raw.hex() if kind == HEX_FIELD else str(raw, 'utf-8')), offset + length
+
+
+def _number_kind(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return INT_NUMBER
+    elif isinstance(value, float):
+        return FLOAT_NUMBER
+    raise ValueError('Unable to encode {!r} as a number'.format(value))
+
+
+def _encode_number(value, parts):
+    kind = _number_kind(value)
+    parts.append(NUMBER_KIND.pack(kind))
+    parts.append((INT if kind == INT_NUMBER else FLOAT).pack(value))
+
+
+def _decode_number(data, offset):
+    kind = NUMBER_KIND.unpack_from(data, offset)[0]
+    offset += NUMBER_KIND.size
+    number = (INT if kind == INT_NUMBER else FLOAT).unpack_from(data, offset)[0]
+    return number, offset + 8
+
+
+def _encode_txn(txn, parts):
+    number_kinds = _number_kind(txn.amount) | _number_kind(txn.timestamp) << 1
+    parts.append(NUMBER_KIND.pack(number_kinds))
+    parts.append(TXN_NUMBERS[number_kinds].pack(txn.amount, txn.timestamp))
+    _encode_field(txn.sender, parts)
+    _encode_field(txn.recipient, parts)
+    _encode_field(txn.signature, parts)
+
+
+def _decode_txn(data, offset):
+    numbers = TXN_NUMBERS[data[offset]]
+    amount, timestamp = numbers.unpack_from(data, offset + 1)
+    sender, offset = _decode_field(data, offset + 1 + numbers.size)
+    recipient, offset = _decode_field(data, offset)
+    signature, offset = _decode_field(data, offset)
+    return Transaction(sender, recipient, amount, signature, timestamp), offset
+
+
+def encode_txn(txn):
+    parts = []
+    _encode_txn(txn, parts)
+    return b''.join(parts)
+
+
+def decode_txn(data):
+    try:
+        return _decode_txn(memoryview(data), 0)[0]
+    except (struct.error, IndexError):
+        raise ValueError('Encoded transaction is truncated or corrupt')
+
+
+def encode_block(block):
+    """
+    Encode a block (and its transactions) in the binary format.
+
+    :param block: the block to encode
+    :return: the encoded bytes
+    """
+    parts = [BLOCK_HEADER.pack(FORMAT_VERSION, block.idx, block.proof, len(block.txns))]
+    _encode_field(block.prev_hash, parts)
+    _encode_number(block.timestamp, parts)
+    for txn in block.txns:
+        _encode_txn(txn, parts)
+    return b''.join(parts)
+
+
+def decode_block(data):
+    """
+    Decode a block encoded by encode_block.
+
+    :param data: the encoded bytes (any bytes-like object)
+    :return: the block
+    :raises ValueError: if the data is not a block in a supported version of the format
+    """
+    data = memoryview(data)
+    try:
+        version, idx, proof, txn_count = BLOCK_HEADER.unpack_from(data, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError('Unsupported block format version {}'.format(version))
+        prev_hash, offset = _decode_field(data, BLOCK_HEADER.size)
+        timestamp, offset = _decode_number(data, offset)
+        txns = []
+        for _ in range(txn_count):
+            txn, offset = _decode_txn(data, offset)
+            txns.append(txn)
+    except (struct.error, IndexError):
+        raise ValueError('Encoded block is truncated or corrupt')
+    return Block(idx, prev_hash, txns, proof, timestamp)
+
+
+def frame(encoded_block):
+    # Prefix an encoded block with its length
+    return FRAME_HEADER.pack(len(encoded_block)) + encoded_block
+
+
+def unframe_all(data):
+    """
+    Split a sequence of framed blocks back into the encoded blocks.
+
+    :param data: the framed blocks (any bytes-like object)
+    :return: a list of the encoded blocks
+    """
+    data = memoryview(data)
+    encoded_blocks = []
+    offset = 0
+    while offset < len(data):
+        if offset + FRAME_HEADER.size > len(data):
+            raise ValueError('Framed block is truncated')
+        length = FRAME_HEADER.unpack_from(data, offset)[0]
+        offset += FRAME_HEADER.size
+        if offset + length > len(data):
+            raise ValueError('Framed block is truncated')
+        encoded_blocks.append(data[offset:offset + length])
+        offset += length
+    return encoded_blocks
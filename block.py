@@ -1,7 +1,12 @@
 from time import time
+from transaction import Transaction
+from utility.hash_util import calc_hash
 
 
 class Block:
+    # Slots rather than a per-instance __dict__ keep the many blocks of a long chain compact
+    __slots__ = ('idx', 'prev_hash', 'txns', 'proof', 'timestamp', '__hash')
+
     def __init__(self, idx, prev_hash, txns, proof, timestamp=None):
         # Python convention is that, by default, attributes are publicly accessible.
         # - i.e. we don't try to hide them using some mechanism like name mangling
@@ -9,14 +14,25 @@ class Block:
         # If at some point access has to be controlled we use properties
         self.idx = idx
         self.prev_hash = prev_hash
-        # Using list comprehension
-        # Alternatives:
-        #   list copy function: txns.copy()
-        #   open-ended range: txns[:]
-        self.txns = [elem for elem in txns]
+        # Use a tuple (rather than a list copy) so that the transactions can't be changed in place.
+        # Replacing them via the attribute invalidates the cached hash (see __setattr__)
+        self.txns = tuple(txns)
         self.proof = proof
         self.timestamp = time() if timestamp is None else timestamp
 
+    def __setattr__(self, name, value):
+        # Any change to the block's contents invalidates its cached hash
+        if name != '_Block__hash':
+            object.__setattr__(self, '_Block__hash', None)
+        object.__setattr__(self, name, value)
+
+    @property
+    def hash(self):
+        # Hashing stringifies every transaction in the block, so only do it once
+        if self.__hash is None:
+            self.__hash = calc_hash(str(self))
+        return self.__hash
+
     def __str__(self):
         return '{}:{}:{}:{}:{}'.format(
             self.idx,
@@ -24,3 +40,22 @@ class Block:
             self.proof,
             [str(txn) for txn in self.txns],
             self.timestamp)
+
+    def to_dict(self):
+        # Our Block and Transaction objects are not JSON serializable, so convert them to dictionaries
+        return {
+            'idx': self.idx,
+            'prev_hash': self.prev_hash,
+            'txns': [txn.to_ordered_dict() for txn in self.txns],
+            'proof': self.proof,
+            'timestamp': self.timestamp
+        }
+
+    @staticmethod
+    def from_dict(dict_block):
+        return Block(
+            dict_block['idx'],
+            dict_block['prev_hash'],
+            [Transaction.from_dict(dict_txn) for dict_txn in dict_block['txns']],
+            dict_block['proof'],
+            dict_block['timestamp'])
@@ -0,0 +1,349 @@
+from binary_codec import decode_block, encode_block, frame, FRAME_HEADER
+from block import Block
+from collections import OrderedDict
+import json
+import mmap
+import os
+import struct
+import threading
+
+# Each index entry is the offset of a block within the blocks file (unsigned 64 bit, little-endian)
+# followed by the block's SHA256 hash (32 raw bytes)
+INDEX_ENTRY = struct.Struct('<Q32s')
+# Index files written before block hashes were indexed. They are rebuilt in the current format
+LEGACY_INDEX_SUFFIX = '.idx'
+# Blocks files written before the binary encoding, holding one JSON line per block. They are converted when loaded
+LEGACY_BLOCKS_SUFFIX = '.blocks'
+# Maximum number of deserialized blocks kept in memory
+DEFAULT_CACHE_SIZE = 1000
+
+
+class BlockStore:
+    """
+    Disk-backed, lazily-loaded sequence of blocks.
+
+    Blocks are appended, binary encoded and framed by their length, to a blocks file. A separate index file holds
+    the offset and hash of every block, so block N (or the block with hash H) can be found
+    without reading the blocks before it.
+    Both files are memory-mapped for reading, and blocks are only deserialized when accessed.
+    The most recently used blocks are kept in a bounded cache.
+    """
+
+    def __init__(self, file_path, cache_size=DEFAULT_CACHE_SIZE):
+        self.__blocks_file_path = file_path + '.bin'
+        self.__legacy_blocks_file_path = file_path + LEGACY_BLOCKS_SUFFIX
+        self.__index_file_path = file_path + '.index'
+        self.__legacy_index_file_path = file_path + LEGACY_INDEX_SUFFIX
+        self.__cache_size = cache_size
+        # Block index -> Block, in least to most recently used order
+        self.__cache = OrderedDict()
+        # Reads change the cache (and may map the files), so concurrent readers take turns to do so.
+        # Writes are expected to be exclusive of reads (e.g. see utility.rw_lock)
+        self.__read_lock = threading.Lock()
+        self.__len = 0
+        # Block hash -> block index. Only built when first needed
+        self.__heights = None
+        self.__blocks_map = None
+        self.__index_map = None
+
+    def __len__(self):
+        return self.__len
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.__len))]
+
+        idx = self.__checked_idx(idx)
+        with self.__read_lock:
+            block = self.__cache.get(idx)
+            if block is not None:
+                self.__cache.move_to_end(idx)
+                return block
+        # Decoded outside the lock (two readers of the same uncached block may both decode it)
+        block = self.__read_block(idx)
+        with self.__read_lock:
+            self.__cache_block(idx, block)
+        return block
+
+    def __iter__(self):
+        for idx in range(self.__len):
+            yield self[idx]
+
+    def __reversed__(self):
+        for idx in reversed(range(self.__len)):
+            yield self[idx]
+
+    def raw_block(self, idx):
+        """
+        Get a block in its encoded form (see binary_codec), without decoding it.
+
+        :param idx: the index of the block (negative values count back from the end)
+        :return: the encoded block
+        """
+        idx = self.__checked_idx(idx)
+        self.__map_files()
+        start, end = self.__record_span(idx)
+        return self.__blocks_map[start:end]
+
+    def hash_at(self, idx):
+        """
+        Get the hash of a block without loading the block itself.
+
+        :param idx: the index of the block (negative values count back from the end)
+        :return: the block's hash as a hex string
+        """
+        idx = self.__checked_idx(idx)
+        self.__map_files()
+        return INDEX_ENTRY.unpack_from(self.__index_map, idx * INDEX_ENTRY.size)[1].hex()
+
+    def height_of(self, block_hash):
+        """
+        Find a block by its hash.
+
+        :param block_hash: the hash of the block as a hex string
+        :return: the index of the block, or None if no block has the hash
+        """
+        if self.__heights is None:
+            self.__heights = {self.hash_at(idx): idx for idx in range(self.__len)}
+        return self.__heights.get(block_hash)
+
+    def load(self):
+        """
+        Open the store's existing files, recovering from any write interrupted by a crash.
+
+        Only the index size and the final block are read; all other blocks are loaded on demand.
+        """
+        self.__unmap_files()
+        self.__cache.clear()
+        self.__heights = None
+        self.__len = 0
+        if os.path.exists(self.__legacy_blocks_file_path):
+            self.__convert_legacy_blocks()
+        if not os.path.exists(self.__blocks_file_path):
+            return
+        if not os.path.exists(self.__index_file_path):
+            self.__rebuild_index()
+
+        # Drop any partially written index entry
+        index_size = os.path.getsize(self.__index_file_path)
+        if index_size % INDEX_ENTRY.size != 0:
+            index_size -= index_size % INDEX_ENTRY.size
+            with open(self.__index_file_path, mode='r+b') as f:
+                f.truncate(index_size)
+        self.__len = index_size // INDEX_ENTRY.size
+
+        # Blocks are written before their index entry, so the blocks file may hold
+        # a block (or part of one) that never made it into the index. Drop it.
+        blocks_end = 0
+        if self.__len > 0:
+            with open(self.__blocks_file_path, mode='rb') as f:
+                f.seek(self.__entry_from_file(self.__len - 1)[0])
+                blocks_end = f.tell() + FRAME_HEADER.size + FRAME_HEADER.unpack(f.read(FRAME_HEADER.size))[0]
+        if os.path.getsize(self.__blocks_file_path) > blocks_end:
+            with open(self.__blocks_file_path, mode='r+b') as f:
+                f.truncate(blocks_end)
+
+    def append(self, block):
+        return self.extend([block])
+
+    def extend(self, blocks):
+        """
+        Durably append blocks to the end of the store.
+
+        :param blocks: the blocks to append, in chain order
+        :return: the number of bytes written (to the blocks and index files)
+        """
+        if len(blocks) == 0:
+            return 0
+
+        self.__unmap_files()
+        entries = []
+        bytes_written = 0
+        with open(self.__blocks_file_path, mode='ab') as f:
+            for block in blocks:
+                entries.append(INDEX_ENTRY.pack(f.tell(), bytes.fromhex(block.hash)))
+                bytes_written += f.write(frame(encode_block(block)))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Only index the blocks once they are safely on disk
+        with open(self.__index_file_path, mode='ab') as f:
+            bytes_written += f.write(b''.join(entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+        for block in blocks:
+            # Blocks in the chain share their participants' keys (see Transaction.intern_keys)
+            for txn in block.txns:
+                txn.intern_keys()
+            self.__cache_block(self.__len, block)
+            if self.__heights is not None:
+                self.__heights[block.hash] = self.__len
+            self.__len += 1
+        return bytes_written
+
+    def truncate(self, length):
+        """
+        Remove every block from index 'length' onwards.
+
+        :param length: the number of blocks to keep
+        """
+        if length >= self.__len:
+            return
+
+        blocks_end = self.__entry_from_file(length)[0]
+        if self.__heights is not None:
+            for idx in range(length, self.__len):
+                self.__heights.pop(self.hash_at(idx), None)
+        self.__unmap_files()
+        # Shrink the index first so it never refers to blocks that no longer exist
+        with open(self.__index_file_path, mode='r+b') as f:
+            f.truncate(length * INDEX_ENTRY.size)
+            os.fsync(f.fileno())
+        with open(self.__blocks_file_path, mode='r+b') as f:
+            f.truncate(blocks_end)
+            os.fsync(f.fileno())
+
+        self.__len = length
+        for idx in [idx for idx in self.__cache if idx >= length]:
+            del self.__cache[idx]
+
+    def replace(self, blocks):
+        """
+        Replace the entire contents of the store.
+
+        :param blocks: the new blocks, in chain order
+        :return: the number of bytes written
+        """
+        self.truncate(0)
+        return self.extend(blocks)
+
+    def __cache_block(self, idx, block):
+        self.__cache[idx] = block
+        self.__cache.move_to_end(idx)
+        while len(self.__cache) > self.__cache_size:
+            self.__cache.popitem(last=False)
+
+    def __checked_idx(self, idx):
+        if idx < 0:
+            idx += self.__len
+        if idx < 0 or idx >= self.__len:
+            raise IndexError('block index out of range')
+        return idx
+
+    def __entry_from_file(self, idx):
+        with open(self.__index_file_path, mode='rb') as f:
+            f.seek(idx * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+
+    def __rebuild_index(self):
+        # Recreate a missing (or legacy format) index by scanning the blocks file
+        print('Rebuilding block index...')
+        entries = []
+        offset = 0
+        with open(self.__blocks_file_path, mode='rb') as f:
+            # Stop at an incomplete final block, which is dropped by load()
+            while True:
+                frame_header = f.read(FRAME_HEADER.size)
+                if len(frame_header) < FRAME_HEADER.size:
+                    break
+                block_size = FRAME_HEADER.unpack(frame_header)[0]
+                encoded_block = f.read(block_size)
+                if len(encoded_block) < block_size:
+                    break
+                block = decode_block(encoded_block)
+                entries.append(INDEX_ENTRY.pack(offset, bytes.fromhex(block.hash)))
+                offset += FRAME_HEADER.size + block_size
+
+        tmp_file_path = self.__index_file_path + '.tmp'
+        with open(tmp_file_path, mode='wb') as f:
+            f.write(b''.join(entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_path, self.__index_file_path)
+
+        if os.path.exists(self.__legacy_index_file_path):
+            os.remove(self.__legacy_index_file_path)
+
+    def __convert_legacy_blocks(self):
+        # Convert a JSON lines blocks file to the binary format. The converted file is only swapped in
+        # once complete, and the legacy file only removed once the index has been rebuilt to match,
+        # so an interrupted conversion is picked up again by the next load
+        print('Converting blocks to the binary format...')
+        if not os.path.exists(self.__blocks_file_path):
+            tmp_file_path = self.__blocks_file_path + '.tmp'
+            with open(self.__legacy_blocks_file_path, mode='rb') as legacy_file, open(tmp_file_path, mode='wb') as f:
+                for line in legacy_file:
+                    if not line.endswith(b'\n'):
+                        break
+                    f.write(frame(encode_block(Block.from_dict(json.loads(line)))))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file_path, self.__blocks_file_path)
+
+        # The existing index holds offsets into the legacy file
+        self.__rebuild_index()
+        os.remove(self.__legacy_blocks_file_path)
+
+    def __map_files(self):
+        # Files are (re)mapped on demand, as writes invalidate the existing mappings
+        if self.__blocks_map is not None:
+            return
+        with self.__read_lock:
+            if self.__blocks_map is None:
+                with open(self.__index_file_path, mode='rb') as f:
+                    self.__index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # The blocks map is set last, as it being set shows that both files are mapped
+                with open(self.__blocks_file_path, mode='rb') as f:
+                    self.__blocks_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __read_block(self, idx):
+        self.__map_files()
+        start, end = self.__record_span(idx)
+        block = decode_block(self.__blocks_map[start:end])
+        for txn in block.txns:
+            txn.intern_keys()
+        return block
+
+    def __record_span(self, idx):
+        # The start and end offsets of an encoded block within the (mapped) blocks file
+        start = INDEX_ENTRY.unpack_from(self.__index_map, idx * INDEX_ENTRY.size)[0] + FRAME_HEADER.size
+        return start, start + FRAME_HEADER.unpack_from(self.__blocks_map, start - FRAME_HEADER.size)[0]
+
+    def __unmap_files(self):
+        if self.__blocks_map is not None:
+            self.__blocks_map.close()
+            self.__index_map.close()
+            self.__blocks_map = None
+            self.__index_map = None
+
+
+class ChainView:
+    """
+    Read-only view of a BlockStore, so the chain can be shared without exposing its mutators.
+    """
+
+    def __init__(self, block_store):
+        self.__block_store = block_store
+
+    def __len__(self):
+        return len(self.__block_store)
+
+    def __getitem__(self, idx):
+        return self.__block_store[idx]
+
+    def __iter__(self):
+        return iter(self.__block_store)
+
+    def __reversed__(self):
+        return reversed(self.__block_store)
+
+    def raw_block(self, idx):
+        return self.__block_store.raw_block(idx)
+
+    def hash_at(self, idx):
+        return self.__block_store.hash_at(idx)
+
+    def height_of(self, block_hash):
+        return self.__block_store.height_of(block_hash)
+
@@ -1,13 +1,22 @@
 # The blockchain implementation
 # - code formatting follows PEP 8 standards
+import binary_codec
 from block import Block
-from http import HTTPStatus
+from block_store import BlockStore, ChainView
+from chain_index import HistoryIndex, TxnIndex
+from chain_log import ChainLog
+from mempool import EVICT_OLDEST, Mempool
+import metrics
+from peer_notifier import PeerNotifier
 import json
 import os
 import requests
+import threading
+from time import perf_counter
 from transaction import Transaction
-from utility.hash_util import calc_hash
-from utility.verification import Verification
+from utility.pow_util import default_worker_count, parallel_proof_of_work, STOP_CHECK_INTERVAL
+from utility.rw_lock import ReadWriteLock
+from utility.verification import PARALLEL_VERIFICATION_MIN_BLOCKS, Verification
 
 # Reward earned by the node owner for mining a block
 MINING_SENDER = 'MINER'
@@ -17,23 +26,84 @@ MINING_REWARD = 10.0
 DATA_DIR = './data'
 DATA_FILE = 'blockchain'
 DATA_FILE_PATH = DATA_DIR + '/' + DATA_FILE
+# Suffix of the append-only data log (replaces the original three line data file)
+DATA_LOG_SUFFIX = '.log'
+# Suffixes of the saved transaction history and transaction id indexes
+HISTORY_INDEX_SUFFIX = '.history'
+TXN_INDEX_SUFFIX = '.txns'
+# Maximum number of deserialized blocks held in memory
+BLOCK_CACHE_SIZE = 1000
+# Suffix given to an original data file once its contents have been migrated to the data log
+MIGRATED_SUFFIX = '.migrated'
+# Maximum number of open transactions, and what to do when a transaction arrives once that is reached
+MEMPOOL_MAX_SIZE = 10000
+MEMPOOL_EVICTION_POLICY = EVICT_OLDEST
+# Compact the data log once it holds this many more commits than a snapshot of the current state
+COMPACTION_INTERVAL = 1000
+# Number of block hashes or blocks requested from a peer at a time when syncing the chain
+SYNC_PAGE_SIZE = 500
+# Number of downloaded blocks validated together when syncing the chain (enough to be verified in parallel)
+SYNC_VALIDATION_RUN_SIZE = PARALLEL_VERIFICATION_MIN_BLOCKS
+# Connect and read timeouts (seconds) for chain sync requests
+SYNC_TIMEOUT = (2.0, 30.0)
+# Number of most recent blocks in a block locator before the gaps between blocks start doubling
+LOCATOR_DENSE_COUNT = 10
+
+OPERATION_SECONDS = metrics.Histogram(
+    'pycoin_blockchain_operation_seconds', 'Time taken by block chain operations', ['operation'])
+POW_ATTEMPTS = metrics.Counter('pycoin_pow_attempts_total', 'Nonces tried while searching for proofs of work')
+POW_HASH_RATE = metrics.Gauge('pycoin_pow_hash_rate', 'Nonces tried per second by the latest proof of work search')
+SAVE_BYTES = metrics.Histogram(
+    'pycoin_save_bytes', 'Bytes written to the data files by each commit of a change, and by each compaction',
+    buckets=metrics.SIZE_BUCKETS)
 
 
 class BlockChain:
-    def __init__(self, public_key, node_id):
+    def __init__(self, public_key, node_id, mining_workers=None, verify_workers=None, get_balance=None,
+                 on_new_tip=None, lock=None):
         self.__public_key = public_key
         self.__node_id = node_id
-        # Start with an empty blockchain
-        self.__chain = []
+        # Used to reject transactions whose sender can't cover their open obligations (not checked if None)
+        self.__get_balance = get_balance
+        # Called when a block from elsewhere (i.e. not one we mined) becomes the tip of the chain
+        self.__on_new_tip = on_new_tip
+        # Reader/writer lock shared with whatever else must change along with the chain (e.g. balances).
+        # Only mine_block and resolve_block_chain take it, as they wait on other processes or peers without it;
+        # callers hold it around every other call
+        self.__lock = ReadWriteLock() if lock is None else lock
+        # Number of processes used to search for a proof of work (default is one per core)
+        self.__mining_workers = default_worker_count() if mining_workers is None else mining_workers
+        # Number of processes used to verify long runs of blocks (default is one per core)
+        self.__verify_workers = default_worker_count() if verify_workers is None else verify_workers
+        # Start with an empty blockchain. Blocks are kept on disk and only loaded when accessed
+        self.__chain = BlockStore('{}_{}'.format(DATA_FILE_PATH, node_id), BLOCK_CACHE_SIZE)
         # Current open (unconfirmed) transactions
-        self.__open_txns = []
+        self.__open_txns = Mempool(MEMPOOL_MAX_SIZE, MEMPOOL_EVICTION_POLICY)
         # The set of peers this node knows about
         self.__peer_nodes = set()
         self.resolve_conflicts = False
+        self.__peer_notifier = PeerNotifier(self.__on_peer_conflict)
+        # Set once the block chain has been replaced (see close), after which it must not change its data files
+        self.__closed = False
+        # Held while resolving conflicts (see resolve_block_chain)
+        self.__resolve_lock = threading.Lock()
+        # Connections to peers are reused across the requests made while syncing the chain
+        self.__sync_session = requests.Session()
+        # Checkpoint of how many blocks have been verified and the hash of the last of them.
+        # Only blocks beyond the checkpoint need validating before the chain is saved
+        self.__verified_height = 0
+        self.__verified_hash = ''
+        # Every change to the chain, open transactions and peers is appended to the data log
+        self.__data_log = ChainLog('{}_{}{}'.format(DATA_FILE_PATH, node_id, DATA_LOG_SUFFIX))
+        # Where each participant's confirmed transactions are in the chain
+        self.__history = HistoryIndex('{}_{}{}'.format(DATA_FILE_PATH, node_id, HISTORY_INDEX_SUFFIX))
+        # Where each confirmed transaction is in the chain
+        self.__txn_index = TxnIndex('{}_{}{}'.format(DATA_FILE_PATH, node_id, TXN_INDEX_SUFFIX))
 
     @property
     def chain(self):
-        return self.__chain[:]
+        # A read-only view rather than a copy, as copying would load every block from disk
+        return ChainView(self.__chain)
 
     # Explicitly disallow setter
     @chain.setter
@@ -46,90 +116,342 @@ class BlockChain:
     # def chain(self, val):
     #     self.__chain = val[:]
 
+    def tip_hash(self):
+        # The hash of the last block (read from the block index, so the block itself isn't loaded)
+        return self.__chain.hash_at(-1) if len(self.__chain) > 0 else ''
+
+    def block_locator(self):
+        """
+        Get the hashes of blocks at exponentially increasing distances back from the tip.
+
+        A peer can find the last block it shares with this chain from the locator, whatever the chain length.
+
+        :return: a list of block hashes, newest first and always ending with the genesis block
+        """
+        locator = []
+        height = len(self.__chain) - 1
+        step = 1
+        while height > 0:
+            locator.append(self.__chain.hash_at(height))
+            if len(locator) >= LOCATOR_DENSE_COUNT:
+                step *= 2
+            height -= step
+        if len(self.__chain) > 0:
+            locator.append(self.__chain.hash_at(0))
+        return locator
+
+    def find_fork(self, locator):
+        """
+        Find where another chain diverges from this one, given that chain's block locator.
+
+        :param locator: the other chain's block locator
+        :return: the height just after the newest locator block that is also in this chain (0 if none are)
+        """
+        for block_hash in locator:
+            height = self.__chain.height_of(block_hash)
+            if height is not None:
+                return height + 1
+        return 0
+
+    def get_block(self, height):
+        """
+        Get the block at a given height
+
+        :param height: the index of the block in the chain
+        :return: the block, or None if the chain is not that long
+        """
+        return self.__chain[height] if 0 <= height < len(self.__chain) else None
+
+    def get_block_by_hash(self, block_hash):
+        """
+        Get the block with a given hash
+
+        :param block_hash: the hash of the block
+        :return: the block, or None if there is no block with the hash in the chain
+        """
+        height = self.__chain.height_of(block_hash)
+        return self.__chain[height] if height is not None else None
+
+    def get_history(self, participant, offset=0, limit=None):
+        """
+        Get the transactions a participant has sent or received
+
+        :param participant: the participant's public key
+        :param offset: the number of (newest) confirmed transactions to skip
+        :param limit: the maximum number of confirmed transactions to return (default is all of them)
+        :return: a tuple of the participant's open transactions (oldest first), their confirmed
+            transactions as (block height, position in block, transaction) tuples (newest first)
+            and their total number of confirmed transactions
+        """
+        confirmed_txns = [(height, position, self.__chain[height].txns[position])
+                          for height, position in self.__history.entries(participant, offset, limit)]
+        return self.__open_txns.txns_of(participant), confirmed_txns, self.__history.count(participant)
+
+    def find_txn(self, txn_id):
+        """
+        Find a transaction, whether confirmed or open, by its id (see Transaction.txn_id)
+
+        :param txn_id: the transaction's id
+        :return: a tuple of the transaction, the height of the block holding it and its position in the block
+            (both None if the transaction is open), or None if there is no such transaction
+        """
+        for height, position in self.__txn_index.find(txn_id):
+            # The index only narrows down where the transaction may be, so check it's the right one
+            txn = self.__chain[height].txns[position]
+            if txn.txn_id == txn_id:
+                return txn, height, position
+
+        txn = self.__open_txns.get(txn_id)
+        return (txn, None, None) if txn is not None else None
+
     @property
     def open_txns(self):
-        return self.__open_txns[:]
+        # A read-only view rather than a copy
+        return self.__open_txns.txns()
 
-    def load_data(self):
+    @OPERATION_SECONDS.labels('load_data').timed
+    def load_data(self, verify_all=False):
+        """
+        Load the block chain, open transactions and peers from the data files.
+
+        :param verify_all: ignore the saved verification checkpoint and validate the whole chain
+                           (e.g. when the data files may not be trustworthy)
+        """
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR)
+            return
+
+        # The data log records how many of the block store's blocks were committed
+        self.__chain.load()
+        if self.__data_log.exists():
+            self.__load_data_log()
         else:
-            try:
-                with open('{}_{}'.format(DATA_FILE_PATH, self.__node_id), mode='r') as f:
-                    lines = f.readlines()
-                    if len(lines) == 3:
-                        # Use range to exclude the terminating new line character
-                        block_chain_loaded = json.loads(lines[0][:-1])
-                        open_transactions_loaded = json.loads(lines[1][:-1])
-                        peers_nodes_loaded = json.loads(lines[2])
-
-                        self.__chain.clear()
-                        for dict_block in block_chain_loaded:
-                            self.__chain.append(
-                                Block(
-                                    dict_block['idx'],
-                                    dict_block['prev_hash'],
-                                    [Transaction(
-                                        dict_txn['sender'],
-                                        dict_txn['recipient'],
-                                        dict_txn['amount'],
-                                        dict_txn['signature'],
-                                        dict_txn['timestamp']
-                                    ) for dict_txn in dict_block['txns']],
-                                    dict_block['proof'],
-                                    dict_block['timestamp']
-                                )
-                            )
-
-                        self.__open_txns.clear()
-                        for dict_txn in open_transactions_loaded:
-                            txn = Transaction(
-                                dict_txn['sender'],
-                                dict_txn['recipient'],
-                                dict_txn['amount'],
-                                dict_txn['signature'],
-                                dict_txn['timestamp']
-                            )
-                            if Verification.is_txn_signature_valid(txn, MINING_SENDER):
-                                self.__open_txns.append(txn)
-                            else:
-                                print('WARN: Discarding open transaction with invalid signature')
-
-                        # Create a new set from the deserialized list
-                        self.__peer_nodes = set(peers_nodes_loaded)
+            self.__migrate_data_file()
+
+        if verify_all and not self.verify_chain(full=True):
+            print('ERROR: Loaded block chain is invalid')
+
+        self.__history.initialize(self.chain)
+        self.__txn_index.initialize(self.chain)
+
+    def __load_data_log(self):
+        committed_height = 0
+        verified_height = 0
+        verified_hash = ''
+        # Data logs written before the block store existed hold the blocks themselves
+        legacy_chain = None
+        open_txns = Mempool(MEMPOOL_MAX_SIZE, MEMPOOL_EVICTION_POLICY)
+        peer_nodes = set()
+
+        # Rebuild the state by applying every committed operation in order
+        for ops in self.__data_log.replay():
+            for op in ops:
+                if op['op'] == 'height':
+                    committed_height = op['height']
+                elif op['op'] == 'verified':
+                    verified_height = op['height']
+                    verified_hash = op['hash']
+                elif op['op'] == 'block':
+                    legacy_chain = [] if legacy_chain is None else legacy_chain
+                    legacy_chain.append(Block.from_dict(op['block']))
+                elif op['op'] == 'chain':
+                    legacy_chain = [Block.from_dict(dict_block) for dict_block in op['chain']]
+                elif op['op'] == 'txn':
+                    txn = Transaction.from_dict(op['txn'])
+                    # Logs written before transactions were fully checked on arrival may hold ones no block can store
+                    if Verification.is_txn_valid(txn):
+                        open_txns.add(txn)
                     else:
-                        print('ERROR: Invalid data file contents')
+                        print('WARN: Discarding open transaction with an invalid key, signature, amount or timestamp')
+                elif op['op'] == 'txns_removed':
+                    if 'txn_ids' in op:
+                        open_txns.remove_all(op['txn_ids'])
+                    else:
+                        # Logs written before transactions had ids of their own list signatures instead
+                        signatures = set(op['signatures'])
+                        open_txns.remove_all([txn.txn_id for txn in open_txns if txn.signature in signatures])
+                elif op['op'] == 'txns_cleared':
+                    open_txns.clear()
+                elif op['op'] == 'peers':
+                    peer_nodes = set(op['peers'])
+                else:
+                    print('WARN: Ignoring unknown data log operation: {}'.format(op['op']))
+
+        self.__set_open_txns(list(open_txns))
+        self.__peer_nodes = peer_nodes
+
+        if legacy_chain is not None:
+            # Move the blocks into the block store and rewrite the log without them
+            self.__chain.replace(legacy_chain)
+            self.__data_log.compact(self.__snapshot())
+            print('Moved data log blocks to block store')
+        elif len(self.__chain) > committed_height:
+            # A crash happened after blocks were stored but before they were committed
+            print('WARN: Discarding {} uncommitted block(s)'.format(len(self.__chain) - committed_height))
+            self.__chain.truncate(committed_height)
+
+        # Only trust the checkpoint if it still matches the chain (__is_chain_valid also checks this)
+        self.__verified_height = verified_height
+        self.__verified_hash = verified_hash
+        self.__compact_if_due()
+
+    def __migrate_data_file(self):
+        # One-time conversion of the original three line data file into the data log
+        data_file_path = '{}_{}'.format(DATA_FILE_PATH, self.__node_id)
+        try:
+            with open(data_file_path, mode='r') as f:
+                lines = f.readlines()
+        except IOError:
+            print('No existing data file to load')
+            return
+
+        if len(lines) == 3:
+            # Use range to exclude the terminating new line character
+            block_chain_loaded = json.loads(lines[0][:-1])
+            open_transactions_loaded = json.loads(lines[1][:-1])
+            peers_nodes_loaded = json.loads(lines[2])
+
+            self.__chain.replace([Block.from_dict(dict_block) for dict_block in block_chain_loaded])
+            self.__set_open_txns([Transaction.from_dict(dict_txn) for dict_txn in open_transactions_loaded])
+            # Create a new set from the deserialized list
+            self.__peer_nodes = set(peers_nodes_loaded)
+
+            self.__data_log.compact(self.__snapshot())
+            # Keep the original file, but out of the way so that the migration only happens once
+            os.replace(data_file_path, data_file_path + MIGRATED_SUFFIX)
+            print('Migrated data file to data log')
+        else:
+            print('ERROR: Invalid data file contents')
 
-            except IOError:
-                print('No existing data file to load')
+    def __set_open_txns(self, txns):
+        self.__open_txns.clear()
+        storable_txns = []
+        for txn in txns:
+            if Verification.is_txn_valid(txn):
+                storable_txns.append(txn)
+            else:
+                print('WARN: Discarding open transaction with an invalid key, signature, amount or timestamp')
+        # Verify the signatures as one batch (which is split across worker processes when large)
+        signature_results = Verification.are_txn_signatures_valid(storable_txns, MINING_SENDER, self.__verify_workers)
+        for txn, is_valid in zip(storable_txns, signature_results):
+            if is_valid:
+                self.__open_txns.add(txn)
+            else:
+                print('WARN: Discarding open transaction with invalid signature')
+
+    def __snapshot(self):
+        # A single commit that rebuilds the current state from scratch (the blocks themselves live in the block store)
+        return [
+            [self.__height_op(), self.__verified_op()] +
+            [{'op': 'txn', 'txn': txn.to_ordered_dict()} for txn in self.__open_txns] +
+            # Convert set to list so that it can be serialized to JSON
+            [{'op': 'peers', 'peers': list(self.__peer_nodes)}]
+        ]
+
+    def __height_op(self):
+        # Commits the blocks currently in the block store
+        return {'op': 'height', 'height': len(self.__chain)}
+
+    def __verified_op(self):
+        return {'op': 'verified', 'height': self.__verified_height, 'hash': self.__verified_hash}
+
+    def __compact_if_due(self):
+        # Anything beyond the single snapshot commit is history (e.g. transactions since mined) that compaction discards
+        if self.__data_log.commit_count > 1 + COMPACTION_INTERVAL:
+            self.__compact()
+
+    def __compact(self):
+        bytes_written = self.__data_log.compact(self.__snapshot())
+        # Save the indexes too, so that only blocks added since need indexing at startup
+        # (unless they haven't caught up with the chain yet, as happens while loading)
+        for index in [self.__history, self.__txn_index]:
+            if index.height == len(self.__chain):
+                bytes_written += index.save(self.chain)
+        SAVE_BYTES.observe(bytes_written)
+
+    def __is_chain_valid(self):
+        # Validate only the blocks beyond the verification checkpoint, then move the checkpoint to the tip
+        # - Note: we are passing a read-only view of the chain (using getter) to external function to prevent reference leak
+        if self.__verified_height > len(self.__chain) or \
+                (self.__verified_height > 0 and self.__chain.hash_at(self.__verified_height - 1) != self.__verified_hash):
+            # The chain has changed underneath the checkpoint (e.g. it was replaced), so start again from genesis
+            self.__verified_height = 0
+            self.__verified_hash = ''
+
+        if not Verification.is_block_chain_valid(self.chain, self.__verified_height, workers=self.__verify_workers):
+            return False
 
-    def save_data(self):
+        self.__verified_height = len(self.__chain)
+        self.__verified_hash = self.tip_hash()
+        return True
+
+    def verify_chain(self, full=False):
+        """
+        Validate the block chain
+
+        :param full: validate every block, rather than just those beyond the verification checkpoint
+        :return: True if the chain is valid
+        """
+        if full:
+            self.__verified_height = 0
+            self.__verified_hash = ''
+        return self.__is_chain_valid()
+
+    def __commit(self, ops, block_bytes=0):
+        """
+        Save a change to the data log (if the chain is still valid).
+
+        :param ops: the operations making up the change
+        :param block_bytes: the number of bytes the change has already written to the block store
+        """
         # Only save the block chain if it is valid
-        # - Note: we are passing a copy of the chain (using getter) to external function to prevent reference leak
-        if Verification.is_block_chain_valid(self.chain):
-            # Mode 'w' ensures we overwrite the contents of the file
-            with open('{}_{}'.format(DATA_FILE_PATH, self.__node_id), mode='w') as f:
-                # Create dictionary version of each block and transaction
-                # - can only serialize certain Python objects to JSON
-                # Note: take copy of block dict so we can convert the block's transactions
-                serializable_chain = [block.__dict__.copy() for block in self.__chain]
-                for dict_block in serializable_chain:
-                    dict_block['txns'] = [txn.__dict__ for txn in dict_block['txns']]
-                f.write(json.dumps(serializable_chain) + '\n')
-                serializable_open_txns = [txn.__dict__ for txn in self.__open_txns]
-                f.write(json.dumps(serializable_open_txns) + '\n')
-                # Convert set to list so that it can be serialized to JSON
-                f.write(json.dumps(list(self.__peer_nodes)))
+        verified_height = self.__verified_height
+        if self.__is_chain_valid():
+            if self.__verified_height != verified_height:
+                # Persist the checkpoint along with the change
+                ops = ops + [self.__verified_op()]
+            SAVE_BYTES.observe(block_bytes + self.__data_log.commit(ops))
+            self.__compact_if_due()
         else:
+            SAVE_BYTES.observe(block_bytes)
             print('Unable to save data as block chain is not valid')
 
-    @staticmethod
-    def proof_of_work(txns, prev_block_hash):
-        nonce = 0
-        while not Verification.is_pow_valid(txns, prev_block_hash, nonce):
-            nonce += 1
+    @OPERATION_SECONDS.labels('save_data').timed
+    def save_data(self):
+        # Write out the complete current state, replacing the data log's history
+        if self.__is_chain_valid():
+            self.__compact()
+        else:
+            print('Unable to save data as block chain is not valid')
 
-        return nonce
+    @staticmethod
+    def proof_of_work(txns, prev_block_hash, workers=1, stop=None, record_progress=None):
+        """
+        Search for a nonce that gives a valid proof of work.
+
+        :param txns: the transactions (excluding the reward transaction) to be mined
+        :param prev_block_hash: the hash of the previous block
+        :param workers: the number of processes to search with
+        :param stop: optional event that abandons the search when set
+        :param record_progress: optional function called with the number of nonces tried so far, now and then
+        :return: the nonce, or None if the search was stopped
+        """
+        if workers > 1:
+            return parallel_proof_of_work(txns, prev_block_hash, workers, stop, record_progress)
+
+        # Serialize the transactions and previous hash once rather than for every nonce attempt
+        prefix_hash = Verification.pow_prefix(txns, prev_block_hash)
+        # Nonces are tried in runs, with any checks between runs, so they don't slow down each attempt
+        first_nonce = 0
+        while True:
+            for nonce in range(first_nonce, first_nonce + STOP_CHECK_INTERVAL):
+                if Verification.is_pow_valid_for_prefix(prefix_hash, nonce):
+                    return nonce
+            first_nonce += STOP_CHECK_INTERVAL
+            if record_progress is not None:
+                record_progress(first_nonce)
+            if stop is not None and stop.is_set():
+                return None
 
     def add_transaction(self, sender, recipient, amount, signature, timestamp=None):
         """
@@ -141,73 +463,164 @@ class BlockChain:
             :amount: the transaction amount
             :signature: the signature of the transaction
         """
+        return self.add_transactions([Transaction(sender, recipient, amount, signature, timestamp)])[0]
+
+    @OPERATION_SECONDS.labels('add_transactions').timed
+    def add_transactions(self, txns):
+        """
+        Add many new open transactions, verifying their signatures in one pass and saving them once.
+
+        :param txns: the transactions to add
+        :return: a list holding, for each transaction, the transaction if it was added or None if it was rejected
+        """
         if self.__public_key is None:
             print('WARN: Unable to add transaction. Public key is not set')
-            return None
-        else:
-            txn = Transaction(sender, recipient, amount, signature, timestamp)
-            if Verification.is_txn_signature_valid(txn, MINING_SENDER):
-                self.__open_txns.append(txn)
-                self.save_data()
-                # Notify peer nodes of transaction only if it originated from this node
-                if txn.sender == self.__public_key:
-                    self.notify_peers_of_txn(txn)
-                return txn
-            else:
+            return [None] * len(txns)
+
+        added_txns = []
+        ops = []
+        # Only the signatures of transactions a block could store are verified (e.g. a key must be a string)
+        is_storable = [Verification.is_txn_valid(txn) for txn in txns]
+        signature_results = iter(Verification.are_txn_signatures_valid(
+            [txn for txn, storable in zip(txns, is_storable) if storable], MINING_SENDER, self.__verify_workers))
+        for txn, storable in zip(txns, is_storable):
+            is_signature_valid = next(signature_results) if storable else False
+            if not storable:
+                print('WARN: Unable to add transaction. A key, signature, amount or timestamp is invalid')
+                added_txns.append(None)
+            elif not self.__is_txn_affordable(txn):
+                print('WARN: Unable to add transaction. Sender has insufficient funds')
+                added_txns.append(None)
+            elif not is_signature_valid:
                 print('WARN: Unable to add transaction. Signature is invalid')
-                return None
+                added_txns.append(None)
+            else:
+                evicted_txns = self.__open_txns.add(txn)
+                if evicted_txns is None:
+                    added_txns.append(None)
+                    continue
+                ops.append({'op': 'txn', 'txn': txn.to_ordered_dict()})
+                if len(evicted_txns) > 0:
+                    ops.append({'op': 'txns_removed', 'txn_ids': [evicted.txn_id for evicted in evicted_txns]})
+                added_txns.append(txn)
+
+        if len(ops) > 0:
+            self.__commit(ops)
+
+        own_txn_count = 0
+        for txn in added_txns:
+            # Notify peer nodes of transaction only if it originated from this node
+            if txn is not None and txn.sender == self.__public_key:
+                self.notify_peers_of_txn(txn)
+                own_txn_count += 1
+        if own_txn_count > 1:
+            # The batch is already complete, so send it without waiting for more transactions to coalesce with
+            self.__peer_notifier.flush_txns()
+
+        return added_txns
+
+    def __is_txn_affordable(self, txn):
+        # Would the sender still be able to meet their netted open obligations with this transaction added ?
+        if self.__get_balance is None or txn.sender == MINING_SENDER:
+            return True
+
+        net_sent = self.__open_txns.net_sent(txn.sender) + txn.amount
+        if txn.recipient == txn.sender:
+            net_sent -= txn.amount
+        return Verification.is_obligation_covered(txn.sender, net_sent, self.__get_balance)
+
+    def close(self):
+        # Called when the block chain is replaced (e.g. by one for a new wallet), holding the lock for writing,
+        # to release its notifier's threads and connections
+        self.__closed = True
+        self.__peer_notifier.shutdown()
 
     def notify_peers_of_txn(self, txn):
-        json_data = txn.__dict__
-        for node in self.__peer_nodes:
-            url = 'http://{}/notify/txn'.format(node)
-            self.notify_peer(url, json_data)
+        # Peers are notified in the background (in batches), so the caller doesn't wait on the slowest peer
+        self.__peer_notifier.queue_txn(self.__peer_nodes, txn.to_ordered_dict())
 
-    def notify_peer(self, url, json_data):
-        try:
-            response = requests.post(url, json=json_data)
-            if response.status_code == HTTPStatus.BAD_REQUEST or \
-                    response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR:
-                print('ERROR: Peer notification failed: {}'.format(url))
-                return False
-            elif response.status_code == HTTPStatus.CONFLICT:
-                self.resolve_conflicts = True
-                return False
-            else:
-                return True
-        except requests.exceptions.ConnectionError:
-            print('ERROR: Peer connection failed: {}'.format(url))
-            return False
+    def __on_peer_conflict(self):
+        # A peer rejected our data as its block chain disagrees with ours
+        self.resolve_conflicts = True
 
-    def mine_block(self, get_balance):
-        if self.__public_key is None:
-            print('WARN: Unable to mine block. Public key is not set')
-            return None
+    @OPERATION_SECONDS.labels('mine_block').timed
+    def mine_block(self, get_balance, stop=None, record_progress=None, on_mined=None):
+        """
+        Mine a block of the open transactions on the current tip of the chain.
+
+        The chain's lock is held (for writing) while the open transactions are gathered and while the block
+        is added, but not during the proof of work search, so the chain can be read and changed meanwhile.
 
-        prev_block_hash = calc_hash(str(self.__chain[-1])) if len(self.__chain) > 0 else ''
+        :param get_balance: function that returns a participant's confirmed balance
+        :param stop: optional event that abandons mining when set (e.g. as the tip has changed)
+        :param record_progress: optional function called with the number of nonces tried so far, now and then
+        :param on_mined: optional function called with the block once it is added, while the lock is still held
+                         (e.g. to update balances along with the chain)
+        :return: the block added to the chain, or None if mining failed or was stopped
+        """
+        with self.__lock.write_locked():
+            if self.__public_key is None:
+                print('WARN: Unable to mine block. Public key is not set')
+                return None
 
-        # Calculate POW on current open transactions before adding the reward transaction
-        pow_value = self.proof_of_work(self.open_txns, prev_block_hash)
+            prev_block_hash = self.tip_hash()
+
+            # The mining reward transaction will impact the hosting node's obligation
+            # - Note: mining reward transaction doesn't require a signature
+            # - it goes straight into the block (rather than via the open transactions), so a full
+            #   set of open transactions can never reject it or evict a transaction the POW covers
+            reward_txn = Transaction(MINING_SENDER, self.__public_key, MINING_REWARD, '')
+
+            # Validate that each transaction sender has necessary funds to meet their obligation when open
+            # transactions are netted. Transactions are checked when added, but balances may since have changed
+            # (e.g. due to a block received from a peer). Checking before the POW avoids wasting the effort
+            if not Verification.check_open_txn_funds_available(
+                    self.__open_txns, get_balance, MINING_SENDER, reward_txn):
+                print('WARN: Unable to mine block. Invalid open transactions ... clearing all open transactions')
+                self.__open_txns.clear()
+                self.__commit([{'op': 'txns_cleared'}])
+                return None
 
-        # Add in the mining reward transaction as it will impact the hosting node's obligation
-        # - Note: mining reward transaction doesn't require a signature
-        self.add_transaction(MINING_SENDER, self.__public_key, MINING_REWARD, '')
+            # Calculate POW on current open transactions before adding the reward transaction
+            # - take a list copy, as the transactions are sent to the worker processes
+            block_txns = list(self.open_txns)
 
-        # Validate that each transaction sender has necessary funds to meet
-        # their obligation when open transactions are netted
-        if not Verification.check_open_txn_funds_available(self.open_txns, get_balance, MINING_SENDER):
-            print('WARN: Unable to mine block. Invalid open transactions ... clearing all open transactions')
-            self.__open_txns.clear()
+        pow_start = perf_counter()
+        pow_value = self.proof_of_work(block_txns, prev_block_hash, self.__mining_workers, stop, record_progress)
+        if pow_value is None:
+            print('Mining stopped before a proof of work was found')
             return None
+        # Recorded once the search is over, rather than slowing down every attempt
+        # - nonces are tried in order (interleaved across workers), so the nonce found is about the number tried
+        self.__record_pow(pow_value + 1, perf_counter() - pow_start)
+
+        with self.__lock.write_locked():
+            if (stop is not None and stop.is_set()) or self.tip_hash() != prev_block_hash:
+                # A block has been added (e.g. received from a peer) since the search started, so this one is stale
+                print('WARN: Unable to add mined block. The block chain has changed since mining started')
+                return None
 
-        block = Block(len(self.__chain), prev_block_hash, self.open_txns, pow_value)
-        self.__chain.append(block)
-        self.__open_txns.clear()
-        self.save_data()
-        self.notify_peers_for_block(block)
+            block = Block(len(self.__chain), prev_block_hash, block_txns + [reward_txn], pow_value)
+            block_bytes = self.__chain.append(block)
+            self.__index_block(block)
+            # Only the mined transactions are removed, as others may have arrived during the search
+            mined_txn_ids = [txn.txn_id for txn in block_txns]
+            self.__open_txns.remove_all(mined_txn_ids)
+            # The new block and the removal of its transactions are committed together
+            self.__commit([self.__height_op(), {'op': 'txns_removed', 'txn_ids': mined_txn_ids}], block_bytes)
+            if on_mined is not None:
+                on_mined(block)
 
+        self.notify_peers_for_block(block)
         return block
 
+    @staticmethod
+    def __record_pow(attempts, seconds):
+        POW_ATTEMPTS.inc(attempts)
+        if seconds > 0:
+            POW_HASH_RATE.set(attempts / seconds)
+
+    @OPERATION_SECONDS.labels('add_block').timed
     def add_block(self, block):
         # Validate the POW for the block's transactions
         txns = [Transaction(
@@ -217,69 +630,211 @@ class BlockChain:
         pow_valid = Verification.is_pow_valid(txns[:-1], block['prev_hash'], block['proof'])
 
         # Does previous hash for block received match the previous hash of our local last block ?
-        local_prev_block_hash = calc_hash(str(self.__chain[-1])) if len(self.__chain) > 0 else ''
-        prev_hash_match = local_prev_block_hash == block['prev_hash']
+        prev_hash_match = self.tip_hash() == block['prev_hash']
 
+        # Convert the received block from dictionary to Block object before appending to chain
+        block_obj = Block(block['idx'], block['prev_hash'], txns, block['proof'], block['timestamp'])
         if not pow_valid or not prev_hash_match:
             return None
+        elif not Verification.are_block_numbers_valid(block_obj):
+            print('WARN: Unable to add block. It contains a number that is invalid or too large')
+            return None
+        elif not all(Verification.are_txn_signatures_valid(txns, MINING_SENDER, self.__verify_workers)):
+            # Transactions we already hold as open transactions were verified on arrival, so are cached
+            print('WARN: Unable to add block. It contains a transaction with an invalid signature')
+            return None
         else:
-            # Convert the received block from dictionary to Block object before appending to chain
-            block_obj = Block(block['idx'], block['prev_hash'], txns, block['proof'], block['timestamp'])
-            self.__chain.append(block_obj)
+            block_bytes = self.__chain.append(block_obj)
+            self.__index_block(block_obj)
             # We now need to remove, from open transactions, any transaction that was part of the received block
-            open_txns_snapshot = self.__open_txns[:]
-            for itx in block['txns']:
-                for opentx in open_txns_snapshot:
-                    # Check for match. Should be enough to just check equality of signatures
-                    if opentx.signature == itx['signature']:
-                        try:
-                            self.__open_txns.remove(opentx)
-                        except ValueError:
-                            print('WARN: Transaction was already removed')
-            self.save_data()
+            # - open transactions are keyed by transaction id, so each is a direct lookup
+            txn_ids = [txn.txn_id for txn in txns]
+            self.__open_txns.remove_all(txn_ids)
+            self.__commit([self.__height_op(), {'op': 'txns_removed', 'txn_ids': txn_ids}], block_bytes)
+            self.__notify_new_tip()
             return block_obj
 
+    def __notify_new_tip(self):
+        if self.__on_new_tip is not None:
+            self.__on_new_tip()
+
+    def __index_block(self, block):
+        self.__history.add_block(block)
+        self.__txn_index.add_block(block)
+
     def notify_peers_for_block(self, block):
-        json_block_data = block.__dict__.copy()
-        json_block_data['txns'] = [txn.__dict__ for txn in json_block_data['txns']]
-        for node in self.__peer_nodes:
-            url = 'http://{}/notify/block'.format(node)
-            self.notify_peer(url, { 'block': json_block_data })
-
-    def resolve_block_chain(self):
-        winning_chain = self.__chain
-        replace_chain = False
-
-        # Get the block chain held on each peer node
-        for node in self.__peer_nodes:
-            url = 'http://{}/chain'.format(node)
-            try:
-                response = requests.get(url)
-                node_chain = response.json()
-                # Check whether peer node has a valid chain that is longer
-                if len(node_chain) > len(winning_chain):
-                    # Convert to block and transaction objects before verifying
-                    node_chain = [Block(
-                        block['index'], block['prev_hash'], block['txns'], block['proof'], block['timestamp'])
-                            for block in node_chain]
-                    for block in node_chain:
-                        block.txns = [Transaction(
-                            txn['sender'], txn['recipient'], txn['amount'], txn['signature'], txn['timestamp'])
-                                for txn in block.txns]
-                    if Verification.is_block_chain_valid(node_chain):
-                        winning_chain = node_chain
-                        replace_chain = True
-
-            except requests.exceptions.ConnectionError:
-                print('ERROR: Peer connection failed: {}'.format(url))
+        return self.__peer_notifier.broadcast(self.__peer_nodes, '/notify/block', {'block': block.to_dict()})
 
-        self.resolve_conflicts = False
-        if replace_chain:
-            self.__chain = winning_chain
-            self.__open_txns.clear()
-            self.save_data()
+    @OPERATION_SECONDS.labels('resolve_block_chain').timed
+    def resolve_block_chain(self, on_resolved=None):
+        """
+        Adopt the longest valid chain held by a peer, if it is longer than ours.
+
+        Only the blocks after the point where a peer's chain diverges from ours are downloaded and validated.
+        Like mine_block, this takes the chain's lock itself. Peers' chains are downloaded without it (so a slow
+        peer doesn't hold up every other request), then the lock is held (for writing) while the winning chain
+        is adopted, provided our chain hasn't changed meanwhile.
+
+        :param on_resolved: optional function called once the chain is replaced, while the lock is still held
+                            (e.g. to rebuild balances from the new chain)
+        :return: True if the local chain was replaced
+        """
+        # One resolve at a time, as each would download the same blocks
+        with self.__resolve_lock:
+            with self.__lock.read_locked():
+                tip_hash = self.tip_hash()
+                local_length = len(self.__chain)
+                locator = self.block_locator()
+                peer_nodes = list(self.__peer_nodes)
+
+            winning_fork = None
+            winning_length = local_length
+            for node in peer_nodes:
+                try:
+                    fork = self.__fetch_divergent_blocks(node, locator, local_length, winning_length)
+                except requests.exceptions.RequestException:
+                    print('ERROR: Peer connection failed: http://{}'.format(node))
+                    continue
+                except (ValueError, KeyError, TypeError):
+                    print('ERROR: Peer sent an invalid chain: http://{}'.format(node))
+                    continue
+
+                if fork is not None:
+                    winning_fork = fork
+                    winning_length = fork[0] + len(fork[1])
+
+            with self.__lock.write_locked():
+                if self.__closed or self.tip_hash() != tip_hash:
+                    # The fork was found against a chain we no longer have (so conflicts remain to be resolved)
+                    print('WARN: Unable to resolve conflicts. The block chain has changed since resolving started')
+                    return False
+
+                self.resolve_conflicts = False
+                if winning_fork is None:
+                    return False
+
+                self.__adopt_fork(*winning_fork)
+                if on_resolved is not None:
+                    on_resolved()
+            return True
+
+    def __adopt_fork(self, fork_height, blocks):
+        # Must be called holding the lock for writing
+        self.__chain.truncate(fork_height)
+        block_bytes = self.__chain.extend(blocks)
+        self.__history.truncate(fork_height)
+        self.__txn_index.truncate(fork_height)
+        for block in blocks:
+            self.__index_block(block)
+        ops = [self.__height_op(), {'op': 'txns_cleared'}]
+        # The downloaded blocks have just been validated, so the whole chain is verified
+        # if the checkpoint already covered the blocks before the fork
+        if self.__verified_height >= fork_height:
+            self.__verified_height = len(self.__chain)
+            self.__verified_hash = self.tip_hash()
+            # __commit only saves the checkpoint if its own validation moves it, which it now won't
+            ops.append(self.__verified_op())
+        self.__open_txns.clear()
+        self.__commit(ops, block_bytes)
+        self.__notify_new_tip()
 
-        return replace_chain
+    def __local_hash_at(self, height):
+        with self.__lock.read_locked():
+            return self.__chain.hash_at(height)
+
+    def __local_block_at(self, height):
+        with self.__lock.read_locked():
+            return self.__chain[height]
+
+    def __fetch_divergent_blocks(self, node, locator, local_length, min_length):
+        """
+        Download, in pages, the blocks of a peer's chain that differ from ours.
+
+        Called without the lock held. Only blocks that our chain held when resolving started are read, and nothing
+        but a resolve removes blocks, so each read takes the lock just for itself.
+
+        :param node: the peer node
+        :param locator: our chain's block locator
+        :param local_length: the length of our chain
+        :param min_length: the length the peer's chain must exceed to be of interest
+        :return: a tuple of the fork height and the validated blocks from there to the peer's tip,
+            or None if the peer's chain is no longer than min_length or is invalid
+        """
+        url = 'http://{}/chain'.format(node)
+        headers = self.__get_json(url + '/headers', {'locator': ','.join(locator)})
+        peer_length = headers['length']
+        if peer_length <= min_length:
+            return None
+
+        # The peer's match against our locator is a common ancestor, but not necessarily the last one,
+        # so step forward through the peer's block hashes to the exact fork point
+        fork_height = headers['from']
+        hashes = headers['hashes']
+        hash_pos = 0
+        while fork_height < min(local_length, peer_length):
+            if hash_pos == len(hashes):
+                hashes = self.__get_json(url + '/headers', {'from': fork_height})['hashes']
+                hash_pos = 0
+                if len(hashes) == 0:
+                    break
+            if hashes[hash_pos] != self.__local_hash_at(fork_height):
+                break
+            fork_height += 1
+            hash_pos += 1
+
+        # The downloaded blocks are validated along with the block before them (the last one we share),
+        # so they can be checked without the lock
+        fork_base = [self.__local_block_at(fork_height - 1)] if fork_height > 0 else []
+        # Download the divergent blocks, validating them in runs as they arrive so a bad peer is dropped early
+        blocks = []
+        validated_count = 0
+        while fork_height + len(blocks) < peer_length:
+            page = self.__get_blocks(url, {'from': fork_height + len(blocks), 'limit': SYNC_PAGE_SIZE})
+            if len(page) == 0:
+                break
+            for block in page:
+                if block.idx != fork_height + len(blocks):
+                    print('ERROR: Block {} received out of order'.format(block.idx))
+                    return None
+                if not Verification.are_block_numbers_valid(block):
+                    print('ERROR: Block {} contains a number that is invalid or too large'.format(block.idx))
+                    return None
+                blocks.append(block)
+            if len(blocks) - validated_count >= SYNC_VALIDATION_RUN_SIZE:
+                if not self.__is_downloaded_run_valid(fork_base, blocks, validated_count):
+                    return None
+                validated_count = len(blocks)
+
+        if not self.__is_downloaded_run_valid(fork_base, blocks, validated_count):
+            return None
+        return (fork_height, blocks) if fork_height + len(blocks) > min_length else None
+
+    def __is_downloaded_run_valid(self, fork_base, blocks, run_start):
+        # Validate the downloaded blocks from run_start on, as add_block would (both their proofs of work
+        # and their transactions' signatures)
+        if not Verification.is_block_chain_valid(fork_base + blocks, len(fork_base) + run_start,
+                                                 workers=self.__verify_workers):
+            return False
+        run_txns = [txn for block in blocks[run_start:] for txn in block.txns]
+        if not all(Verification.are_txn_signatures_valid(run_txns, MINING_SENDER, self.__verify_workers)):
+            print('ERROR: Downloaded blocks contain a transaction with an invalid signature')
+            return False
+        return True
+
+    def __get_blocks(self, url, params):
+        # Ask for the binary encoding, but accept JSON from peers that don't support it
+        response = self.__sync_session.get(url, params=params, timeout=SYNC_TIMEOUT, headers={
+            'Accept': '{}, application/json;q=0.5'.format(binary_codec.MEDIA_TYPE)})
+        response.raise_for_status()
+        if response.headers.get('Content-Type', '').startswith(binary_codec.MEDIA_TYPE):
+            return [binary_codec.decode_block(encoded_block)
+                    for encoded_block in binary_codec.unframe_all(response.content)]
+        return [Block.from_dict(dict_block) for dict_block in response.json()]
+
+    def __get_json(self, url, params):
+        response = self.__sync_session.get(url, params=params, timeout=SYNC_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
 
     def add_peer_node(self, node):
         """
@@ -289,7 +844,7 @@ class BlockChain:
         :return:
         """
         self.__peer_nodes.add(node)
-        self.save_data()
+        self.__commit([{'op': 'peers', 'peers': list(self.__peer_nodes)}])
 
     def remove_peer_node(self, node):
         """
@@ -299,7 +854,7 @@ class BlockChain:
         :return:
         """
         self.__peer_nodes.discard(node)
-        self.save_data()
+        self.__commit([{'op': 'peers', 'peers': list(self.__peer_nodes)}])
 
     def get_peer_nodes(self):
         """
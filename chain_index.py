@@ -0,0 +1,306 @@
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+import hashlib
+import json
+from key_table import participant_keys
+import os
+
+# Each index entry packs a block height and a transaction's position within the block into one unsigned 64 bit int
+POSITION_BITS = 24
+POSITION_MASK = (1 << POSITION_BITS) - 1
+ENTRY_TYPE = 'Q'
+
+
+def pack_entry(height, position):
+    return height << POSITION_BITS | position
+
+
+def unpack_entry(entry):
+    return entry >> POSITION_BITS, entry & POSITION_MASK
+
+
+class ChainIndex(ABC):
+    """
+    Base for indexes of where things are in the chain, built as blocks are added.
+
+    An index is saved alongside the data log, tagged with the height and hash of the last block
+    it covers, so only later blocks need indexing at startup. Subclasses provide the contents
+    (see add_block, truncate, and the _reset, _header, _write and _read hooks).
+    """
+
+    def __init__(self, file_path, description):
+        self.__file_path = file_path
+        self.__description = description
+        # Number of blocks indexed
+        self._height = 0
+
+    @property
+    def height(self):
+        return self._height
+
+    @abstractmethod
+    def add_block(self, block):
+        # Blocks must be added in chain order
+        pass
+
+    @abstractmethod
+    def truncate(self, height):
+        # Remove the entries of every block from 'height' onwards
+        pass
+
+    def initialize(self, block_chain):
+        """
+        Load the saved index, if it still matches the chain, and index any blocks it doesn't cover.
+
+        :param block_chain: the (read-only view of the) chain being indexed
+        """
+        self._reset()
+        self.__load(block_chain)
+        start_height = self._height
+        for height in range(start_height, len(block_chain)):
+            self.add_block(block_chain[height])
+        if len(block_chain) - start_height > 0:
+            print('Indexed {} of {} block(s)'.format(self.__description, len(block_chain) - start_height))
+
+    def save(self, block_chain):
+        """
+        Save the index, tagged with the hash of the last block it covers.
+
+        :param block_chain: the (read-only view of the) chain being indexed
+        :return: the size (in bytes) of the saved index (0 if it couldn't be saved)
+        """
+        header = self._header()
+        header['height'] = self._height
+        header['hash'] = block_chain.hash_at(self._height - 1) if self._height > 0 else ''
+        try:
+            # Write to a temporary file first, so a crash can't leave a partially written index
+            tmp_file_path = self.__file_path + '.tmp'
+            with open(tmp_file_path, mode='wb') as f:
+                f.write(json.dumps(header).encode() + b'\n')
+                self._write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file_path, self.__file_path)
+            return os.path.getsize(self.__file_path)
+        except IOError:
+            print('WARN: Failed to save {} index'.format(self.__description))
+            return 0
+
+    def __load(self, block_chain):
+        if not os.path.exists(self.__file_path):
+            return
+        try:
+            with open(self.__file_path, mode='rb') as f:
+                header = json.loads(f.readline())
+                height = header['height']
+                # The index is only valid if the chain still holds the block it was saved at
+                if height > len(block_chain) or \
+                        (height > 0 and block_chain.hash_at(height - 1) != header['hash']):
+                    print('WARN: {} index does not match the block chain. Rebuilding'.format(
+                        self.__description.capitalize()))
+                    return
+                self._read(header, f)
+        except (IOError, ValueError, KeyError):
+            print('WARN: Ignoring unreadable {} index. Rebuilding'.format(self.__description))
+            self._reset()
+            return
+        self._height = height
+
+    @abstractmethod
+    def _reset(self):
+        # Empty the index
+        pass
+
+    def _header(self):
+        # Any details (as a dictionary) the saved index needs in order to be read back
+        return {}
+
+    @abstractmethod
+    def _write(self, f):
+        # Write the contents of the index (after the header) to a binary file
+        pass
+
+    @abstractmethod
+    def _read(self, header, f):
+        # Read back the contents written by _write (raising ValueError if they are incomplete)
+        pass
+
+    @staticmethod
+    def _read_array(f, count):
+        entries = array(ENTRY_TYPE)
+        entries.frombytes(f.read(count * entries.itemsize))
+        if len(entries) != count:
+            raise ValueError('Index is truncated')
+        return entries
+
+
+class HistoryIndex(ChainIndex):
+    """
+    Index of participant -> the (block height, transaction position) of every confirmed
+    transaction the participant sent or received, oldest first.
+
+    Finding a participant's transactions costs in proportion to how many they have taken part in,
+    rather than to the length of the chain.
+    """
+
+    def __init__(self, file_path):
+        super().__init__(file_path, 'transaction history')
+        # Participant key id -> array of packed entries
+        self.__entries = {}
+
+    def count(self, participant):
+        key_id = participant_keys.id_of(participant)
+        return len(self.__entries[key_id]) if key_id in self.__entries else 0
+
+    def entries(self, participant, offset=0, limit=None):
+        """
+        Get where a participant's transactions are in the chain, newest first.
+
+        :param participant: the participant's public key
+        :param offset: the number of (newest) transactions to skip
+        :param limit: the maximum number of transactions to return (default is all of them)
+        :return: a list of (block height, transaction position) tuples
+        """
+        key_id = participant_keys.id_of(participant)
+        if key_id not in self.__entries:
+            return []
+        participant_entries = self.__entries[key_id]
+        end = max(len(participant_entries) - offset, 0)
+        start = 0 if limit is None else max(end - limit, 0)
+        return [unpack_entry(entry) for entry in reversed(participant_entries[start:end])]
+
+    def add_block(self, block):
+        # Blocks are added in chain order, so each participant's entries stay sorted
+        for position, txn in enumerate(block.txns):
+            entry = pack_entry(block.idx, position)
+            for key_id in {txn.sender_id, txn.recipient_id}:
+                participant_entries = self.__entries.get(key_id)
+                if participant_entries is None:
+                    participant_entries = self.__entries[key_id] = array(ENTRY_TYPE)
+                participant_entries.append(entry)
+        self._height = block.idx + 1
+
+    def truncate(self, height):
+        if height >= self._height:
+            return
+        for key_id in list(self.__entries):
+            participant_entries = self.__entries[key_id]
+            del participant_entries[bisect_left(participant_entries, pack_entry(height, 0)):]
+            if len(participant_entries) == 0:
+                del self.__entries[key_id]
+        self._height = height
+
+    def _reset(self):
+        self.__entries = {}
+        self._height = 0
+
+    def _header(self):
+        return {'participants': [[participant_keys.key(key_id), len(participant_entries)]
+                                 for key_id, participant_entries in self.__entries.items()]}
+
+    def _write(self, f):
+        # In the same order as the header's participants
+        for participant_entries in self.__entries.values():
+            f.write(participant_entries.tobytes())
+
+    def _read(self, header, f):
+        self.__entries = {participant_keys.intern(participant): self._read_array(f, count)
+                          for participant, count in header['participants']}
+
+
+class TxnIndex(ChainIndex):
+    """
+    Index of transaction id (see Transaction.txn_id) -> the (block height, transaction position)
+    of the confirmed transaction.
+
+    To keep the index compact, ids are held as 64 bit digests. A digest only identifies
+    candidate transactions, which the caller confirms by comparing the full id.
+    """
+
+    # Saved indexes of what the index is keyed by (those keyed by signature, from before transactions had ids
+    # of their own, are rebuilt)
+    KEY = 'txn_id'
+
+    def __init__(self, file_path):
+        super().__init__(file_path, 'transaction id')
+        # Id digest -> packed entry (or a tuple of entries, on the rare digest collision)
+        self.__entries = {}
+
+    @staticmethod
+    def __digest(txn_id):
+        # The id is already a (hex) hash, so its leading 64 bits will do
+        return int(txn_id[:16], 16)
+
+    def find(self, txn_id):
+        """
+        Find where the transaction with an id might be in the chain.
+
+        :param txn_id: the transaction's id
+        :return: a list of candidate (block height, transaction position) tuples (usually one or none)
+        """
+        try:
+            entry = self.__entries.get(self.__digest(txn_id))
+        except ValueError:
+            # Not a hex id, so there can't be such a transaction
+            return []
+        if entry is None:
+            return []
+        return [unpack_entry(entry) for entry in (entry if isinstance(entry, tuple) else (entry,))]
+
+    def add_block(self, block):
+        for position, txn in enumerate(block.txns):
+            self.__add_entry(self.__digest(txn.txn_id), pack_entry(block.idx, position))
+        self._height = block.idx + 1
+
+    def __add_entry(self, digest, entry):
+        existing_entry = self.__entries.get(digest)
+        if existing_entry is None:
+            self.__entries[digest] = entry
+        else:
+            self.__entries[digest] = (existing_entry if isinstance(existing_entry, tuple) else (existing_entry,)) + \
+                (entry,)
+
+    def truncate(self, height):
+        if height >= self._height:
+            return
+        # Entries aren't ordered by height, so every entry is checked (chain replacements are rare)
+        first_removed = pack_entry(height, 0)
+        for digest, entry in list(self.__entries.items()):
+            if isinstance(entry, tuple):
+                kept_entries = tuple(kept_entry for kept_entry in entry if kept_entry < first_removed)
+                if len(kept_entries) == 0:
+                    del self.__entries[digest]
+                else:
+                    self.__entries[digest] = kept_entries if len(kept_entries) > 1 else kept_entries[0]
+            elif entry >= first_removed:
+                del self.__entries[digest]
+        self._height = height
+
+    def _reset(self):
+        self.__entries = {}
+        self._height = 0
+
+    def _header(self):
+        return {'key': TxnIndex.KEY,
+                'count': sum(len(entry) if isinstance(entry, tuple) else 1 for entry in self.__entries.values())}
+
+    def _write(self, f):
+        # Digests then entries, as two arrays (a digest is repeated for each of its entries)
+        digests = array(ENTRY_TYPE)
+        entries = array(ENTRY_TYPE)
+        for digest, entry in self.__entries.items():
+            for single_entry in (entry if isinstance(entry, tuple) else (entry,)):
+                digests.append(digest)
+                entries.append(single_entry)
+        f.write(digests.tobytes())
+        f.write(entries.tobytes())
+
+    def _read(self, header, f):
+        if header.get('key') != TxnIndex.KEY:
+            raise ValueError('Index is keyed by signature')
+        digests = self._read_array(f, header['count'])
+        entries = self._read_array(f, header['count'])
+        self.__entries = {}
+        for digest, entry in zip(digests, entries):
+            self.__add_entry(digest, entry)
@@ -0,0 +1,110 @@
+import json
+import os
+import zlib
+
+
+class ChainLog:
+    """
+    Append-only log of block chain state changes.
+
+    Each line of the log is a single commit holding a list of operations (e.g. a block
+    being added, open transactions being added or removed). Lines are prefixed with a
+    CRC32 of their contents so that a commit torn by a crash is detected and ignored.
+    The log can be compacted into a fresh snapshot, which is atomically swapped in.
+    """
+
+    def __init__(self, file_path):
+        self.__file_path = file_path
+        # Number of commits currently held in the log file
+        self.__commit_count = 0
+
+    @property
+    def commit_count(self):
+        return self.__commit_count
+
+    def exists(self):
+        return os.path.exists(self.__file_path)
+
+    @staticmethod
+    def __encode(ops):
+        data = json.dumps(ops)
+        return '{:08x} {}\n'.format(zlib.crc32(data.encode()), data)
+
+    @staticmethod
+    def __decode(line):
+        # Returns None if the line is incomplete or its checksum does not match
+        if not line.endswith('\n') or len(line) < 10:
+            return None
+        crc, data = line[:8], line[9:-1]
+        try:
+            if int(crc, 16) != zlib.crc32(data.encode()):
+                return None
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def replay(self):
+        """
+        Get the operations of every committed change, in the order they were made.
+
+        Anything following a damaged commit (i.e. a write interrupted by a crash) is discarded.
+
+        :return: a list of operation lists, one per commit
+        """
+        commits = []
+        if not self.exists():
+            return commits
+
+        valid_len = 0
+        with open(self.__file_path, mode='r', newline='') as f:
+            for line in f:
+                ops = ChainLog.__decode(line)
+                if ops is None:
+                    print('WARN: Discarding incomplete or corrupt data log entries')
+                    break
+                commits.append(ops)
+                valid_len += len(line.encode())
+
+        # Cut off any damaged tail so that later commits are appended after the last good one
+        if valid_len < os.path.getsize(self.__file_path):
+            with open(self.__file_path, mode='r+') as f:
+                f.truncate(valid_len)
+
+        self.__commit_count = len(commits)
+        return commits
+
+    def commit(self, ops):
+        """
+        Durably append a group of operations to the log as a single commit.
+
+        :param ops: the list of operations making up the commit
+        :return: the number of bytes written
+        """
+        line = ChainLog.__encode(ops)
+        # Mode 'a' ensures we only ever add to the end of the file
+        with open(self.__file_path, mode='a', newline='') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.__commit_count += 1
+        return len(line.encode())
+
+    def compact(self, commits):
+        """
+        Replace the whole log with the given commits (usually a snapshot of the current state).
+
+        The new log is written to a temporary file which then atomically replaces the old one,
+        so a crash part way through leaves the old log intact.
+
+        :param commits: a list of operation lists, one per commit
+        :return: the size (in bytes) of the new log
+        """
+        tmp_file_path = self.__file_path + '.tmp'
+        with open(tmp_file_path, mode='w', newline='') as f:
+            for ops in commits:
+                f.write(ChainLog.__encode(ops))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_path, self.__file_path)
+        self.__commit_count = len(commits)
+        return os.path.getsize(self.__file_path)
@@ -1,26 +1,33 @@
 from balance_manager import BalanceManager
 from blockchain import BlockChain
 import json
+from os import environ
 import re
-from utility.verification import Verification
 from wallet import Wallet
 
 
+# Identifies this node's wallet and data files
+NODE_ID = 'cmd_line'
+# Optional number of proof of work processes (defaults to one per core)
+MINING_WORKERS_ENV_VAR_NAME = 'miningWorkers'
+
 # Regex for validating transaction amount input
 int_pattern = re.compile('^[0-9]*$')
 float_pattern = re.compile('^[0-9]*.[0-9]*$')
 
 
 class Node:
-    def __init__(self):
-        self.wallet = Wallet()
+    def __init__(self, mining_workers=None):
+        self.wallet = Wallet(NODE_ID)
         self.block_chain = None
-        self.balance_manager = BalanceManager()
+        self.balance_manager = BalanceManager(NODE_ID)
+        self.mining_workers = mining_workers
 
     def init_block_chain(self):
-        self.block_chain = BlockChain(self.wallet.public_key)
+        self.block_chain = BlockChain(
+            self.wallet.public_key, NODE_ID, self.mining_workers, get_balance=self.balance_manager.get_balance)
         self.block_chain.load_data()
-        # Notice that we initialize balances using a copy of the chain (via getter)
+        # Notice that we initialize balances using a read-only view of the chain (via getter)
         self.balance_manager.initialize_balances(self.block_chain.chain)
 
     def process_input(self):
@@ -102,7 +109,7 @@ class Node:
                 else:
                     print('WARN: Failed to save wallet keys')
             elif option.upper() == 'V':
-                if not Verification.is_block_chain_valid(self.block_chain.chain):
+                if not self.block_chain.verify_chain(full=True):
                     print('ERROR: Blockchain is invalid...exiting')
                     finished = True
                 else:
@@ -132,6 +139,7 @@ class Node:
 
 
 if __name__ == '__main__':
-    node = Node()
+    workers = int(environ[MINING_WORKERS_ENV_VAR_NAME]) if MINING_WORKERS_ENV_VAR_NAME in environ else None
+    node = Node(workers)
     node.init_block_chain()
     node.process_input()
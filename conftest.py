@@ -0,0 +1 @@
+# Lets pytest import the modules at the root of the repository (e.g. when run as plain "pytest")
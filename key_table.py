@@ -0,0 +1,59 @@
+import threading
+
+
+class KeyId(int):
+    """
+    The id of a key in a KeyTable.
+
+    A type of its own, so an id can't be mistaken for a key that happens to be an int (e.g. sent by a client).
+    """
+    __slots__ = ()
+
+
+class KeyTable:
+    """
+    Table of participant keys, each given a small integer id.
+
+    Admitted transactions hold the id rather than the key itself, so each (long, hex) public key is
+    stored once however many transactions it appears in. Ids are never reused or removed, so only
+    keys of transactions admitted to the mempool or chain are added.
+    """
+
+    def __init__(self):
+        # Id -> key, and key -> id
+        self.__keys = []
+        self.__ids = {}
+        # Only taken when adding a key, so lookups of known keys never wait
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def intern(self, key):
+        """
+        Get the id of a key, adding the key to the table if it is new.
+
+        :param key: the participant key
+        :return: the key's id
+        """
+        key_id = self.__ids.get(key)
+        if key_id is None:
+            with self.__lock:
+                key_id = self.__ids.get(key)
+                if key_id is None:
+                    key_id = KeyId(len(self.__keys))
+                    # Add the key before publishing its id, so any id found can be looked up
+                    self.__keys.append(key)
+                    self.__ids[key] = key_id
+        return key_id
+
+    def key(self, key_id):
+        return self.__keys[key_id]
+
+    def id_of(self, key):
+        # Returns None (rather than adding the key) if the key isn't in the table
+        return self.__ids.get(key)
+
+
+# The table shared by every transaction in the process
+participant_keys = KeyTable()
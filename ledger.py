@@ -0,0 +1,163 @@
+""" Optional columnar (NumPy backed) ledger of confirmed transactions, for balance and analytics queries """
+from key_table import participant_keys
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional. Without it the columnar ledger is unavailable
+    np = None
+
+# Column name -> NumPy dtype. Each row is one confirmed transaction
+COLUMNS = [
+    ('sender', 'i8'),
+    ('recipient', 'i8'),
+    ('amount', 'f8'),
+    ('height', 'i8'),
+    ('timestamp', 'f8')
+]
+INITIAL_CAPACITY = 1024
+# Ways participants can be ranked by top()
+BY_BALANCE = 'balance'
+BY_VOLUME = 'volume'
+
+
+def is_available():
+    return np is not None
+
+
+class ColumnarLedger:
+    """
+    Every confirmed transaction held as rows of parallel arrays (sender and recipient key ids,
+    amount, block height and timestamp), appended to as blocks are added to the chain.
+
+    Balances and other aggregates are then computed by vectorized operations over the columns,
+    rather than by walking the chain. A height of H means the first H blocks of the chain.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError('The columnar ledger requires NumPy')
+        self.__size = 0
+        # Number of blocks whose transactions have been appended
+        self.__height = 0
+        self.__columns = {name: np.empty(INITIAL_CAPACITY, dtype=dtype) for name, dtype in COLUMNS}
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def height(self):
+        return self.__height
+
+    def clear(self):
+        self.__size = 0
+        self.__height = 0
+
+    def append_block(self, block):
+        """
+        Append the transactions of the next block in the chain.
+
+        :param block: the block, which must be at the ledger's current height
+        """
+        txns = block.txns
+        start = self.__size
+        end = start + len(txns)
+        self.__ensure_capacity(end)
+        columns = self.__columns
+        columns['sender'][start:end] = [txn.sender_id for txn in txns]
+        columns['recipient'][start:end] = [txn.recipient_id for txn in txns]
+        columns['amount'][start:end] = [txn.amount for txn in txns]
+        columns['height'][start:end] = block.idx
+        columns['timestamp'][start:end] = [txn.timestamp for txn in txns]
+        self.__size = end
+        self.__height = block.idx + 1
+
+    def balances(self, height=None):
+        """
+        Get every participant's balance.
+
+        :param height: the number of blocks to include (default is every block)
+        :return: a dictionary of participant -> balance, for each participant in those blocks
+        """
+        sent, received, counts = self.__totals(height)
+        return {participant_keys.key(key_id): float(received[key_id] - sent[key_id])
+                for key_id in np.flatnonzero(counts)}
+
+    def balance(self, participant, height=None):
+        """
+        Get a participant's balance.
+
+        :param participant: the participant's public key
+        :param height: the number of blocks to include (default is every block)
+        :return: the balance (0.0 if the participant has no transactions)
+        """
+        sent, received, count = self.volume(participant, height)
+        return received - sent
+
+    def volume(self, participant, height=None):
+        """
+        Get the totals a participant has sent and received.
+
+        :param participant: the participant's public key
+        :param height: the number of blocks to include (default is every block)
+        :return: a tuple of the total sent, the total received and the number of transactions taken part in
+        """
+        key_id = participant_keys.id_of(participant)
+        if key_id is None:
+            return 0.0, 0.0, 0
+        rows = self.__rows(height)
+        amount = self.__columns['amount'][:rows]
+        is_sender = self.__columns['sender'][:rows] == key_id
+        is_recipient = self.__columns['recipient'][:rows] == key_id
+        return (float(amount[is_sender].sum()), float(amount[is_recipient].sum()),
+                int(np.count_nonzero(is_sender | is_recipient)))
+
+    def top(self, count, by=BY_BALANCE, height=None):
+        """
+        Rank the participants.
+
+        :param count: the number of participants to return
+        :param by: BY_BALANCE, or BY_VOLUME (the total sent and received)
+        :param height: the number of blocks to include (default is every block)
+        :return: a list of (participant, value) tuples, highest value first
+        """
+        sent, received, counts = self.__totals(height)
+        values = received - sent if by == BY_BALANCE else received + sent
+        key_ids = np.flatnonzero(counts)
+        values = values[key_ids]
+        if count < len(key_ids):
+            # Only sort the top entries
+            top_pos = np.argpartition(-values, count)[:count]
+        else:
+            top_pos = np.arange(len(key_ids))
+        top_pos = top_pos[np.argsort(-values[top_pos], kind='stable')]
+        return [(participant_keys.key(key_ids[pos]), float(values[pos])) for pos in top_pos]
+
+    def __totals(self, height):
+        # Arrays, indexed by key id, of the totals sent and received and the number of transactions
+        rows = self.__rows(height)
+        sender = self.__columns['sender'][:rows]
+        recipient = self.__columns['recipient'][:rows]
+        amount = self.__columns['amount'][:rows]
+        key_count = len(participant_keys)
+        sent = np.bincount(sender, weights=amount, minlength=key_count)
+        received = np.bincount(recipient, weights=amount, minlength=key_count)
+        counts = np.bincount(sender, minlength=key_count) + np.bincount(recipient, minlength=key_count)
+        return sent, received, counts
+
+    def __rows(self, height):
+        # Number of rows in the first 'height' blocks (rows are in height order)
+        if height is None or height >= self.__height:
+            return self.__size
+        return int(np.searchsorted(self.__columns['height'][:self.__size], height, side='left'))
+
+    def __ensure_capacity(self, size):
+        capacity = len(self.__columns['amount'])
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, dtype in COLUMNS:
+            column = np.empty(capacity, dtype=dtype)
+            column[:self.__size] = self.__columns[name][:self.__size]
+            self.__columns[name] = column
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+# Eviction policies applied when a transaction is added to a full mempool
+EVICT_OLDEST = 'oldest'
+REJECT_NEW = 'reject'
+
+
+class Mempool:
+    """
+    The open (unconfirmed) transactions, keyed by id and kept in the order they were added.
+
+    Running totals of the amounts each participant sends and receives in the open transactions,
+    and the transactions each participant takes part in, are maintained as transactions are added and removed.
+    """
+
+    def __init__(self, max_size, eviction_policy=EVICT_OLDEST):
+        self.__max_size = max_size
+        self.__eviction_policy = eviction_policy
+        # Transaction id -> Transaction, oldest first
+        self.__txns = OrderedDict()
+        # Participant -> [total sent, total received, number of transactions they take part in]
+        self.__totals = {}
+        # Participant -> {transaction id -> Transaction} of the transactions they take part in, oldest first
+        self.__participant_txns = {}
+
+    def __len__(self):
+        return len(self.__txns)
+
+    def __contains__(self, txn_id):
+        return txn_id in self.__txns
+
+    def __iter__(self):
+        return iter(self.__txns.values())
+
+    def txns(self):
+        # A read-only, live view of the transactions (so nothing is copied)
+        return self.__txns.values()
+
+    def get(self, txn_id):
+        return self.__txns.get(txn_id)
+
+    def participants(self):
+        return self.__totals.keys()
+
+    def txns_of(self, participant):
+        """
+        Get the transactions a participant sends or receives.
+
+        :param participant: the participant's public key
+        :return: a list of the transactions, oldest first
+        """
+        return list(self.__participant_txns.get(participant, {}).values())
+
+    def net_sent(self, participant):
+        """
+        Get a participant's obligation if all the open transactions are netted.
+
+        :param participant: the participant's public key
+        :return: the total the participant sends less the total they receive
+        """
+        totals = self.__totals.get(participant)
+        return totals[0] - totals[1] if totals is not None else 0.0
+
+    def add(self, txn):
+        """
+        Add a transaction, making room for it if the mempool is full.
+
+        :param txn: the transaction to add
+        :return: a list of the transactions evicted to make room, or None if the transaction was not added
+        """
+        if txn.txn_id in self.__txns:
+            # (e.g. the same transaction received from more than one peer)
+            print('WARN: The transaction is already open')
+            return None
+
+        evicted = []
+        if len(self.__txns) >= self.__max_size:
+            if self.__eviction_policy == REJECT_NEW:
+                print('WARN: Open transactions are full. Transaction rejected')
+                return None
+            while len(self.__txns) >= self.__max_size:
+                evicted_txn = self.__txns.popitem(last=False)[1]
+                self.__update_totals(evicted_txn, -1)
+                evicted.append(evicted_txn)
+            print('WARN: Open transactions are full. Evicted {} oldest transaction(s)'.format(len(evicted)))
+
+        txn.intern_keys()
+        self.__txns[txn.txn_id] = txn
+        self.__update_totals(txn, 1)
+        return evicted
+
+    def remove(self, txn_id):
+        """
+        Remove a transaction.
+
+        :param txn_id: the id of the transaction to remove
+        :return: the removed transaction, or None if there was no transaction with the id
+        """
+        txn = self.__txns.pop(txn_id, None)
+        if txn is not None:
+            self.__update_totals(txn, -1)
+        return txn
+
+    def remove_all(self, txn_ids):
+        """
+        Remove every transaction with one of the given ids.
+
+        :param txn_ids: the ids of the transactions to remove
+        :return: a list of the removed transactions
+        """
+        removed = [self.remove(txn_id) for txn_id in txn_ids]
+        return [txn for txn in removed if txn is not None]
+
+    def clear(self):
+        self.__txns.clear()
+        self.__totals.clear()
+        self.__participant_txns.clear()
+
+    def __update_totals(self, txn, direction):
+        # direction is 1 when a transaction is added and -1 when it is removed
+        for participant, total_pos in [(txn.sender, 0), (txn.recipient, 1)]:
+            totals = self.__totals.setdefault(participant, [0.0, 0.0, 0])
+            totals[total_pos] += direction * txn.amount
+            totals[2] += direction
+            if direction > 0:
+                self.__participant_txns.setdefault(participant, {})[txn.txn_id] = txn
+            else:
+                self.__participant_txns[participant].pop(txn.txn_id, None)
+            if totals[2] == 0:
+                # Drop participants with no open transactions (which also discards any float rounding residue)
+                del self.__totals[participant]
+                del self.__participant_txns[participant]
@@ -0,0 +1,246 @@
+""" Hand-rolled counters, gauges and histograms, exposed in the Prometheus text format """
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+import math
+import threading
+from time import perf_counter
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Default histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Histogram bucket upper bounds for sizes, in bytes (1 KB to 64 MB)
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(9))
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    # A list of (name, value) tuples -> '{name="value",...}' (or '' if there are no labels)
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+class Registry:
+    """
+    The set of metrics rendered together (e.g. by a /metrics endpoint).
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__metrics = {}
+
+    def register(self, metric):
+        with self.__lock:
+            if metric.name in self.__metrics:
+                raise ValueError('Metric {} is already registered'.format(metric.name))
+            self.__metrics[metric.name] = metric
+
+    def render(self):
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        return ''.join(metric.render() for metric in metrics)
+
+
+# The registry metrics are added to unless another is given
+registry = Registry()
+
+
+class Metric(ABC):
+    """
+    Base for a metric, which holds a separate value (a child) for each combination of label values.
+
+    Call labels() once, up front, and keep the child where possible, so that recording a value is
+    only a lock and an addition. A metric without labels can be recorded to directly.
+    """
+
+    # The Prometheus type of the metric
+    TYPE = 'untyped'
+
+    def __init__(self, name, description, label_names=(), metric_registry=None):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        # Label values -> child
+        self.__children = {}
+        # Unlabelled metrics are rendered (as zero) even before anything is recorded
+        self.__default_child = self.labels() if len(self.label_names) == 0 else None
+        (registry if metric_registry is None else metric_registry).register(self)
+
+    def labels(self, *label_values):
+        if len(label_values) != len(self.label_names):
+            raise ValueError('Metric {} expects {} label value(s)'.format(self.name, len(self.label_names)))
+        label_values = tuple(str(value) for value in label_values)
+        child = self.__children.get(label_values)
+        if child is None:
+            with self._lock:
+                child = self.__children.setdefault(label_values, self._new_child())
+        return child
+
+    def _default(self):
+        # The child of a metric without labels
+        if self.__default_child is None:
+            raise ValueError('Metric {} needs label values (see labels())'.format(self.name))
+        return self.__default_child
+
+    @abstractmethod
+    def _new_child(self):
+        # A child holding the initial value for one combination of label values
+        pass
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE {} {}'.format(self.name, self.TYPE)]
+        with self._lock:
+            children = sorted(self.__children.items())
+            samples = [(label_values, child.samples()) for label_values, child in children]
+        for label_values, child_samples in samples:
+            labels = list(zip(self.label_names, label_values))
+            for suffix, extra_labels, value in child_samples:
+                lines.append('{}{}{} {}'.format(self.name, suffix, format_labels(labels + extra_labels),
+                                                format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class _Value:
+    # A single number (the child of a counter or gauge)
+    __slots__ = ('__lock', '__value')
+
+    def __init__(self, lock):
+        self.__lock = lock
+        self.__value = 0.0
+
+    @property
+    def value(self):
+        return self.__value
+
+    def inc(self, amount=1.0):
+        with self.__lock:
+            self.__value += amount
+
+    def set(self, value):
+        with self.__lock:
+            self.__value = value
+
+    def samples(self):
+        # Must be called holding the lock
+        return [('', [], self.__value)]
+
+
+class Counter(Metric):
+    """
+    A total that only increases (e.g. a number of requests).
+    """
+
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def inc(self, amount=1.0):
+        if amount < 0:
+            raise ValueError('Counter {} can only increase'.format(self.name))
+        self._default().inc(amount)
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down (e.g. a queue size).
+    """
+
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+
+class _HistogramValue:
+    # Counts of observations per bucket (the child of a histogram)
+    __slots__ = ('__lock', '__bounds', '__counts', '__sum')
+
+    def __init__(self, lock, bounds):
+        self.__lock = lock
+        self.__bounds = bounds
+        # One count per bucket, plus one for observations above the largest bound
+        self.__counts = [0] * (len(bounds) + 1)
+        self.__sum = 0.0
+
+    def observe(self, value):
+        # Bucket bounds are inclusive upper bounds
+        bucket_pos = bisect_left(self.__bounds, value)
+        with self.__lock:
+            self.__counts[bucket_pos] += 1
+            self.__sum += value
+
+    @contextmanager
+    def time(self):
+        # Observe the seconds taken by the body of a with statement
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def timed(self, func):
+        # Decorator that observes the seconds taken by each call of a function
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(perf_counter() - start)
+        return timed_func
+
+    def samples(self):
+        # Must be called holding the lock. Prometheus buckets are cumulative
+        samples = []
+        cumulative_count = 0
+        for bound, count in zip(self.__bounds + (math.inf,), self.__counts):
+            cumulative_count += count
+            samples.append(('_bucket', [('le', format_value(bound))], cumulative_count))
+        samples.append(('_sum', [], self.__sum))
+        samples.append(('_count', [], cumulative_count))
+        return samples
+
+
+class Histogram(Metric):
+    """
+    Counts of observations (e.g. request latencies) falling into buckets, with their sum.
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS, metric_registry=None):
+        self.__buckets = tuple(sorted(buckets))
+        super().__init__(name, description, label_names, metric_registry)
+
+    def _new_child(self):
+        return _HistogramValue(self._lock, self.__buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def timed(self, func):
+        return self._default().timed(func)
@@ -0,0 +1,168 @@
+from collections import OrderedDict
+import itertools
+import threading
+from time import time
+
+# Job statuses
+RUNNING = 'running'
+MINED = 'mined'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+# Number of finished jobs remembered (so their results can still be fetched)
+FINISHED_JOBS_KEPT = 100
+
+
+class MiningJob:
+    """
+    A block being mined in the background.
+
+    The job's proof of work search can be stopped at any time, either to cancel the job or
+    to restart it against a new tip of the chain.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = RUNNING
+        self.started = time()
+        self.finished = None
+        # Nonces tried by the current proof of work search, and how many times the search has been restarted
+        self.attempts = 0
+        self.restarts = 0
+        self.block = None
+        # Set to stop the current search (see cancel_requested and restart_requested for why)
+        self.stop = threading.Event()
+        self.cancel_requested = False
+        self.restart_requested = False
+        self.__done = threading.Event()
+
+    def record_progress(self, attempts):
+        self.attempts = attempts
+
+    def finish(self, status, block=None):
+        self.status = status
+        self.block = block
+        self.finished = time()
+        self.__done.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the job to finish.
+
+        :param timeout: the maximum number of seconds to wait (default is no limit)
+        :return: True if the job has finished
+        """
+        return self.__done.wait(timeout)
+
+    def to_dict(self):
+        dict_job = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'restarts': self.restarts,
+            'elapsed': (self.finished or time()) - self.started
+        }
+        if self.block is not None:
+            dict_job['block'] = self.block.to_dict()
+        return dict_job
+
+
+class MiningJobs:
+    """
+    Runs mining jobs, one at a time, each on its own background thread.
+    """
+
+    def __init__(self, mine):
+        """
+        :param mine: function(stop, record_progress) that mines a block on the current tip, returning the block,
+                     or None if it failed or the 'stop' event was set before the block was added to the chain
+        """
+        self.__mine = mine
+        self.__lock = threading.Lock()
+        self.__job_ids = itertools.count(1)
+        # Job id -> job, oldest first
+        self.__jobs = OrderedDict()
+        self.__running_job = None
+
+    def start(self):
+        """
+        Start mining a block, unless a job is already running.
+
+        :return: a tuple of the job and whether it was started by this call
+        """
+        with self.__lock:
+            if self.__running_job is not None:
+                return self.__running_job, False
+            job = MiningJob(next(self.__job_ids))
+            self.__jobs[job.job_id] = job
+            self.__running_job = job
+            self.__forget_finished_jobs()
+        threading.Thread(target=self.__run, args=(job,), name='mining-job-{}'.format(job.job_id), daemon=True).start()
+        return job, True
+
+    def get(self, job_id):
+        with self.__lock:
+            return self.__jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Its search stops, and it is reported as cancelled, within moments.
+
+        :param job_id: the id of the job
+        :return: the job (None if there is no such job)
+        """
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            if job is not None and job.status == RUNNING:
+                job.cancel_requested = True
+                job.stop.set()
+        return job
+
+    def restart(self):
+        # The tip of the chain has changed under the running job (if there is one), so its work is wasted
+        with self.__lock:
+            job = self.__running_job
+            if job is not None:
+                job.restart_requested = True
+                job.stop.set()
+
+    def __run(self, job):
+        while True:
+            with self.__lock:
+                if job.cancel_requested:
+                    self.__finish(job, CANCELLED)
+                    return
+                job.restart_requested = False
+                job.stop.clear()
+                job.attempts = 0
+
+            try:
+                block = self.__mine(job.stop, job.record_progress)
+            except Exception as e:
+                print('ERROR: Mining job {} failed: {}'.format(job.job_id, e))
+                block = None
+
+            with self.__lock:
+                # A block that made it into the chain counts, even if the job was stopped at the last moment
+                if block is not None:
+                    self.__finish(job, MINED, block)
+                    return
+                elif job.cancel_requested:
+                    self.__finish(job, CANCELLED)
+                    return
+                elif not job.restart_requested:
+                    self.__finish(job, FAILED)
+                    return
+                job.restarts += 1
+
+    def __finish(self, job, status, block=None):
+        # Must be called holding the lock
+        job.finish(status, block)
+        self.__running_job = None
+
+    def __forget_finished_jobs(self):
+        # Must be called holding the lock
+        while len(self.__jobs) > FINISHED_JOBS_KEPT:
+            oldest_job_id = next(iter(self.__jobs))
+            if self.__jobs[oldest_job_id].status == RUNNING:
+                break
+            del self.__jobs[oldest_job_id]
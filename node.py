@@ -1,25 +1,100 @@
 from balance_manager import BalanceManager
+import binary_codec
+from block import Block
 from blockchain import BlockChain
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, g, jsonify, request, Response, send_from_directory
 from flask_cors import CORS
 from http import HTTPStatus
+import json
+import ledger
+import math
+import metrics
+from mining_jobs import CANCELLED, FAILED, MINED, MiningJobs
 from os import environ
+from time import perf_counter, time
+from transaction import Transaction
 from typing import Optional
+from utility.rw_lock import ReadWriteLock
+from utility.verification import Verification
 from wallet import Wallet
+import zlib
 
 HOST_ENV_VAR_NAME = 'hostName'
 PORT_ENV_VAR_NAME = 'port'
+# Optional number of proof of work processes (defaults to one per core)
+MINING_WORKERS_ENV_VAR_NAME = 'miningWorkers'
+# Optional flag ('true') to fully validate the block chain at startup, ignoring the saved checkpoint
+VERIFY_ON_LOAD_ENV_VAR_NAME = 'verifyOnLoad'
+# Optional flag ('true') to keep a columnar ledger of confirmed transactions for the /ledger queries (needs NumPy)
+LEDGER_ENV_VAR_NAME = 'columnarLedger'
+# Maximum number of blocks, and of block hashes, returned by a single chain page request
+CHAIN_PAGE_MAX_SIZE = 500
+CHAIN_HEADERS_MAX_SIZE = 2000
+# Compression level used for gzip encoded chain responses
+CHAIN_GZIP_LEVEL = 6
+# Maximum (and default) number of confirmed transactions returned by a single /history page
+HISTORY_PAGE_MAX_SIZE = 100
+# Number of participants returned by /ledger/top unless a count is given
+LEDGER_TOP_DEFAULT_COUNT = 10
+# Maximum number of transactions in a single /transactions/batch request
+TXN_BATCH_MAX_SIZE = 1000
+# Seconds a request to cancel a mining job waits for the job to stop
+MINING_CANCEL_WAIT = 1.0
+# Number of blocks /chain reads each time it takes the state lock while streaming the chain
+CHAIN_STREAM_RUN_SIZE = 100
+# Returned when a transaction's amount isn't a positive number (e.g. a string from a hand-written request)
+INVALID_AMOUNT_MESSAGE = 'Transaction amount must be a positive number'
+# Returned when a transaction received from a peer has a timestamp that isn't a number
+INVALID_TIMESTAMP_MESSAGE = 'Transaction timestamp must be a number'
+# Returned when a transaction's sender or recipient isn't a public key (i.e. not a string)
+INVALID_KEY_MESSAGE = 'Transaction sender and recipient must be strings'
+
+REQUEST_SECONDS = metrics.Histogram(
+    'pycoin_http_request_seconds', 'Time taken to handle API requests', ['method', 'route', 'status'])
+CHAIN_HEIGHT = metrics.Gauge('pycoin_chain_height', 'Number of blocks in the block chain')
+MEMPOOL_SIZE = metrics.Gauge('pycoin_mempool_size', 'Number of open transactions')
 
 py_coin_app = Flask(__name__)
 CORS(py_coin_app)
+# Requests are handled on many threads. Those that only read the block chain, balances and wallet hold this
+# lock for reading, so they run in parallel, while those that change them hold it for writing, one at a time
+state_lock = ReadWriteLock()
+# Add a type hint so that IDE is able to suggest auto-completion options
+block_chain: Optional[BlockChain] = None
 
 
 def init_block_chain():
     global block_chain
-    block_chain = BlockChain(wallet.public_key, node_id)
-    block_chain.load_data()
-    # Notice that we initialize balances using a copy of the chain (via getter)
+    previous_block_chain = block_chain
+    block_chain = BlockChain(wallet.public_key, node_id, mining_workers, get_balance=balance_manager.get_balance,
+                             on_new_tip=mining_jobs.restart, lock=state_lock)
+    block_chain.load_data(verify_on_load)
+    # Notice that we initialize balances using a read-only view of the chain (via getter)
     balance_manager.initialize_balances(block_chain.chain)
+    # Any running mining job is now working on the previous chain
+    mining_jobs.restart()
+    if previous_block_chain is not None:
+        previous_block_chain.close()
+
+
+def mine_block(stop, record_progress):
+    # Runs on a mining job's thread. The block chain takes the state lock itself, other than during the
+    # proof of work search, and balances are updated (now transactions are confirmed) while it is held
+    return block_chain.mine_block(balance_manager.get_balance, stop, record_progress,
+                                  balance_manager.update_balances_for_block)
+
+
+@py_coin_app.before_request
+def start_request_timer():
+    g.request_start = perf_counter()
+
+
+@py_coin_app.after_request
+def record_request_time(response):
+    # Streamed responses (e.g. /chain) are timed up to the start of their body
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(perf_counter() - g.request_start)
+    return response
 
 
 @py_coin_app.route('/', methods=['GET'])
@@ -33,6 +108,7 @@ def get_network_ui():
 
 
 @py_coin_app.route('/wallet', methods=['POST'])
+@state_lock.write_locked()
 def create_keys():
     wallet.create_keys()
     if wallet.save_keys():
@@ -51,6 +127,7 @@ def create_keys():
 
 
 @py_coin_app.route('/wallet', methods=['GET'])
+@state_lock.write_locked()
 def load_keys():
     if wallet.load_keys():
         init_block_chain()
@@ -68,6 +145,7 @@ def load_keys():
 
 
 @py_coin_app.route('/balance', methods=['GET'])
+@state_lock.read_locked()
 def get_balance():
     response = {
         'balance': balance_manager.get_balance(wallet.public_key)
@@ -76,6 +154,7 @@ def get_balance():
 
 
 @py_coin_app.route('/transactions', methods=['POST'])
+@state_lock.write_locked()
 def add_transaction():
     # Respond straight away if wallet keys are not available
     if wallet.public_key is None:
@@ -99,12 +178,18 @@ def add_transaction():
         }
         return jsonify(response), HTTPStatus.BAD_REQUEST
 
+    if not isinstance(req_body['recipient'], str):
+        return invalid_key()
+    if not Verification.is_amount_valid(req_body['amount']):
+        return invalid_amount()
+
     signature = wallet.sign_txn(wallet.public_key, req_body['recipient'], req_body['amount'])
     added_txn = block_chain.add_transaction(wallet.public_key, req_body['recipient'], req_body['amount'], signature)
     if added_txn is not None:
         response = {
             'message': 'Transaction added successfully',
-            'txn': added_txn.__dict__.copy()
+            'txn_id': added_txn.txn_id,
+            'txn': added_txn.to_ordered_dict()
         }
         return jsonify(response), HTTPStatus.CREATED
     else:
@@ -114,15 +199,234 @@ def add_transaction():
         return jsonify(response), HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+def invalid_amount():
+    response = {
+        'message': INVALID_AMOUNT_MESSAGE
+    }
+    return jsonify(response), HTTPStatus.BAD_REQUEST
+
+
+def invalid_timestamp():
+    response = {
+        'message': INVALID_TIMESTAMP_MESSAGE
+    }
+    return jsonify(response), HTTPStatus.BAD_REQUEST
+
+
+def invalid_key():
+    response = {
+        'message': INVALID_KEY_MESSAGE
+    }
+    return jsonify(response), HTTPStatus.BAD_REQUEST
+
+
+@py_coin_app.route('/transactions/batch', methods=['POST'])
+@state_lock.write_locked()
+def add_transactions():
+    # Respond straight away if wallet keys are not available
+    if wallet.public_key is None:
+        response = {
+            'message': 'Failed to add transactions. Wallet contains no keys'
+        }
+        return jsonify(response), HTTPStatus.CONFLICT
+
+    req_body = request.get_json()
+    if not req_body or not isinstance(req_body.get('txns'), list) or len(req_body['txns']) == 0:
+        response = {
+            'message': 'No transactions contained in request'
+        }
+        return jsonify(response), HTTPStatus.BAD_REQUEST
+    if len(req_body['txns']) > TXN_BATCH_MAX_SIZE:
+        response = {
+            'message': 'A batch can contain at most {} transactions'.format(TXN_BATCH_MAX_SIZE)
+        }
+        return jsonify(response), HTTPStatus.BAD_REQUEST
+
+    # Sign each well formed item, then add them all together (so they are saved once and broadcast as one batch)
+    required_fields = ['recipient', 'amount']
+    results = [None] * len(req_body['txns'])
+    txns = []
+    txn_positions = []
+    # Repeats of the same payment are told apart by their timestamps, so make sure no two items share one
+    # (the clock may not advance between items)
+    timestamp = 0.0
+    for pos, item in enumerate(req_body['txns']):
+        if not isinstance(item, dict) or not all(field in item for field in required_fields):
+            results[pos] = {
+                'added': False,
+                'message': 'Transaction data is missing one or more required fields: {}'.format(required_fields)
+            }
+            continue
+        if not isinstance(item['recipient'], str):
+            results[pos] = {
+                'added': False,
+                'message': INVALID_KEY_MESSAGE
+            }
+            continue
+        if not Verification.is_amount_valid(item['amount']):
+            results[pos] = {
+                'added': False,
+                'message': INVALID_AMOUNT_MESSAGE
+            }
+            continue
+        signature = wallet.sign_txn(wallet.public_key, item['recipient'], item['amount'])
+        timestamp = max(time(), math.nextafter(timestamp, math.inf))
+        txns.append(Transaction(wallet.public_key, item['recipient'], item['amount'], signature, timestamp))
+        txn_positions.append(pos)
+
+    added_count = 0
+    for pos, added_txn in zip(txn_positions, block_chain.add_transactions(txns)):
+        if added_txn is not None:
+            results[pos] = {
+                'added': True,
+                'txn_id': added_txn.txn_id,
+                'txn': added_txn.to_ordered_dict()
+            }
+            added_count += 1
+        else:
+            results[pos] = {
+                'added': False,
+                'message': 'Failed to add transaction'
+            }
+
+    response = {
+        'message': '{} of {} transactions added successfully'.format(added_count, len(results)),
+        'results': results
+    }
+    return jsonify(response), HTTPStatus.CREATED if added_count > 0 else HTTPStatus.OK
+
+
 @py_coin_app.route('/transactions', methods=['GET'])
+@state_lock.read_locked()
 def get_transactions():
-    dict_txns = [txn.__dict__ for txn in block_chain.open_txns]
+    dict_txns = [txn.to_ordered_dict() for txn in block_chain.open_txns]
     return jsonify(dict_txns), HTTPStatus.OK
 
 
+@py_coin_app.route('/ledger/balances', methods=['GET'])
+@state_lock.read_locked()
+def get_ledger_balances():
+    columnar_ledger = balance_manager.ledger
+    if columnar_ledger is None:
+        return ledger_unavailable()
+
+    # Optionally the balances as they were after the first 'height' blocks
+    height = request.args.get('height', type=int)
+    response = {
+        'height': columnar_ledger.height if height is None else min(height, columnar_ledger.height),
+        'balances': columnar_ledger.balances(height)
+    }
+    return jsonify(response), HTTPStatus.OK
+
+
+@py_coin_app.route('/ledger/participants/<public_key>', methods=['GET'])
+@state_lock.read_locked()
+def get_ledger_participant(public_key):
+    columnar_ledger = balance_manager.ledger
+    if columnar_ledger is None:
+        return ledger_unavailable()
+
+    height = request.args.get('height', type=int)
+    sent, received, txn_count = columnar_ledger.volume(public_key, height)
+    response = {
+        'height': columnar_ledger.height if height is None else min(height, columnar_ledger.height),
+        'balance': received - sent,
+        'sent': sent,
+        'received': received,
+        'txn_count': txn_count
+    }
+    return jsonify(response), HTTPStatus.OK
+
+
+@py_coin_app.route('/ledger/top', methods=['GET'])
+@state_lock.read_locked()
+def get_ledger_top():
+    columnar_ledger = balance_manager.ledger
+    if columnar_ledger is None:
+        return ledger_unavailable()
+
+    by = request.args.get('by', ledger.BY_BALANCE)
+    if by not in [ledger.BY_BALANCE, ledger.BY_VOLUME]:
+        response = {
+            'message': 'Participants can only be ranked by: {}'.format([ledger.BY_BALANCE, ledger.BY_VOLUME])
+        }
+        return jsonify(response), HTTPStatus.BAD_REQUEST
+
+    count = max(request.args.get('count', LEDGER_TOP_DEFAULT_COUNT, type=int), 0)
+    height = request.args.get('height', type=int)
+    response = {
+        'height': columnar_ledger.height if height is None else min(height, columnar_ledger.height),
+        'by': by,
+        'participants': [{'participant': participant, by: value}
+                         for participant, value in columnar_ledger.top(count, by, height)]
+    }
+    return jsonify(response), HTTPStatus.OK
+
+
+def ledger_unavailable():
+    response = {
+        'message': 'Columnar ledger is not enabled on this node (set {}=true, requires NumPy)'.format(
+            LEDGER_ENV_VAR_NAME)
+    }
+    return jsonify(response), HTTPStatus.NOT_IMPLEMENTED
+
+
+@py_coin_app.route('/transactions/<txn_id>', methods=['GET'])
+@state_lock.read_locked()
+def get_transaction(txn_id):
+    # A transaction's id is a hash of the whole transaction (see Transaction.txn_id), as given when it was added
+    found = block_chain.find_txn(txn_id)
+    if found is None:
+        response = {
+            'message': 'No transaction found with id: {}'.format(txn_id)
+        }
+        return jsonify(response), HTTPStatus.NOT_FOUND
+
+    txn, height, position = found
+    response = {
+        'status': 'pending' if height is None else 'confirmed',
+        'height': height,
+        'position': position,
+        # The number of blocks from (and including) the transaction's block to the tip
+        'confirmations': 0 if height is None else len(block_chain.chain) - height,
+        'txn_id': txn.txn_id,
+        'txn': txn.to_ordered_dict()
+    }
+    return jsonify(response), HTTPStatus.OK
+
+
+@py_coin_app.route('/history/<public_key>', methods=['GET'])
+@state_lock.read_locked()
+def get_history(public_key):
+    # Confirmed transactions are returned newest first, a page at a time (offset=<count>&limit=<count>).
+    # Open transactions are always included in full (the mempool is bounded)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_MAX_SIZE, type=int), 0), HISTORY_PAGE_MAX_SIZE)
+    open_txns, confirmed_txns, confirmed_count = block_chain.get_history(public_key, offset, limit)
+    chain_length = len(block_chain.chain)
+    response = {
+        'pending': [txn.to_ordered_dict() for txn in open_txns],
+        'confirmed': [{
+            'height': height,
+            'position': position,
+            'confirmations': chain_length - height,
+            'txn_id': txn.txn_id,
+            'txn': txn.to_ordered_dict()
+        } for height, position, txn in confirmed_txns],
+        'confirmed_count': confirmed_count,
+        'offset': offset,
+        'limit': limit
+    }
+    return jsonify(response), HTTPStatus.OK
+
+
 @py_coin_app.route('/resolve', methods=['POST'])
 def resolve_conflicts():
-    replaced = block_chain.resolve_block_chain()
+    # The block chain takes the state lock itself, other than while peers' chains are downloaded.
+    # Balances are rebuilt (from the latest snapshot that is still part of the new chain) while it is held
+    resolving_block_chain = block_chain
+    replaced = resolving_block_chain.resolve_block_chain(
+        lambda: balance_manager.initialize_balances(resolving_block_chain.chain))
     response = {
         'message': 'Local block chain was {}'.format('replaced' if replaced else 'kept')
     }
@@ -130,6 +434,7 @@ def resolve_conflicts():
 
 
 @py_coin_app.route('/mine', methods=['POST'])
+@state_lock.read_locked()
 def mine():
     if block_chain.resolve_conflicts:
         response = {
@@ -137,38 +442,168 @@ def mine():
         }
         return jsonify(response), HTTPStatus.CONFLICT
 
-    mined_block = block_chain.mine_block(balance_manager.get_balance)
-    if mined_block is not None:
-        # Now transactions are confirmed, update balances
-        balance_manager.update_balances_for_block(mined_block)
-        dict_block = mined_block.__dict__.copy()
-        dict_block['txns'] = [txn.__dict__ for txn in dict_block['txns']]
-        response = {
-            'message': 'Block mined successfully',
-            'block': dict_block,
-            'funds_available': balance_manager.get_balance(wallet.public_key)
-        }
-        return jsonify(response), HTTPStatus.CREATED
-    else:
+    if wallet.public_key is None:
         response = {
             'message': 'Mine block failed',
-            'wallet_initialized': wallet.public_key is not None
+            'wallet_initialized': False
         }
         return jsonify(response), HTTPStatus.INTERNAL_SERVER_ERROR
 
+    # Mining runs in the background. Its progress and result are fetched from /mine/<job_id>
+    job, started = mining_jobs.start()
+    response = {
+        'message': 'Mining job started' if started else 'Mining job already running',
+        'job': job.to_dict()
+    }
+    return jsonify(response), HTTPStatus.ACCEPTED
+
+
+@py_coin_app.route('/mine/<int:job_id>', methods=['GET'])
+@state_lock.read_locked()
+def get_mining_job(job_id):
+    job = mining_jobs.get(job_id)
+    if job is None:
+        return mining_job_not_found()
+    return jsonify(mining_job_response(job)), HTTPStatus.OK
+
+
+@py_coin_app.route('/mine/<int:job_id>', methods=['DELETE'])
+def cancel_mining_job(job_id):
+    job = mining_jobs.cancel(job_id)
+    if job is None:
+        return mining_job_not_found()
+    # Wait without holding the state lock, which the job may need in order to stop
+    job.wait(MINING_CANCEL_WAIT)
+    with state_lock.read_locked():
+        return jsonify(mining_job_response(job)), HTTPStatus.OK
+
+
+def mining_job_response(job):
+    messages = {
+        MINED: 'Block mined successfully',
+        FAILED: 'Mine block failed',
+        CANCELLED: 'Mining job cancelled'
+    }
+    return {
+        'message': messages.get(job.status, 'Mining in progress'),
+        'job': job.to_dict(),
+        'funds_available': balance_manager.get_balance(wallet.public_key)
+    }
+
+
+def mining_job_not_found():
+    response = {
+        'message': 'Mining job not found'
+    }
+    return jsonify(response), HTTPStatus.NOT_FOUND
+
 
 @py_coin_app.route('/chain', methods=['GET'])
+@state_lock.read_locked()
 def get_chain():
     chain_snapshot = block_chain.chain
-    # Our Block and Transaction objects are not JSON serializable
-    # so we must convert them into dictionaries
-    dict_chain = [block.__dict__.copy() for block in chain_snapshot]
-    for dict_block in dict_chain:
-        dict_block['txns'] = [txn.__dict__ for txn in dict_block['txns']]
-    return jsonify(dict_chain), HTTPStatus.OK
+    start_idx = 0
+    end_idx = len(chain_snapshot)
+    # Peers syncing the chain request it a page at a time (from=<idx>&limit=<count>)
+    if 'from' in request.args or 'limit' in request.args:
+        start_idx = min(max(request.args.get('from', 0, type=int), 0), end_idx)
+        limit = min(max(request.args.get('limit', CHAIN_PAGE_MAX_SIZE, type=int), 0), CHAIN_PAGE_MAX_SIZE)
+        end_idx = min(start_idx + limit, end_idx)
+
+    # Peers can ask for the compact binary encoding. JSON remains the default (e.g. for the UI)
+    use_binary = request.accept_mimetypes.best_match(['application/json', binary_codec.MEDIA_TYPE]) == \
+        binary_codec.MEDIA_TYPE
+    # A client can refuse gzip by giving it a quality of 0 (e.g. 'gzip;q=0')
+    use_gzip = request.accept_encodings.quality('gzip') > 0
+    # The tip hash identifies the whole chain, so if it hasn't changed the client's copy is still current
+    etag = block_chain.tip_hash() + ('-bin' if use_binary else '') + ('-gzip' if use_gzip else '')
+    if request.if_none_match.contains(etag):
+        response = Response(status=HTTPStatus.NOT_MODIFIED)
+    else:
+        # The body is generated after this returns (and the state lock is released), so note the last block
+        # it should end with, in case the chain is replaced as it is sent
+        last_hash = chain_snapshot.hash_at(end_idx - 1) if end_idx > start_idx else None
+        if use_binary:
+            body = stream_raw_blocks(chain_snapshot, start_idx, end_idx, last_hash)
+        else:
+            body = stream_blocks(chain_snapshot, start_idx, end_idx, last_hash)
+        response = Response(gzip_stream(body) if use_gzip else body,
+                            mimetype=binary_codec.MEDIA_TYPE if use_binary else 'application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['X-Chain-Length'] = str(len(chain_snapshot))
+    return response
+
+
+def stream_blocks(chain_snapshot, start_idx, end_idx, last_hash):
+    # Generate the JSON array one block at a time, so the whole chain is never held in memory.
+    # Our Block and Transaction objects are not JSON serializable, so each block is converted to a dictionary
+    yield b'['
+    block_count = 0
+    for dict_blocks in read_block_runs(chain_snapshot, start_idx, end_idx, last_hash,
+                                       lambda idx: chain_snapshot[idx].to_dict()):
+        for dict_block in dict_blocks:
+            yield (b',' if block_count > 0 else b'') + json.dumps(dict_block).encode()
+            block_count += 1
+    # An incomplete chain is left as invalid JSON, rather than passed off as the whole chain
+    if block_count == end_idx - start_idx:
+        yield b']'
+
+
+def stream_raw_blocks(chain_snapshot, start_idx, end_idx, last_hash):
+    # Blocks are stored in the binary encoding, so they are sent as stored without being decoded
+    for raw_blocks in read_block_runs(chain_snapshot, start_idx, end_idx, last_hash, chain_snapshot.raw_block):
+        for raw_block in raw_blocks:
+            yield binary_codec.frame(raw_block)
+
+
+def read_block_runs(chain_snapshot, start_idx, end_idx, last_hash, read_block):
+    # Read the blocks a run at a time, holding the state lock only while each run is read (not while it is sent).
+    # Stops early if the chain no longer ends the way it did when the request was handled (i.e. it was replaced)
+    for run_start_idx in range(start_idx, end_idx, CHAIN_STREAM_RUN_SIZE):
+        with state_lock.read_locked():
+            if len(chain_snapshot) < end_idx or chain_snapshot.hash_at(end_idx - 1) != last_hash:
+                print('WARN: Block chain was replaced while being sent. Response is incomplete')
+                return
+            run = [read_block(idx) for idx in range(run_start_idx, min(run_start_idx + CHAIN_STREAM_RUN_SIZE, end_idx))]
+        yield run
+
+
+def gzip_stream(chunks):
+    # Compress a stream of bytes as it is generated (wbits of 31 selects the gzip format)
+    compressor = zlib.compressobj(CHAIN_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@py_coin_app.route('/chain/headers', methods=['GET'])
+@state_lock.read_locked()
+def get_chain_headers():
+    # Block hashes (read from the block index) used by peers to find where their chain diverges from ours.
+    # Hashes start from the given index, or from the fork point of a comma separated block locator
+    chain_snapshot = block_chain.chain
+    locator = request.args.get('locator')
+    if locator is not None:
+        start_idx = block_chain.find_fork([block_hash for block_hash in locator.split(',') if block_hash])
+    else:
+        start_idx = max(request.args.get('from', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', CHAIN_HEADERS_MAX_SIZE, type=int), 0), CHAIN_HEADERS_MAX_SIZE)
+    response = {
+        'length': len(chain_snapshot),
+        'tip_hash': block_chain.tip_hash(),
+        'from': start_idx,
+        'hashes': [chain_snapshot.hash_at(idx) for idx in range(start_idx, min(start_idx + limit, len(chain_snapshot)))]
+    }
+    return jsonify(response), HTTPStatus.OK
 
 
 @py_coin_app.route('/nodes', methods=['GET'])
+@state_lock.read_locked()
 def get_nodes():
     response = {
         'nodes': block_chain.get_peer_nodes()
@@ -177,6 +612,7 @@ def get_nodes():
 
 
 @py_coin_app.route('/nodes', methods=['POST'])
+@state_lock.write_locked()
 def add_node():
     # Convert the request body into a dictionary
     req_body = request.get_json()
@@ -203,6 +639,7 @@ def add_node():
 
 
 @py_coin_app.route('/nodes/<node_url>', methods=['DELETE'])
+@state_lock.write_locked()
 def remove_node(node_url):
     # Check whether request body dictionary contains the required key (i.e. node)
     if node_url == '' or node_url is None:
@@ -224,7 +661,17 @@ def get_node_id():
     return jsonify(node_id), HTTPStatus.OK
 
 
+@py_coin_app.route('/metrics', methods=['GET'])
+@state_lock.read_locked()
+def get_metrics():
+    # Sizes are read when scraped, rather than tracked on every change
+    CHAIN_HEIGHT.set(len(block_chain.chain))
+    MEMPOOL_SIZE.set(len(block_chain.open_txns))
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @py_coin_app.route('/notify/txn', methods=['POST'])
+@state_lock.write_locked()
 def notify_transaction():
     # Convert the request body into a dictionary
     req_body = request.get_json()
@@ -241,6 +688,13 @@ def notify_transaction():
             'message': 'Data is missing one or more required fields: {}'.format(required_fields)
         }
         return jsonify(response), HTTPStatus.BAD_REQUEST
+    if not isinstance(req_body['sender'], str) or not isinstance(req_body['recipient'], str):
+        return invalid_key()
+    if not Verification.is_amount_valid(req_body['amount']):
+        return invalid_amount()
+    # The timestamp isn't signed, so a relayed transaction's timestamp may have been changed to anything
+    if not Verification.is_number_valid(req_body['timestamp']):
+        return invalid_timestamp()
 
     added_txn = block_chain.add_transaction(
         req_body['sender'], req_body['recipient'], req_body['amount'], req_body['signature'], req_body['timestamp'])
@@ -248,7 +702,8 @@ def notify_transaction():
     if added_txn is not None:
         response = {
             'message': 'Transaction added successfully',
-            'txn': added_txn.__dict__.copy()
+            'txn_id': added_txn.txn_id,
+            'txn': added_txn.to_ordered_dict()
         }
         return jsonify(response), HTTPStatus.CREATED
     else:
@@ -258,9 +713,53 @@ def notify_transaction():
         return jsonify(response), HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+@py_coin_app.route('/notify/txns', methods=['POST'])
+@state_lock.write_locked()
+def notify_transactions():
+    # A batch of transactions coalesced by the notifying peer
+    req_body = request.get_json()
+    if not req_body or not isinstance(req_body.get('txns'), list):
+        response = {
+            'message': 'No transactions contained in request'
+        }
+        return jsonify(response), HTTPStatus.BAD_REQUEST
+
+    required_fields = ['sender', 'recipient', 'amount', 'signature', 'timestamp']
+    if not all(isinstance(txn, dict) and all(field in txn for field in required_fields)
+               for txn in req_body['txns']):
+        response = {
+            'message': 'Transaction data is missing one or more required fields: {}'.format(required_fields)
+        }
+        return jsonify(response), HTTPStatus.BAD_REQUEST
+    if not all(isinstance(txn['sender'], str) and isinstance(txn['recipient'], str) for txn in req_body['txns']):
+        return invalid_key()
+    if not all(Verification.is_amount_valid(txn['amount']) for txn in req_body['txns']):
+        return invalid_amount()
+    if not all(Verification.is_number_valid(txn['timestamp']) for txn in req_body['txns']):
+        return invalid_timestamp()
+
+    # The whole batch is verified and saved together
+    added_txns = block_chain.add_transactions([Transaction.from_dict(txn) for txn in req_body['txns']])
+    added_count = len([txn for txn in added_txns if txn is not None])
+
+    response = {
+        'message': '{} of {} transactions added successfully'.format(added_count, len(added_txns)),
+        'added': [txn is not None for txn in added_txns]
+    }
+    return jsonify(response), HTTPStatus.CREATED if added_count > 0 else HTTPStatus.OK
+
+
 @py_coin_app.route('/notify/block', methods=['POST'])
+@state_lock.write_locked()
 def notify_block():
-    req_body = request.get_json()
+    if request.mimetype == binary_codec.MEDIA_TYPE:
+        # The block alone, in the binary encoding
+        try:
+            req_body = {'block': binary_codec.decode_block(request.get_data()).to_dict()}
+        except ValueError:
+            req_body = None
+    else:
+        req_body = request.get_json()
     if not req_body:
         response = {
             'message': 'No data contained in request'
@@ -278,7 +777,7 @@ def notify_block():
 
     # Is index of block received one more than the index of the last local block ?
     received_idx = block['idx']
-    last_local_idx = block_chain.chain[-1].idx if len(block_chain.chain) > 0 else -1
+    last_local_idx = len(block_chain.chain) - 1
     if received_idx == last_local_idx + 1:
         added_block = block_chain.add_block(block)
         if added_block is not None:
@@ -290,6 +789,10 @@ def notify_block():
             # - signal the problem to the block publisher using 'CONFLICT' status
             response = {'message': 'Failed to add block received to local block chain'}
             return jsonify(response), HTTPStatus.CONFLICT
+    elif block_chain.get_block_by_hash(Block.from_dict(block).hash) is not None:
+        # We already have the block (e.g. it has been gossiped back to us), so there is no conflict
+        response = {'message': 'Block received is already in the local block chain'}
+        return jsonify(response), HTTPStatus.OK
     elif received_idx >= last_local_idx:
         block_chain.resolve_conflicts = True
         # The local block chain is stale... this is not an issue with the block publisher
@@ -306,9 +809,17 @@ if __name__ == '__main__':
     host = environ[HOST_ENV_VAR_NAME]
     port = environ[PORT_ENV_VAR_NAME]
     node_id = '{}_{}'.format(host, port)
+    mining_workers = int(environ[MINING_WORKERS_ENV_VAR_NAME]) if MINING_WORKERS_ENV_VAR_NAME in environ else None
+    verify_on_load = environ.get(VERIFY_ON_LOAD_ENV_VAR_NAME, '').lower() == 'true'
     wallet = Wallet(node_id)
-    # Add a type hint so that IDE is able to suggest auto-completion options
-    block_chain: Optional[BlockChain] = None
-    balance_manager = BalanceManager()
+    columnar_ledger = None
+    if environ.get(LEDGER_ENV_VAR_NAME, '').lower() == 'true':
+        if ledger.is_available():
+            columnar_ledger = ledger.ColumnarLedger()
+        else:
+            print('WARN: NumPy is not installed. Columnar ledger is disabled')
+    balance_manager = BalanceManager(node_id, ledger=columnar_ledger)
+    mining_jobs = MiningJobs(mine_block)
     init_block_chain()
-    py_coin_app.run(host=host, port=port)
+    # Each request is handled on its own thread (see state_lock)
+    py_coin_app.run(host=host, port=port, threaded=True)
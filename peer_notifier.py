@@ -0,0 +1,178 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from http import HTTPStatus
+import metrics
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+from time import perf_counter
+from urllib.parse import urlsplit
+
+# Maximum number of peers notified at the same time
+NOTIFY_WORKERS = 8
+# Seconds allowed to connect to a peer, and then for it to respond
+NOTIFY_TIMEOUT = (2.0, 5.0)
+# Seconds that outgoing transactions are held so that they can be sent to peers as one batch
+TXN_BATCH_WINDOW = 0.05
+# A batch is sent straight away once it holds this many transactions
+TXN_BATCH_MAX_SIZE = 500
+
+NOTIFICATIONS = metrics.Counter(
+    'pycoin_peer_notifications_total', 'Notifications sent to peers, by path and outcome', ['path', 'outcome'])
+NOTIFICATION_SECONDS = metrics.Histogram(
+    'pycoin_peer_notification_seconds', 'Time taken to notify a peer (including any retries)', ['path'])
+
+
+class PeerNotifier:
+    """
+    Sends notifications to peer nodes concurrently, in the background.
+
+    Connections to peers are pooled and reused, and every request is bounded by a timeout,
+    so a slow or dead peer can't hold up the caller or the notification of other peers.
+    Transactions are coalesced over a short window and sent to each peer as a batch.
+    """
+
+    def __init__(self, on_conflict, workers=NOTIFY_WORKERS, timeout=NOTIFY_TIMEOUT):
+        # Called when a peer responds with CONFLICT (i.e. its block chain disagrees with ours)
+        self.__on_conflict = on_conflict
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        self.__session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='peer-notifier')
+        # Transactions waiting to be sent as the next batch, and the peers to send them to
+        self.__batch_lock = threading.Lock()
+        self.__batch_txns = []
+        self.__batch_peer_nodes = []
+        self.__batch_timer = None
+
+    def broadcast(self, peer_nodes, path, json_data):
+        """
+        Post the same data to each peer without waiting for any of them to respond.
+
+        :param peer_nodes: the peers to notify
+        :param path: the URL path to post to on each peer
+        :param json_data: the data to post (must not be changed after the call)
+        :return: a list of futures, one per peer, each holding whether its notification succeeded
+        """
+        futures = []
+        for node in list(peer_nodes):
+            url = 'http://{}{}'.format(node, path)
+            try:
+                futures.append(self.__executor.submit(self.notify_peer, url, json_data))
+            except RuntimeError:
+                # The executor has been shut down (e.g. a block was mined as the process exits),
+                # so notify the peer from this thread rather than skip it
+                future = Future()
+                future.set_result(self.notify_peer(url, json_data))
+                futures.append(future)
+        return futures
+
+    def queue_txn(self, peer_nodes, json_txn):
+        """
+        Add a transaction to the next batch sent to peers.
+
+        The batch is sent once the coalescing window has passed, or sooner if the batch is full.
+
+        :param peer_nodes: the peers to notify
+        :param json_txn: the transaction data to send (must not be changed after the call)
+        """
+        with self.__batch_lock:
+            self.__batch_txns.append(json_txn)
+            self.__batch_peer_nodes = list(peer_nodes)
+            if len(self.__batch_txns) < TXN_BATCH_MAX_SIZE:
+                if self.__batch_timer is None:
+                    self.__batch_timer = threading.Timer(TXN_BATCH_WINDOW, self.flush_txns)
+                    self.__batch_timer.start()
+                return
+            batch_txns, peer_nodes = self.__take_batch()
+        self.__send_batch(batch_txns, peer_nodes)
+
+    def flush_txns(self):
+        # Send any queued transactions now
+        with self.__batch_lock:
+            batch_txns, peer_nodes = self.__take_batch()
+        self.__send_batch(batch_txns, peer_nodes)
+
+    def shutdown(self):
+        """
+        Send any queued transactions, then release the worker threads and pooled connections once every
+        notification already submitted has been sent (without waiting for them).
+        """
+        self.flush_txns()
+        threading.Thread(target=self.__close, name='peer-notifier-shutdown', daemon=True).start()
+
+    def __close(self):
+        self.__executor.shutdown(wait=True)
+        self.__session.close()
+
+    def __take_batch(self):
+        # Must be called holding the batch lock. The batch is sent after the lock is released
+        if self.__batch_timer is not None:
+            self.__batch_timer.cancel()
+            self.__batch_timer = None
+        batch_txns = self.__batch_txns
+        self.__batch_txns = []
+        return batch_txns, self.__batch_peer_nodes
+
+    def __send_batch(self, batch_txns, peer_nodes):
+        if len(batch_txns) == 0:
+            return
+        json_data = {'txns': batch_txns}
+        for node in peer_nodes:
+            try:
+                self.__executor.submit(self.__notify_peer_of_txns, node, json_data)
+            except RuntimeError:
+                # The executor has been shut down (e.g. the window ended as the process exits),
+                # so send the batch from this thread rather than lose it
+                self.__notify_peer_of_txns(node, json_data)
+
+    def __notify_peer_of_txns(self, node, json_data):
+        start = perf_counter()
+        try:
+            response = self.__session.post(
+                'http://{}/notify/txns'.format(node), json=json_data, timeout=self.__timeout)
+        except requests.exceptions.RequestException:
+            print('ERROR: Peer connection failed: http://{}/notify/txns'.format(node))
+            succeeded = False
+        else:
+            if response.status_code == HTTPStatus.NOT_FOUND:
+                # The peer predates batched notifications, so fall back to one transaction at a time
+                # (each of which is recorded by notify_peer)
+                return all([self.notify_peer('http://{}/notify/txn'.format(node), json_txn)
+                            for json_txn in json_data['txns']])
+            succeeded = response.status_code != HTTPStatus.BAD_REQUEST and \
+                response.status_code != HTTPStatus.INTERNAL_SERVER_ERROR
+            if not succeeded:
+                print('ERROR: Peer notification failed: http://{}/notify/txns'.format(node))
+
+        PeerNotifier.__record('/notify/txns', succeeded, perf_counter() - start)
+        return succeeded
+
+    def notify_peer(self, url, json_data):
+        start = perf_counter()
+        succeeded = self.__post(url, json_data)
+        PeerNotifier.__record(urlsplit(url).path, succeeded, perf_counter() - start)
+        return succeeded
+
+    @staticmethod
+    def __record(path, succeeded, seconds):
+        NOTIFICATIONS.labels(path, 'success' if succeeded else 'failure').inc()
+        NOTIFICATION_SECONDS.labels(path).observe(seconds)
+
+    def __post(self, url, json_data):
+        try:
+            response = self.__session.post(url, json=json_data, timeout=self.__timeout)
+            if response.status_code == HTTPStatus.BAD_REQUEST or \
+                    response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR:
+                print('ERROR: Peer notification failed: {}'.format(url))
+                return False
+            elif response.status_code == HTTPStatus.CONFLICT:
+                self.__on_conflict()
+                return False
+            else:
+                return True
+        except requests.exceptions.Timeout:
+            print('ERROR: Peer notification timed out: {}'.format(url))
+            return False
+        except requests.exceptions.ConnectionError:
+            print('ERROR: Peer connection failed: {}'.format(url))
+            return False
@@ -0,0 +1,24 @@
+from balance_manager import BalanceManager
+from mining_jobs import MiningJobs
+import node
+import pytest
+from wallet import Wallet
+
+NODE_ID = 'test'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A node with a new wallet, keeping its data files in a temporary directory
+    monkeypatch.chdir(tmp_path)
+    wallet = Wallet(NODE_ID)
+    wallet.create_keys()
+    monkeypatch.setattr(node, 'wallet', wallet, raising=False)
+    monkeypatch.setattr(node, 'node_id', NODE_ID, raising=False)
+    monkeypatch.setattr(node, 'mining_workers', 1, raising=False)
+    monkeypatch.setattr(node, 'verify_on_load', False, raising=False)
+    monkeypatch.setattr(node, 'balance_manager', BalanceManager(NODE_ID), raising=False)
+    monkeypatch.setattr(node, 'mining_jobs', MiningJobs(node.mine_block), raising=False)
+    monkeypatch.setattr(node, 'block_chain', None, raising=False)
+    node.init_block_chain()
+    return node.py_coin_app.test_client()
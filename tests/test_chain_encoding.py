@@ -0,0 +1,12 @@
+""" The chain is only gzipped for clients that accept gzip """
+from http import HTTPStatus
+import pytest
+
+
+@pytest.mark.parametrize('accept_encoding, is_gzipped', [
+    ('gzip', True), ('deflate, gzip;q=0.5', True), ('*', True),
+    ('gzip;q=0', False), ('identity', False), ('*, gzip;q=0', False)])
+def test_chain_is_gzipped_if_accepted(client, accept_encoding, is_gzipped):
+    response = client.get('/chain', headers={'Accept-Encoding': accept_encoding})
+    assert response.status_code == HTTPStatus.OK
+    assert (response.headers.get('Content-Encoding') == 'gzip') == is_gzipped
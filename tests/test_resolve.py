@@ -0,0 +1,80 @@
+""" Resolving conflicts validates the blocks downloaded from a peer as add_block would, in runs """
+from benchmark.chain_generator import create_wallets, generate_chain
+import blockchain
+from blockchain import BlockChain
+import pytest
+from utility.verification import Verification
+
+PEER = 'peer:5000'
+
+
+@pytest.fixture
+def serve_chain(monkeypatch):
+    # Stands in for the peer's /chain and /chain/headers, serving the chain it is given
+    def serve(peer_chain):
+        def get_json(block_chain, url, params):
+            start_idx = block_chain.find_fork(params['locator'].split(',')) if 'locator' in params else params['from']
+            return {'length': len(peer_chain), 'from': start_idx,
+                    'hashes': [block.hash for block in peer_chain[start_idx:]]}
+
+        def get_blocks(block_chain, url, params):
+            return peer_chain[params['from']:params['from'] + params['limit']]
+
+        monkeypatch.setattr(BlockChain, '_BlockChain__get_json', get_json)
+        monkeypatch.setattr(BlockChain, '_BlockChain__get_blocks', get_blocks)
+    return serve
+
+
+@pytest.fixture
+def block_chain(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    local_chain = BlockChain('public-key', 'test', mining_workers=1, verify_workers=1)
+    local_chain.load_data()
+    local_chain.add_peer_node(PEER)
+    yield local_chain
+    local_chain.close()
+
+
+def test_signed_chain_is_adopted(block_chain, serve_chain):
+    peer_chain = generate_chain(3, wallets=create_wallets(2))
+    serve_chain(peer_chain)
+    assert block_chain.resolve_block_chain()
+    assert block_chain.tip_hash() == peer_chain[-1].hash
+
+
+def test_chain_with_invalid_signatures_is_rejected(block_chain, serve_chain):
+    # The proofs of work are valid, but the transactions are signed with random bytes
+    serve_chain(generate_chain(3))
+    assert not block_chain.resolve_block_chain()
+    assert len(block_chain.chain) == 0
+
+
+def test_blocks_are_validated_in_runs(block_chain, serve_chain, monkeypatch):
+    monkeypatch.setattr(blockchain, 'SYNC_PAGE_SIZE', 2)
+    monkeypatch.setattr(blockchain, 'SYNC_VALIDATION_RUN_SIZE', 5)
+    run_lengths = []
+    is_block_chain_valid = Verification.is_block_chain_valid
+
+    def record_run(chain, start_idx=0, char_count=3, workers=1):
+        run_lengths.append(len(chain) - start_idx)
+        return is_block_chain_valid(chain, start_idx, char_count, workers)
+
+    monkeypatch.setattr(Verification, 'is_block_chain_valid', staticmethod(record_run))
+    serve_chain(generate_chain(13, wallets=create_wallets(2)))
+    assert block_chain.resolve_block_chain()
+    # Pages are validated once enough of them have arrived for a run, and the rest once the download is complete.
+    # The adopted chain is then committed without validating any block again
+    assert run_lengths == [6, 6, 1, 0]
+
+
+def test_checkpoint_of_adopted_chain_is_saved(block_chain, serve_chain):
+    peer_chain = generate_chain(3, wallets=create_wallets(2))
+    serve_chain(peer_chain)
+    assert block_chain.resolve_block_chain()
+
+    # Reloaded, the chain is already verified up to its tip, so won't be validated again
+    reloaded_chain = BlockChain('public-key', 'test', mining_workers=1, verify_workers=1)
+    reloaded_chain.load_data()
+    assert reloaded_chain._BlockChain__verified_height == len(peer_chain)
+    assert reloaded_chain._BlockChain__verified_hash == peer_chain[-1].hash
+    reloaded_chain.close()
@@ -0,0 +1,48 @@
+""" Transactions whose amount isn't a positive number are rejected with BAD REQUEST, rather than failing the node """
+from http import HTTPStatus
+import node
+import pytest
+from utility.verification import Verification
+
+# Amounts that JSON can carry but a transaction can't (the last is too large to store in a block)
+INVALID_AMOUNTS = ['1.0', None, True, [1], {'amount': 1}, 0, -1.5, 2 ** 63]
+
+
+@pytest.mark.parametrize('amount', [1, 0.5, 10.0])
+def test_positive_numbers_are_valid(amount):
+    assert Verification.is_amount_valid(amount)
+
+
+@pytest.mark.parametrize('amount', INVALID_AMOUNTS + [float('nan'), float('inf')])
+def test_other_amounts_are_invalid(amount):
+    assert not Verification.is_amount_valid(amount)
+
+
+def peer_txn(amount):
+    return {'sender': 'sender', 'recipient': 'recipient', 'amount': amount, 'signature': 'signature',
+            'timestamp': 0.0}
+
+
+@pytest.mark.parametrize('amount', INVALID_AMOUNTS)
+def test_add_transaction_rejects_invalid_amount(client, amount):
+    response = client.post('/transactions', json={'recipient': 'recipient', 'amount': amount})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.parametrize('amount', INVALID_AMOUNTS)
+def test_add_transactions_rejects_invalid_amount(client, amount):
+    response = client.post('/transactions/batch', json={'txns': [{'recipient': 'recipient', 'amount': amount}]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json()['results'] == [{'added': False, 'message': node.INVALID_AMOUNT_MESSAGE}]
+
+
+@pytest.mark.parametrize('amount', INVALID_AMOUNTS)
+def test_notify_transaction_rejects_invalid_amount(client, amount):
+    response = client.post('/notify/txn', json=peer_txn(amount))
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.parametrize('amount', INVALID_AMOUNTS)
+def test_notify_transactions_rejects_invalid_amount(client, amount):
+    response = client.post('/notify/txns', json={'txns': [peer_txn(1.0), peer_txn(amount)]})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
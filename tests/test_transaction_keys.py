@@ -0,0 +1,67 @@
+""" Participant keys read back exactly as given, whether or not they have been interned """
+from http import HTTPStatus
+from key_table import participant_keys
+import node
+import pytest
+from transaction import Transaction
+
+# Recipients that JSON can carry but that aren't public keys. Small ints are also ids in the key table
+INVALID_RECIPIENTS = [None, 0, 1, 7, ['recipient']]
+
+
+@pytest.mark.parametrize('recipient', [0, 1, 7, None])
+def test_keys_that_are_not_strings_are_kept_as_given(recipient):
+    # Make sure the ids the recipient could be mistaken for are in use
+    for key in ['alice-key', 'bob-key']:
+        participant_keys.intern(key)
+    txn = Transaction('alice-key', recipient, 1.0, 'signature', 0.0)
+    dict_txn = txn.to_ordered_dict()
+    txn_id = txn.txn_id
+
+    assert txn.recipient == recipient
+    assert dict_txn['recipient'] == recipient
+    assert str(txn) == 'alice-key:{}:1.0:signature:0.0'.format(recipient)
+
+    txn.intern_keys()
+    assert txn.recipient == recipient
+    assert txn.to_ordered_dict() == dict_txn
+    assert txn.txn_id == txn_id
+
+
+def test_interned_keys_read_back_as_the_keys():
+    txn = Transaction('alice-key', 'bob-key', 1.0, 'signature', 0.0)
+    dict_txn = txn.to_ordered_dict()
+    txn.intern_keys()
+    assert (txn.sender, txn.recipient) == ('alice-key', 'bob-key')
+    assert participant_keys.key(txn.recipient_id) == 'bob-key'
+    assert txn.to_ordered_dict() == dict_txn
+
+
+@pytest.mark.parametrize('recipient', INVALID_RECIPIENTS)
+def test_add_transaction_rejects_invalid_recipient(client, recipient):
+    response = client.post('/transactions', json={'recipient': recipient, 'amount': 1.0})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.get_json()['message'] == node.INVALID_KEY_MESSAGE
+
+
+@pytest.mark.parametrize('recipient', INVALID_RECIPIENTS)
+def test_add_transactions_rejects_invalid_recipient(client, recipient):
+    response = client.post('/transactions/batch', json={'txns': [{'recipient': recipient, 'amount': 1.0}]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json()['results'] == [{'added': False, 'message': node.INVALID_KEY_MESSAGE}]
+
+
+@pytest.mark.parametrize('key', INVALID_RECIPIENTS)
+@pytest.mark.parametrize('field', ['sender', 'recipient'])
+def test_notify_transaction_rejects_invalid_key(client, field, key):
+    txn = {'sender': 'sender', 'recipient': 'recipient', 'amount': 1.0, 'signature': 'signature', 'timestamp': 0.0}
+    response = client.post('/notify/txn', json=dict(txn, **{field: key}))
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.post('/notify/txns', json={'txns': [txn, dict(txn, **{field: key})]})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.parametrize('key', INVALID_RECIPIENTS)
+def test_add_transactions_rejects_transaction_with_invalid_key(client, key):
+    # Without verifying its signature, which needs the sender's key
+    assert node.block_chain.add_transactions([Transaction(key, 'recipient', 1.0, 'signature', 0.0)]) == [None]
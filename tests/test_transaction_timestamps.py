@@ -0,0 +1,71 @@
+""" Transactions whose timestamp a block can't store are never admitted, so they can't stop the node mining """
+from blockchain import DATA_FILE_PATH, DATA_LOG_SUFFIX
+from chain_log import ChainLog
+from http import HTTPStatus
+import node
+import pytest
+import threading
+from transaction import Transaction
+from utility.verification import Verification
+
+# Timestamps that JSON can carry but a block can't store
+INVALID_TIMESTAMPS = ['later', None, True, [1.0], 2 ** 63, -2 ** 63 - 1]
+
+
+@pytest.mark.parametrize('timestamp', [0, 1.5, 2 ** 63 - 1, -2 ** 63])
+def test_storable_numbers_are_valid(timestamp):
+    assert Verification.is_number_valid(timestamp)
+
+
+@pytest.mark.parametrize('timestamp', INVALID_TIMESTAMPS + [float('nan'), float('inf')])
+def test_other_numbers_are_invalid(timestamp):
+    assert not Verification.is_number_valid(timestamp)
+
+
+def mine(client):
+    block = node.mine_block(threading.Event(), None)
+    assert block is not None
+    return block
+
+
+def pending_txn(client):
+    # A payment signed by the node's wallet, once it has funds to make it
+    mine(client)
+    response = client.post('/transactions', json={'recipient': 'recipient', 'amount': 1.0})
+    assert response.status_code == HTTPStatus.CREATED
+    return response.get_json()['txn']
+
+
+@pytest.mark.parametrize('timestamp', INVALID_TIMESTAMPS)
+def test_notify_transaction_rejects_invalid_timestamp(client, timestamp):
+    # The signature doesn't cover the timestamp, so a relayed copy of a pending payment can carry any timestamp
+    txn = dict(pending_txn(client), timestamp=timestamp)
+    response = client.post('/notify/txn', json=txn)
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.get_json()['message'] == node.INVALID_TIMESTAMP_MESSAGE
+    assert len(node.block_chain.open_txns) == 1
+    mine(client)
+
+
+@pytest.mark.parametrize('timestamp', INVALID_TIMESTAMPS)
+def test_notify_transactions_rejects_invalid_timestamp(client, timestamp):
+    txn = pending_txn(client)
+    response = client.post('/notify/txns', json={'txns': [dict(txn, timestamp=1.0), dict(txn, timestamp=timestamp)]})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert len(node.block_chain.open_txns) == 1
+
+
+def test_add_transactions_rejects_invalid_timestamp(client):
+    txn = Transaction.from_dict(dict(pending_txn(client), timestamp='later'))
+    assert node.block_chain.add_transactions([txn]) == [None]
+    assert len(node.block_chain.open_txns) == 1
+
+
+def test_saved_transaction_with_invalid_timestamp_is_discarded_on_load(client):
+    # As saved by a node that didn't check timestamps on arrival
+    txn = pending_txn(client)
+    ChainLog('{}_{}{}'.format(DATA_FILE_PATH, node.node_id, DATA_LOG_SUFFIX)).commit(
+        [{'op': 'txn', 'txn': dict(txn, timestamp='later')}])
+    node.init_block_chain()
+    assert [open_txn.to_ordered_dict() for open_txn in node.block_chain.open_txns] == [txn]
+    mine(client)
@@ -1,8 +1,16 @@
 from collections import OrderedDict
+from key_table import KeyId, participant_keys
 from time import time
+from utility.hash_util import calc_hash
 
 
 class Transaction:
+    # Slots rather than a per-instance __dict__, as a chain can hold millions of transactions.
+    # Sender and recipient are each held as the key itself until the transaction is admitted (to the mempool
+    # or chain), then as a KeyId in the shared key table (see intern_keys). So keys from rejected transactions
+    # (e.g. with random keys, sent by a peer) never grow the table. Anything other than a KeyId is the key as given
+    __slots__ = ('__sender', '__recipient', 'amount', 'signature', 'timestamp', '__txn_id')
+
     def __init__(self, sender, recipient, amount, signature, timestamp=None):
         self.sender = sender
         self.recipient = recipient
@@ -10,6 +18,59 @@ class Transaction:
         self.signature = signature
         self.timestamp = time() if timestamp is None else timestamp
 
+    def __setattr__(self, name, value):
+        # Any change to the transaction's contents invalidates its cached id
+        if name != '_Transaction__txn_id':
+            object.__setattr__(self, '_Transaction__txn_id', None)
+        object.__setattr__(self, name, value)
+
+    @property
+    def txn_id(self):
+        # The signature only covers the sender, recipient and amount, so repeats of the same payment share it.
+        # The id is a hash of the whole transaction (including its timestamp), so each has its own
+        if self.__txn_id is None:
+            self.__txn_id = calc_hash(str(self))
+        return self.__txn_id
+
+    def intern_keys(self):
+        # Hold the sender and recipient as ids in the shared key table (the transaction's contents are unchanged,
+        # so its cached id is kept)
+        if type(self.__sender) is not KeyId:
+            object.__setattr__(self, '_Transaction__sender', participant_keys.intern(self.__sender))
+        if type(self.__recipient) is not KeyId:
+            object.__setattr__(self, '_Transaction__recipient', participant_keys.intern(self.__recipient))
+
+    @property
+    def sender(self):
+        return participant_keys.key(self.__sender) if type(self.__sender) is KeyId else self.__sender
+
+    @sender.setter
+    def sender(self, sender):
+        self.__sender = sender
+
+    @property
+    def sender_id(self):
+        # Only admitted transactions have ids, so asking for one admits the keys
+        self.intern_keys()
+        return self.__sender
+
+    @property
+    def recipient(self):
+        return participant_keys.key(self.__recipient) if type(self.__recipient) is KeyId else self.__recipient
+
+    @recipient.setter
+    def recipient(self, recipient):
+        self.__recipient = recipient
+
+    @property
+    def recipient_id(self):
+        self.intern_keys()
+        return self.__recipient
+
+    def __reduce__(self):
+        # Key ids are only meaningful within this process, so pickle (e.g. for worker processes) the keys themselves
+        return Transaction, (self.sender, self.recipient, self.amount, self.signature, self.timestamp)
+
     def __str__(self):
         return '{}:{}:{}:{}:{}'.format(
             self.sender,
@@ -27,3 +88,12 @@ class Transaction:
             ('signature', self.signature),
             ('timestamp', self.timestamp)
         ])
+
+    @staticmethod
+    def from_dict(dict_txn):
+        return Transaction(
+            dict_txn['sender'],
+            dict_txn['recipient'],
+            dict_txn['amount'],
+            dict_txn['signature'],
+            dict_txn['timestamp'])
@@ -8,3 +8,15 @@ def calc_hash(str_data):
     return hl.sha256(str_data.encode()).hexdigest()
 
 
+def calc_prefix_hash(str_prefix):
+    # Hash only the fixed leading part of some data. The returned hash object holds the
+    # intermediate (midstate) and can be extended with different suffixes via calc_hash_with_prefix
+    return hl.sha256(str_prefix.encode())
+
+
+def calc_hash_with_prefix(prefix_hash, str_suffix):
+    # Copy the midstate so the prefix hash object can be reused for the next suffix.
+    # The result is identical to calc_hash(prefix + suffix)
+    suffix_hash = prefix_hash.copy()
+    suffix_hash.update(str_suffix.encode())
+    return suffix_hash.hexdigest()
@@ -0,0 +1,112 @@
+""" Provides a multi-process proof of work search """
+import os
+import queue
+import threading
+from utility.process_pool import PROCESS_CONTEXT, shared_pool
+from utility.verification import Verification
+
+# How many nonce attempts a worker makes between checks of the shared 'found' flag.
+# Checking the flag on every attempt would noticeably slow the search down.
+STOP_CHECK_INTERVAL = 1000
+# Seconds between checks, while waiting for the workers, of whether the search should stop
+WAIT_INTERVAL = 0.1
+
+
+def default_worker_count():
+    # One worker per core (cpu_count can return None on some platforms)
+    return os.cpu_count() or 1
+
+
+# Workers -> (found event, attempts counter) shared with the search pool's workers as they start
+_search_flags = {}
+# Searches share their pool's flags, so only one runs at a time
+_search_lock = threading.Lock()
+# Set in each search worker by _init_search_worker
+_found = None
+_attempts_made = None
+
+
+def _init_search_worker(found, attempts_made):
+    global _found, _attempts_made
+    _found = found
+    _attempts_made = attempts_made
+
+
+def _search_nonces(txns, prev_hash, first_nonce, stride):
+    # Runs in a worker process. Returns the nonce found, or None if the search was stopped
+    # Hash objects can't be passed between processes, so each worker builds its own prefix
+    prefix_hash = Verification.pow_prefix(txns, prev_hash)
+
+    # Each worker owns every stride'th nonce starting at first_nonce,
+    # so together the workers cover the whole nonce space without overlap
+    nonce = first_nonce
+    attempts = 0
+    while True:
+        if Verification.is_pow_valid_for_prefix(prefix_hash, nonce):
+            _found.set()
+            return nonce
+
+        nonce += stride
+        attempts += 1
+        if attempts % STOP_CHECK_INTERVAL == 0:
+            with _attempts_made.get_lock():
+                _attempts_made.value += STOP_CHECK_INTERVAL
+            if _found.is_set():
+                # Another worker has already found a valid nonce (or the search has been stopped)
+                return None
+
+
+def _search_pool(workers):
+    # Must be called holding the search lock
+    if workers not in _search_flags:
+        _search_flags[workers] = (PROCESS_CONTEXT.Event(), PROCESS_CONTEXT.Value('q', 0))
+    found, attempts_made = _search_flags[workers]
+    return shared_pool('proof_of_work', workers, _init_search_worker, (found, attempts_made)), found, attempts_made
+
+
+def parallel_proof_of_work(txns, prev_hash, workers, stop=None, record_progress=None):
+    """
+    Search for a valid proof of work nonce using a pool of worker processes.
+
+    The first worker to find a valid nonce signals all the others to stop. The pool is kept for later searches.
+
+    :param txns: the transactions (excluding the reward transaction) to be mined
+    :param prev_hash: the hash of the previous block
+    :param workers: the number of worker processes to use
+    :param stop: optional event that abandons the search when set
+    :param record_progress: optional function called with the number of nonces tried so far, every WAIT_INTERVAL
+    :return: a nonce that satisfies Verification.is_pow_valid, or None if the search was stopped
+    """
+    with _search_lock:
+        pool, found, attempts_made = _search_pool(workers)
+        found.clear()
+        with attempts_made.get_lock():
+            attempts_made.value = 0
+        # Each worker's outcome (a nonce, None once stopped, or an exception) is delivered here
+        results = queue.Queue()
+        searches = [pool.apply_async(_search_nonces, (txns, prev_hash, first_nonce, workers),
+                                     callback=results.put, error_callback=results.put)
+                    for first_nonce in range(workers)]
+
+        try:
+            nonce = None
+            while nonce is None:
+                try:
+                    result = results.get(timeout=WAIT_INTERVAL)
+                except queue.Empty:
+                    if record_progress is not None:
+                        record_progress(attempts_made.value)
+                    if stop is not None and stop.is_set():
+                        break
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                nonce = result
+        finally:
+            # Make sure every worker stops (even if we were interrupted while waiting), so the pool is idle
+            # for the next search
+            found.set()
+            for search in searches:
+                search.wait()
+
+    return nonce
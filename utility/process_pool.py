@@ -0,0 +1,33 @@
+""" Provides long-lived pools of worker processes """
+import multiprocessing
+import threading
+
+# Workers are started by a fork server (or spawned, where there isn't one) rather than forked from this process.
+# Forking while other threads run (e.g. the node's request threads) copies any lock one of them holds, such as
+# the node's state lock or a logging lock, and the child deadlocks if it ever needs it
+PROCESS_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# (name, number of workers) -> pool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def shared_pool(name, workers, initializer=None, initargs=()):
+    """
+    Get a pool of worker processes, starting it on first use.
+
+    Starting a worker is slow (it imports the main module afresh), so a pool is kept for the life of
+    the process and shared by every caller asking for the same name and number of workers.
+
+    :param name: what the pool is for (e.g. 'verification')
+    :param workers: the number of worker processes
+    :param initializer: optional function each worker calls with initargs as it starts
+    :param initargs: the arguments passed to the initializer
+    :return: the pool
+    """
+    with _pools_lock:
+        pool = _pools.get((name, workers))
+        if pool is None:
+            pool = _pools[(name, workers)] = PROCESS_CONTEXT.Pool(workers, initializer, initargs)
+        return pool
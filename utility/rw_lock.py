@@ -0,0 +1,64 @@
+""" Provides a reader/writer lock """
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock:
+    """
+    A lock that any number of readers can hold at once, or a single writer on its own.
+
+    Waiting writers take priority over newly arriving readers, so a steady stream of reads can't
+    hold off a write indefinitely. The lock isn't reentrant: a thread must not acquire it again
+    (in either mode) while holding it, and a reader can't upgrade to a writer.
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition(threading.Lock())
+        self.__reader_count = 0
+        self.__writing = False
+        self.__waiting_writer_count = 0
+
+    def acquire_read(self):
+        with self.__condition:
+            while self.__writing or self.__waiting_writer_count > 0:
+                self.__condition.wait()
+            self.__reader_count += 1
+
+    def release_read(self):
+        with self.__condition:
+            self.__reader_count -= 1
+            if self.__reader_count == 0:
+                self.__condition.notify_all()
+
+    def acquire_write(self):
+        with self.__condition:
+            self.__waiting_writer_count += 1
+            try:
+                while self.__writing or self.__reader_count > 0:
+                    self.__condition.wait()
+            finally:
+                self.__waiting_writer_count -= 1
+            self.__writing = True
+
+    def release_write(self):
+        with self.__condition:
+            self.__writing = False
+            self.__condition.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        # Can also decorate a function, to hold the lock for reading while it runs
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        # Can also decorate a function, to hold the lock for writing while it runs
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
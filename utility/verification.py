@@ -2,9 +2,44 @@
 import binascii
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
+from collections import OrderedDict
 from Crypto.Signature import PKCS1_v1_5
+from functools import lru_cache
 import json
-from utility.hash_util import calc_hash
+import math
+from utility.hash_util import calc_hash_with_prefix, calc_prefix_hash
+from utility.process_pool import shared_pool
+
+# Chains with fewer blocks to check are always verified serially,
+# as starting the worker processes would cost more than it saves
+PARALLEL_VERIFICATION_MIN_BLOCKS = 1000
+# Number of chunks of blocks (or transactions) handed to each worker process during parallel verification
+CHUNKS_PER_WORKER = 4
+# Batches with fewer unverified signatures are always verified serially
+PARALLEL_SIGNATURE_MIN_TXNS = 200
+# Maximum number of parsed sender public keys to keep
+PUBLIC_KEY_CACHE_SIZE = 1024
+# Maximum number of signature verification results to keep
+SIGNATURE_CACHE_SIZE = 100000
+# Range of the numbers a block can store (binary_codec encodes them as signed 64 bit numbers),
+# and of its idx and proof (encoded unsigned)
+MIN_NUMBER = -2 ** 63
+MAX_NUMBER = 2 ** 63 - 1
+MAX_UNSIGNED = 2 ** 64 - 1
+
+# (sender, signature, signed payload) -> whether the signature is valid, in least to most recently used order
+_signature_cache = OrderedDict()
+
+
+def _signature_cache_key(txn):
+    # The signature covers the sender, recipient and amount (see Wallet.sign_txn)
+    return txn.sender, txn.signature, str(txn.sender) + str(txn.recipient) + str(txn.amount)
+
+
+@lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
+def _txn_verifier(sender):
+    # Parsing the DER encoded key is relatively expensive, and the same senders sign many transactions
+    return PKCS1_v1_5.new(RSA.import_key(binascii.unhexlify(sender)))
 
 
 class Verification:
@@ -17,21 +52,52 @@ class Verification:
         # but output string for txns list includes escaped single quotes instead of double quotes.
         # This in turn leads to a different hash being calculated...so use json representation instead
         # - use of sort_keys ensures that dictionary serialization is always consistent
+        return Verification.is_pow_valid_for_prefix(Verification.pow_prefix(txns, prev_hash), pow, char, char_count)
+
+    @staticmethod
+    def pow_prefix(txns, prev_hash):
+        # The POW hash is calculated over '<txns json>:<prev_hash>:<pow>'.
+        # Everything up to the pow is fixed for a given block, so serialize and hash it only once
         ordered_txns = [txn.to_ordered_dict() for txn in txns]
-        pow_hash = calc_hash('{}:{}:{}'.format(json.dumps(ordered_txns, sort_keys=True), prev_hash, pow))
+        return calc_prefix_hash('{}:{}:'.format(json.dumps(ordered_txns, sort_keys=True), prev_hash))
+
+    @staticmethod
+    def is_pow_valid_for_prefix(prefix_hash, pow, char="0", char_count=3):
+        # Only the pow suffix is hashed on top of the precomputed prefix (see pow_prefix)
+        pow_hash = calc_hash_with_prefix(prefix_hash, str(pow))
         return pow_hash[0:char_count] == char * char_count
 
     @staticmethod
-    def is_block_chain_valid(block_chain):
-        # Start prev_idx at the second to last element
-        prev_idx = len(block_chain) - 2
+    def is_block_chain_valid(block_chain, start_idx=0, char_count=3, workers=1):
+        # Blocks before start_idx are trusted (i.e. they have already been verified).
+        # The block at start_idx is still checked against the hash of the block before it
+        invalid_block = Verification.find_invalid_block(block_chain, start_idx, len(block_chain), char_count, workers)
+        if invalid_block is not None:
+            block_idx, failed_check = invalid_block
+            print('ERROR: Block ' + str(block_idx) + ' failed ' + failed_check + ' validation')
+            return False
+
+        return True
+
+    @staticmethod
+    def find_invalid_block(block_chain, start_idx, end_idx, char_count=3, workers=1):
+        """
+        Check the blocks from end_idx - 1 back to start_idx, stopping at the first invalid block.
+
+        Long runs of blocks are checked in chunks across a pool of worker processes,
+        which reports the same invalid block as the serial check.
+
+        :return: a tuple of the invalid block's idx and the check it failed, or None if all the blocks are valid
+        """
+        if workers > 1 and end_idx - start_idx >= PARALLEL_VERIFICATION_MIN_BLOCKS:
+            return Verification.__find_invalid_block_parallel(block_chain, start_idx, end_idx, char_count, workers)
 
         # Use a reverse iterator over blockchain elements to process last block first
-        for block_to_check in reversed(block_chain):
+        for block_pos in reversed(range(start_idx, end_idx)):
+            block_to_check = block_chain[block_pos]
             # First element of current block must equal the entire previous block
-            if prev_idx >= 0 and (block_to_check.prev_hash != calc_hash(str(block_chain[prev_idx]))):
-                print('ERROR: Block ' + str(block_to_check.idx) + ' failed previous hash validation')
-                return False
+            if block_pos > 0 and (block_to_check.prev_hash != block_chain[block_pos - 1].hash):
+                return block_to_check.idx, 'previous hash'
 
             if not Verification.is_pow_valid(
                     # We have to exclude the reward txn when validating POW
@@ -40,39 +106,153 @@ class Verification:
                     # Use range selector to exclude last txn in list - which we know is the reward txn
                     block_to_check.txns[:-1],
                     block_to_check.prev_hash,
-                    block_to_check.proof):
-                print('ERROR: Block ' + str(block_to_check.idx) + ' failed POW validation')
-                return False
+                    block_to_check.proof,
+                    char_count=char_count):
+                return block_to_check.idx, 'POW'
 
-            prev_idx -= 1
+        return None
 
-        return True
+    @staticmethod
+    def __find_invalid_block_parallel(block_chain, start_idx, end_idx, char_count, workers):
+        # Split the blocks into chunks, several per worker so that the work stays balanced
+        chunk_size = -(-(end_idx - start_idx) // (workers * CHUNKS_PER_WORKER))
+        chunks = []
+        # Order the chunks last first so that the first failure found is the one the serial check would report
+        for chunk_start in reversed(range(start_idx, end_idx, chunk_size)):
+            chunk_end = min(chunk_start + chunk_size, end_idx)
+            # Include the preceding block so the chunk's first block can be checked against its hash
+            slice_start = chunk_start - 1 if chunk_start > 0 else 0
+            chunks.append((block_chain[slice_start:chunk_end], chunk_start - slice_start, char_count))
+
+        # The pool is shared and kept, so any chunks still being checked when an invalid block is found
+        # are left to finish (and their results ignored)
+        for invalid_block in shared_pool('verification', workers).imap(_find_invalid_block_in_chunk, chunks):
+            if invalid_block is not None:
+                return invalid_block
+
+        return None
 
     @staticmethod
-    def check_open_txn_funds_available(open_txns, get_balance, mining_identity):
+    def check_open_txn_funds_available(open_txns, get_balance, mining_identity, reward_txn=None):
         # Validate that each transaction sender has necessary funds to meet
         # their obligation when open transactions are netted.
+        # - the mempool keeps each participant's netted totals, so this is one comparison per participant
         # ...exclude the mining identity
-        ot_senders = set(txn.sender for txn in open_txns if txn.sender is not mining_identity)
-
-        for participant in ot_senders:
-            sent_total = sum([txn.amount for txn in open_txns if txn.sender == participant])
-            received_total = sum([txn.amount for txn in open_txns if txn.recipient == participant])
-            net_sent = sent_total - received_total
-            current_balance = get_balance(participant)
-            if current_balance < net_sent:
-                print('*** {} has an obligation of {:.2f}, but an available balance of only {:.2f}'
-                      .format(participant, net_sent, current_balance))
+        for participant in open_txns.participants():
+            if participant == mining_identity:
+                continue
+
+            net_sent = open_txns.net_sent(participant)
+            if reward_txn is not None and participant == reward_txn.recipient:
+                # The reward (which isn't an open transaction) counts towards the miner's funds
+                net_sent -= reward_txn.amount
+            if not Verification.is_obligation_covered(participant, net_sent, get_balance):
                 return False
 
         return True
 
+    @staticmethod
+    def is_number_valid(number):
+        # Transaction and block numbers arrive as JSON, so may be of any type, but must be storable (see binary_codec).
+        # A bool is an int in Python, so is ruled out explicitly
+        if isinstance(number, bool):
+            return False
+        elif isinstance(number, int):
+            return MIN_NUMBER <= number <= MAX_NUMBER
+        return isinstance(number, float) and math.isfinite(number)
+
+    @staticmethod
+    def is_amount_valid(amount):
+        return Verification.is_number_valid(amount) and amount > 0
+
+    @staticmethod
+    def is_txn_valid(txn):
+        # Can a block store the transaction? Its keys and signature must be strings and its numbers in range.
+        # (Its timestamp isn't signed, so anyone relaying it can change it)
+        return all(isinstance(field, str) for field in [txn.sender, txn.recipient, txn.signature]) and \
+            Verification.is_amount_valid(txn.amount) and Verification.is_number_valid(txn.timestamp)
+
+    @staticmethod
+    def are_block_numbers_valid(block):
+        # Blocks received as JSON may hold numbers that can't be stored (the proof of work only covers the transactions)
+        return all(isinstance(number, int) and not isinstance(number, bool) and 0 <= number <= MAX_UNSIGNED
+                   for number in [block.idx, block.proof]) and \
+            Verification.is_number_valid(block.timestamp) and all(Verification.is_txn_valid(txn) for txn in block.txns)
+
+    @staticmethod
+    def is_obligation_covered(participant, net_sent, get_balance):
+        current_balance = get_balance(participant)
+        if current_balance < net_sent:
+            print('*** {} has an obligation of {:.2f}, but an available balance of only {:.2f}'
+                  .format(participant, net_sent, current_balance))
+            return False
+
+        return True
+
     @staticmethod
     def is_txn_signature_valid(txn, mining_identity):
         if txn.sender == mining_identity:
             return True
 
-        public_key = RSA.import_key(binascii.unhexlify(txn.sender))
-        verifier = PKCS1_v1_5.new(public_key)
-        generated_hash = SHA256.new((str(txn.sender) + str(txn.recipient) + str(txn.amount)).encode('utf8'))
-        return verifier.verify(generated_hash, binascii.unhexlify(txn.signature))
+        # The same transaction is often verified several times (e.g. when it is gossiped back,
+        # reloaded or received in a block), so remember the outcome
+        cache_key = _signature_cache_key(txn)
+        if cache_key in _signature_cache:
+            _signature_cache.move_to_end(cache_key)
+            return _signature_cache[cache_key]
+
+        generated_hash = SHA256.new(cache_key[2].encode('utf8'))
+        try:
+            is_valid = _txn_verifier(txn.sender).verify(generated_hash, binascii.unhexlify(txn.signature))
+        except (TypeError, ValueError):
+            # The sender isn't a (hex) public key or the signature isn't hex, e.g. sent by a faulty peer
+            is_valid = False
+        Verification.__cache_signature_result(cache_key, is_valid)
+        return is_valid
+
+    @staticmethod
+    def are_txn_signatures_valid(txns, mining_identity, workers=1):
+        """
+        Verify the signatures of many transactions at once.
+
+        Large batches of transactions that haven't been verified before are split across a pool of worker processes.
+
+        :param txns: the transactions to verify
+        :param mining_identity: the sender of mining reward transactions (which aren't signed)
+        :param workers: the maximum number of worker processes to use
+        :return: a list holding whether each transaction's signature is valid
+        """
+        if workers > 1:
+            unverified_txns = [txn for txn in txns
+                               if txn.sender != mining_identity and _signature_cache_key(txn) not in _signature_cache]
+            if len(unverified_txns) >= PARALLEL_SIGNATURE_MIN_TXNS:
+                chunk_size = -(-len(unverified_txns) // (workers * CHUNKS_PER_WORKER))
+                chunks = [(unverified_txns[start:start + chunk_size], mining_identity)
+                          for start in range(0, len(unverified_txns), chunk_size)]
+                chunk_results = shared_pool('verification', workers).map(_are_txn_signatures_valid_in_chunk, chunks)
+
+                # Record the workers' results in this process's cache, so the loop below only does lookups
+                for (chunk_txns, _), results in zip(chunks, chunk_results):
+                    for txn, is_valid in zip(chunk_txns, results):
+                        Verification.__cache_signature_result(_signature_cache_key(txn), is_valid)
+
+        return [Verification.is_txn_signature_valid(txn, mining_identity) for txn in txns]
+
+    @staticmethod
+    def __cache_signature_result(cache_key, is_valid):
+        _signature_cache[cache_key] = is_valid
+        if len(_signature_cache) > SIGNATURE_CACHE_SIZE:
+            # Evict the least recently used result
+            _signature_cache.popitem(last=False)
+
+
+def _find_invalid_block_in_chunk(chunk):
+    # Runs in a worker process (so must be a module level function that can be pickled)
+    blocks, first_pos, char_count = chunk
+    return Verification.find_invalid_block(blocks, first_pos, len(blocks), char_count)
+
+
+def _are_txn_signatures_valid_in_chunk(chunk):
+    # Runs in a worker process (so must be a module level function that can be pickled)
+    txns, mining_identity = chunk
+    return [Verification.is_txn_signature_valid(txn, mining_identity) for txn in txns]
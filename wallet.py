@@ -17,6 +17,10 @@ class Wallet:
         self.private_key = None
         self.public_key = None
         self.__node_id = node_id
+        # Parsing the private key is far slower than signing with it, so the parsed signer is kept,
+        # along with the key it was parsed from (in case the keys are replaced)
+        self.__signer = None
+        self.__signer_private_key = None
 
     @staticmethod
     def generate_keys():
@@ -56,7 +60,10 @@ class Wallet:
             return False
 
     def sign_txn(self, sender, recipient, amount):
-        signer = PKCS1_v1_5.new(RSA.import_key(binascii.unhexlify(self.private_key)))
+        if self.__signer is None or self.__signer_private_key != self.private_key:
+            self.__signer = PKCS1_v1_5.new(RSA.import_key(binascii.unhexlify(self.private_key)))
+            self.__signer_private_key = self.private_key
+        signer = self.__signer
         generated_hash = SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf8'))
         signature = signer.sign(generated_hash)
         return binascii.hexlify(signature).decode('ascii')